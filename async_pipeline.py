@@ -0,0 +1,101 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import NEONIZE_EXECUTOR_WORKERS
+from intake_queue import PRIORITY_COMMAND, PRIORITY_MESSAGE
+from metrics import metrics
+
+# Bounded pool for blocking calls (neonize, file conversion) made from coroutines
+blocking_executor = ThreadPoolExecutor(max_workers=NEONIZE_EXECUTOR_WORKERS, thread_name_prefix="neonize")
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the bounded executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+class AsyncPipeline:
+    """
+    Runs an async handler on a dedicated event loop thread.
+    Items sharing a key are handled one at a time in submission order, and at most
+    `max_concurrency` items are in flight across all keys. At most `max_pending`
+    items may be waiting; commands bypass both limits.
+    """
+    def __init__(self, handler, max_concurrency, max_pending, name="async_pipeline"):
+        self.handler = handler
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._key_locks = {}  # key -> [asyncio.Lock, pending count]
+        self._in_flight = 0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def start(self):
+        ready = threading.Event()
+
+        def run_loop():
+            asyncio.set_event_loop(self.loop)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run_loop, name=self.name, daemon=True).start()
+        ready.wait()
+        logging.info(f"Started {self.name} event loop (max {self.max_concurrency} concurrent items).")
+
+    def submit(self, key: str, *args, priority=PRIORITY_MESSAGE, deadline=None):
+        """
+        Schedule `handler(*args)` from any thread.
+        Returns False if the item was shed because too many items are pending.
+        """
+        with self._pending_lock:
+            if self._pending >= self.max_pending and priority > PRIORITY_COMMAND:
+                metrics.inc(f"{self.name}.dropped.full")
+                return False
+            self._pending += 1
+            metrics.set_gauge(f"{self.name}.depth", self._pending)
+        asyncio.run_coroutine_threadsafe(self._handle(key, time.monotonic(), priority, deadline, args), self.loop)
+        return True
+
+    async def _handle(self, key, enqueued_at, priority, deadline, args):
+        # asyncio.Lock wakes waiters in FIFO order, which keeps per-key ordering
+        entry = self._key_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                if priority == PRIORITY_COMMAND:
+                    await self._run_item(enqueued_at, deadline, args)
+                else:
+                    async with self._semaphore:
+                        await self._run_item(enqueued_at, deadline, args)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._key_locks[key]
+
+    async def _run_item(self, enqueued_at, deadline, args):
+        with self._pending_lock:
+            self._pending -= 1
+            metrics.set_gauge(f"{self.name}.depth", self._pending)
+        metrics.observe(f"{self.name}.wait", time.monotonic() - enqueued_at)
+        if deadline is not None and time.time() > deadline:
+            metrics.inc(f"{self.name}.dropped.stale")
+            return
+        self._in_flight += 1
+        metrics.set_gauge(f"{self.name}.in_flight", self._in_flight)
+        try:
+            await self.handler(*args)
+        except Exception as e:
+            logging.error(f"Error in {self.name}: {e}")
+        finally:
+            self._in_flight -= 1
+            metrics.set_gauge(f"{self.name}.in_flight", self._in_flight)
+
+    def stats(self):
+        """Return the number of pending and in-flight items."""
+        return {"pending": self._pending, "in_flight": self._in_flight}
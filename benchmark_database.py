@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of message inserts and recent-window reads per second, comparing a
+new connection per call with the default rollback journal (how database.py used to
+work) against the shared per-thread WAL connections. Runs on temporary databases.
+
+    python benchmark_database.py --users 50 --inserts 5000 --reads 5000 --threads 4
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_connections import SQLiteConnections
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        message_content TEXT,
+        timestamp INTEGER,
+        from_me BOOLEAN,
+        UNIQUE(user_id, message_content, timestamp, from_me)
+    )
+"""
+INSERT = "INSERT INTO messages (user_id, message_content, timestamp, from_me) VALUES (?, ?, ?, ?)"
+RECENT = "SELECT message_content, timestamp, from_me FROM messages WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?"
+
+class ConnectPerCall:
+    def __init__(self, path):
+        self.path = path
+
+    def insert(self, row):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(INSERT, row)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def recent(self, user_id, limit):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute(RECENT, (user_id, limit)).fetchall()
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+class PerThreadWAL:
+    def __init__(self, path):
+        self.connections = SQLiteConnections(path)
+
+    def insert(self, row):
+        conn = self.connections.get()
+        with conn:
+            conn.execute(INSERT, row)
+
+    def recent(self, user_id, limit):
+        return self.connections.get().execute(RECENT, (user_id, limit)).fetchall()
+
+    def close(self):
+        self.connections.close_all()
+
+def _run(func, jobs, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(func, *job) for job in jobs]:
+            future.result()
+    return len(jobs) / (time.perf_counter() - started)
+
+def benchmark(name, store_class, options, directory):
+    path = os.path.join(directory, f"{name}.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(SCHEMA)
+    conn.commit()
+    conn.close()
+    store = store_class(path)
+    users = [f"user{i}@s.whatsapp.net" for i in range(options.users)]
+    inserts = [((random.choice(users), f"Message {i} " + "x" * random.randint(10, 400), 1700000000 + i, i % 2),) for i in range(options.inserts)]
+    reads = [(random.choice(users), options.window) for _ in range(options.reads)]
+    insert_rate = _run(store.insert, inserts, options.threads)
+    read_rate = _run(store.recent, reads, options.threads)
+    store.close()
+    print(f"{name:<18} {insert_rate:>10.0f} inserts/s {read_rate:>10.0f} reads/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--inserts", type=int, default=5000)
+    parser.add_argument("--reads", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=10, help="messages per recent-window read")
+    parser.add_argument("--threads", type=int, default=4)
+    options = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark("connect per call", ConnectPerCall, options, directory)
+        benchmark("per-thread WAL", PerThreadWAL, options, directory)
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,181 @@ SCENARIO = os.getenv("SCENARIO", "base")
 
 OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-4.1-mini-2025-04-14")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Any OpenAI-compatible endpoint, e.g. a local mock server; unset for api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 
 CONV_DB_PATH = "db/conversations.sqlite3"
 NEO_DB_PATH = "db/neonize.sqlite3"
+SESSION_DB_PATH = "db/sessions.sqlite3"
 MAX_MESSAGES = 10
+# Message bodies of at least this many bytes are stored compressed
+MESSAGE_COMPRESS_BYTES = 1024
+# Saved messages are committed in the background, up to MESSAGE_WRITE_BATCH rows
+# per transaction, waiting up to MESSAGE_WRITE_INTERVAL seconds for more
+MESSAGE_WRITE_BATCH = 100
+MESSAGE_WRITE_INTERVAL = 0.01
+# Every RETENTION_INTERVAL seconds, messages beyond each user's newest
+# RETENTION_MAX_MESSAGES or older than RETENTION_MAX_AGE_DAYS are moved to
+# compressed per-user archives in ARCHIVE_DIR (0 disables a limit), and up to
+# RETENTION_VACUUM_PAGES free pages are returned to the file system
+RETENTION_MAX_MESSAGES = 5000
+RETENTION_MAX_AGE_DAYS = 365
+RETENTION_INTERVAL = 3600
+RETENTION_VACUUM_PAGES = 2000
+ARCHIVE_DIR = "db/archive"
 SKIP_HISTORY_SYNC = True
+# Messages inserted per transaction when importing a history sync
+HISTORY_IMPORT_BATCH = 5000
 SCRAPE_USER_LINKS = False
-DOWNLOAD_USER_FILES = False
\ No newline at end of file
+DOWNLOAD_USER_FILES = False
+
+# "threaded": a pool of worker threads, "async": one asyncio event loop
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "threaded")
+
+# Number of message worker threads; messages are sharded by chat
+MESSAGE_WORKERS = 4
+
+# Max messages waiting to be processed; beyond this users get a busy reply
+INTAKE_QUEUE_SIZE = 200
+# Messages older than this many seconds are not answered
+MESSAGE_MAX_AGE = 60
+# Min seconds between busy replies to the same chat
+BUSY_REPLY_INTERVAL = 60
+
+# Consecutive messages from one chat arriving within DEBOUNCE_WINDOW seconds of each
+# other are answered in one turn (0 disables), flushed after DEBOUNCE_MAX_WAIT at most
+DEBOUNCE_WINDOW = 2.0
+DEBOUNCE_MAX_WAIT = 8.0
+DEBOUNCE_MAX_MESSAGES = 10
+
+# Async mode: max concurrently processed conversations and blocking-call threads
+ASYNC_MAX_CONCURRENCY = 200
+NEONIZE_EXECUTOR_WORKERS = 16
+
+# Session content (links, documents, image descriptions) kept in memory per user
+# and in total; the rest stays on disk. Idle users are dropped from memory after
+# SESSION_IDLE_TTL seconds and their content is deleted after SESSION_DISK_TTL.
+SESSION_USER_BYTES = 512 * 1024
+SESSION_GLOBAL_BYTES = 64 * 1024 * 1024
+SESSION_IDLE_TTL = 30 * 60
+SESSION_DISK_TTL = 30 * 24 * 3600
+
+# Session content beyond RETRIEVAL_TOKEN_BUDGET tokens is chunked and only the
+# RETRIEVAL_TOP_K chunks most relevant to the message are sent (BM25, blended with
+# local vector similarity when RETRIEVAL_VECTOR_WEIGHT > 0)
+RETRIEVAL_TOKEN_BUDGET = 3000
+RETRIEVAL_TOP_K = 8
+RETRIEVAL_CHUNK_WORDS = 150
+RETRIEVAL_CHUNK_OVERLAP = 30
+RETRIEVAL_VECTOR_WEIGHT = 0.0
+
+# Send the final prompt and the tools in one request instead of polling for tools
+# first; the model may request tools for up to this many rounds before answering
+SINGLE_ROUND_TRIP = os.getenv("SINGLE_ROUND_TRIP", "false").lower() == "true"
+SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS = 2
+
+# Offer every scenario a tool for full-text search of the user's older messages,
+# returning up to SEARCH_HISTORY_RESULTS matches
+SEARCH_HISTORY_TOOL = os.getenv("SEARCH_HISTORY_TOOL", "false").lower() == "true"
+SEARCH_HISTORY_RESULTS = 5
+
+# Default per-tool timeout in seconds and threads for running tool calls in parallel
+TOOL_TIMEOUT = 60
+TOOL_MAX_WORKERS = 16
+
+# Raw incoming messages are journaled in gzip segments of about this size
+JOURNAL_DIR = "journal"
+JOURNAL_SEGMENT_BYTES = 16 * 1024 * 1024
+
+METRICS_PATH = "metrics.json"
+METRICS_REPORT_INTERVAL = 60  # seconds
+
+# Local intent pre-classifier in front of the tool-poll call. Decisions below the
+# confidence threshold are left to the LLM; a share of confident decisions is also
+# checked against the LLM to measure disagreement. The n-gram model is trained from
+# tool-poll samples in the file log and is only used once it has enough of them.
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "true").lower() == "true"
+INTENT_CONFIDENCE_THRESHOLD = 0.9
+INTENT_SHADOW_RATE = 0.05
+INTENT_MIN_SAMPLES = 50
+INTENT_TRAINING_LOG = "filelogger.log"
+
+# Wait/error/busy phrases per detected language; languages without built-in
+# phrases are generated once by the LLM and persisted here
+PHRASES_PATH = "db/phrases.json"
+PHRASE_VARIATIONS = 3
+
+# Cache for LLM completions and tool polls: "memory", "sqlite" or "off". Entries
+# expire after RESPONSE_CACHE_TTL seconds and the least recently used beyond
+# RESPONSE_CACHE_MAX_ENTRIES are evicted. With RESPONSE_CACHE_SEMANTIC_THRESHOLD
+# above 0, completions for similar messages (cosine similarity of local
+# embeddings) under the same prompt are reused as well.
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_PATH = "db/response_cache.sqlite3"
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+RESPONSE_CACHE_SEMANTIC_THRESHOLD = 0.0
+
+# Total seconds per OpenAI call type, retries included. Rate limits and server
+# errors are retried with jittered exponential backoff. Call types listed in
+# OPENAI_HEDGE_KINDS send a second request once the first exceeds the p95
+# latency of the last calls. After OPENAI_BREAKER_FAILURES consecutive failed calls,
+# calls fail fast for OPENAI_BREAKER_RESET seconds and fallback replies are used.
+OPENAI_DEADLINES = {
+    "completion": 45,
+    "tool_poll": 20,
+    "vision": 45,
+    "transcription": 60,
+    "tts": 45,
+    "image": 120,
+    "summary": 60,
+}
+OPENAI_MAX_RETRIES = 3
+OPENAI_BACKOFF_BASE = 0.5
+OPENAI_BACKOFF_CAP = 8
+OPENAI_HEDGE_KINDS = ()
+OPENAI_HEDGE_MIN_SAMPLES = 20
+OPENAI_BREAKER_FAILURES = 5
+OPENAI_BREAKER_RESET = 30
+
+# Token budgets for the final prompt. Each section is cut to its own budget, and
+# if the prompt is still over PROMPT_TOKEN_BUDGET, sections later in
+# PROMPT_SECTION_PRIORITY are shortened or omitted first. History keeps the newest
+# messages that fit (at most PROMPT_HISTORY_MAX_MESSAGES), each cut to
+# PROMPT_HISTORY_MESSAGE_TOKENS.
+PROMPT_TOKEN_BUDGET = 8000
+PROMPT_SECTION_BUDGETS = {
+    "tool_usage_result": 2500,
+    "previous_messages": 2500,
+    "scraped_text": 3000,
+}
+PROMPT_SECTION_PRIORITY = ("tool_usage_result", "previous_messages", "scraped_text")
+PROMPT_HISTORY_MAX_MESSAGES = 50
+PROMPT_HISTORY_MESSAGE_TOKENS = 400
+
+# Rolling conversation summaries: once SUMMARY_BATCH_MESSAGES messages have built
+# up beyond the newest SUMMARY_TAIL_MESSAGES, a background thread folds them into
+# the user's summary; prompts get the summary plus the messages after it
+SUMMARY_BATCH_MESSAGES = 20
+SUMMARY_TAIL_MESSAGES = 8
+SUMMARY_INPUT_TOKENS = 8000
+
+# Recent history of the HISTORY_CACHE_USERS most recently active users is kept in
+# memory, enough messages for both the tool poll and the final prompt
+HISTORY_CACHE_USERS = 1000
+HISTORY_CACHE_MESSAGES = max(MAX_MESSAGES, PROMPT_HISTORY_MAX_MESSAGES)
+
+# SQLite connection settings: seconds to wait for a lock, page cache and memory-mapped
+# I/O sizes, and prepared statements kept per connection
+SQLITE_BUSY_TIMEOUT = 5
+SQLITE_CACHE_SIZE_KB = 16 * 1024
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+SQLITE_STATEMENT_CACHE = 128
+
+# Scraped pages are cached on disk by normalized URL. Entries are fresh for as long
+# as Cache-Control or Expires allow, else SCRAPE_CACHE_TTL seconds, and are then
+# revalidated with conditional requests; the least recently used are evicted beyond
+# SCRAPE_CACHE_MAX_BYTES of text (0 disables the cache)
+SCRAPE_CACHE_PATH = "db/scrape_cache.sqlite3"
+SCRAPE_CACHE_TTL = 6 * 3600
+SCRAPE_CACHE_MAX_BYTES = 50 * 1024 * 1024
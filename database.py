@@ -1,80 +1,512 @@
+import hashlib
+import queue
+import re
 import sqlite3
-from config import CONV_DB_PATH, MAX_MESSAGES
+import threading
+import time
+import zlib
+from config import (
+    CONV_DB_PATH,
+    MAX_MESSAGES,
+    MESSAGE_COMPRESS_BYTES,
+    MESSAGE_WRITE_BATCH,
+    MESSAGE_WRITE_INTERVAL,
+    HISTORY_CACHE_USERS,
+    HISTORY_CACHE_MESSAGES
+)
+from history_cache import HistoryCache
+from sqlite_connections import SQLiteConnections
+from metrics import metrics
 from neonize.utils import log
 
+SCHEMA_VERSION = 1
+
+# Set by init_db: whether SQLite supports the FTS5 message index
+search_available = False
+
+# Messages are deduplicated on a 16-byte hash of their content instead of the full
+# text. The unique index starts with (user_id, timestamp), so it also serves the
+# recent-history queries. Bodies of MESSAGE_COMPRESS_BYTES or more are stored
+# zlib-compressed as BLOBs; shorter ones stay TEXT.
+MESSAGES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        message_content,
+        timestamp INTEGER,
+        from_me BOOLEAN,
+        content_hash BLOB
+    )
+"""
+MESSAGES_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp, from_me, content_hash)"
+
+def _content_hash(message_content):
+    return hashlib.blake2b(message_content.encode("utf-8"), digest_size=16).digest()
+
+def _encode(message_content):
+    data = message_content.encode("utf-8")
+    if len(data) < MESSAGE_COMPRESS_BYTES:
+        return message_content
+    return zlib.compress(data)
+
+def _decode(message_content):
+    if isinstance(message_content, bytes):
+        return zlib.decompress(message_content).decode("utf-8")
+    return message_content
+
+def _decoded(rows, content_index=0):
+    return [row[:content_index] + (_decode(row[content_index]),) + row[content_index + 1:] for row in rows]
+
+def _setup_connection(conn):
+    # Lets SQL, such as the search index triggers, read compressed bodies
+    conn.create_function("message_text", 1, _decode, deterministic=True)
+
+# Per-thread connections, reused across calls
+db_connections = SQLiteConnections(CONV_DB_PATH, setup=_setup_connection)
+
+def _migrate_messages(conn):
+    """
+    Rewrite a version 0 messages table, deduplicated on the full text, into the
+    current schema. Ids are kept, so summaries still point at the right messages.
+    """
+    count = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    log.info(f"Migrating {count} messages to the hashed and compressed schema...")
+    conn.execute("BEGIN")
+    try:
+        conn.execute(MESSAGES_SCHEMA.format(table="messages_v1"))
+        rows = conn.execute("SELECT id, user_id, message_content, timestamp, from_me FROM messages ORDER BY id")
+        while True:
+            batch = rows.fetchmany(1000)
+            if not batch:
+                break
+            conn.executemany("""
+                INSERT INTO messages_v1 (id, user_id, message_content, timestamp, from_me, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (id_, user_id, _encode(content or ""), timestamp, from_me, _content_hash(content or ""))
+                for id_, user_id, content, timestamp, from_me in batch
+            ])
+        conn.execute("DROP TABLE messages")
+        conn.execute("ALTER TABLE messages_v1 RENAME TO messages")
+        conn.execute(MESSAGES_INDEX)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.execute("VACUUM")
+    log.info("Message migration done.")
+
 def init_db():
-    """Initialize the SQLite database with a unique constraint."""
-    conn = sqlite3.connect(CONV_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            message_content TEXT,
-            timestamp INTEGER,
-            from_me BOOLEAN,
-            UNIQUE(user_id, message_content, timestamp, from_me)
+    """Initialize the SQLite database, migrating older message tables in place."""
+    conn = db_connections.get()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    has_messages = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'").fetchone()
+    if has_messages and version < 1:
+        _migrate_messages(conn)
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        # Lets retention hand freed pages back to the file system a few at a time
+        log.info("Enabling incremental vacuum on the conversation database...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.execute(MESSAGES_SCHEMA.format(table="messages"))
+    conn.execute(MESSAGES_INDEX)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            user_id TEXT PRIMARY KEY,
+            summary TEXT,
+            last_message_id INTEGER,
+            updated_at INTEGER
         )
     """)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
+    _init_search_index(conn)
+
+def _init_search_index(conn):
+    """
+    Create the FTS5 index over message text, kept in sync by triggers, and fill it
+    from existing messages the first time. Search is disabled if SQLite lacks FTS5.
+    """
+    global search_available
+    has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                message_content, user_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        log.warning(f"Full-text search over messages is unavailable: {e}")
+        search_available = False
+        return
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message_content, user_id)
+            VALUES (new.id, message_text(new.message_content), new.user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            DELETE FROM messages_fts WHERE rowid = old.id;
+        END
+    """)
+    if not has_index:
+        log.info("Indexing existing messages for full-text search...")
+        conn.execute("""
+            INSERT INTO messages_fts (rowid, message_content, user_id)
+            SELECT id, message_text(message_content), user_id FROM messages
+        """)
+    conn.commit()
+    search_available = True
+
+class MessageWriter:
+    """
+    Write-behind for save_message. Messages get their id right away and are queued;
+    a background thread inserts whatever has queued up in one transaction, at most
+    `batch_size` rows at a time, after waiting up to `interval` seconds for more.
+    `flush` waits until everything queued before it is committed, so reads from the
+    database see the newest messages. Until `start` is called, messages are written
+    synchronously. Rows the database skips as duplicates, or fails to store, are
+    dropped from the history cache once their batch is done.
+    """
+    def __init__(self, batch_size=MESSAGE_WRITE_BATCH, interval=MESSAGE_WRITE_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._next_id = None
+        self._lock = threading.Lock()
+        self._queued = set()  # (user_id, message_content, timestamp, from_me) not yet committed
+        self._thread = None
+
+    def start(self):
+        conn = db_connections.get()
+        self._next_id = conn.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").fetchone()
+        self._next_id = max(self._next_id, sequence[0] if sequence else 0)
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def allocate_ids(self, count=1):
+        """Reserve `count` consecutive message ids; returns the first."""
+        with self._lock:
+            first = self._next_id + 1
+            self._next_id += count
+            return first
+
+    def write(self, row):
+        """
+        Queue an (id, user_id, message_content, timestamp, from_me) row. Returns False,
+        without queuing it, if the same message is already waiting to be committed.
+        """
+        with self._lock:
+            if row[1:] in self._queued:
+                return False
+            self._queued.add(row[1:])
+        self._queue.put(row)
+        metrics.set_gauge("message_writer.pending", self._queue.qsize())
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every message queued so far is committed."""
+        if not self.running:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout=10):
+        """Commit what's queued and stop the writer thread, e.g. on shutdown."""
+        if not self.running:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            rows, barriers, stopping = [], [], False
+            deadline = time.monotonic() + self.interval
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    barriers.append(item)
+                else:
+                    rows.append(item)
+                if stopping or len(rows) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            if rows:
+                self._insert(rows)
+                with self._lock:
+                    self._queued.difference_update(row[1:] for row in rows)
+            for barrier in barriers:
+                barrier.set()
+            if stopping:
+                return
+
+    def _insert(self, rows):
+        started = time.monotonic()
+        for attempt in range(3):
+            try:
+                inserted = _insert_messages(rows)
+                break
+            except sqlite3.Error as e:
+                log.error(f"Failed to write {len(rows)} messages (attempt {attempt + 1}): {e}")
+                time.sleep(0.5 * (attempt + 1))
+        else:
+            metrics.inc("message_writer.dropped", len(rows))
+            self._uncache(rows)
+            return
+        if inserted < len(rows):
+            # Redelivered messages already on disk were skipped; their allocated ids don't exist
+            conn = db_connections.get()
+            ids = [row[0] for row in rows]
+            stored = {id_ for id_, in conn.execute(f"SELECT id FROM messages WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+            self._uncache([row for row in rows if row[0] not in stored])
+        metrics.inc("message_writer.batches")
+        metrics.inc("message_writer.rows", len(rows))
+        metrics.observe("message_writer.commit", time.monotonic() - started)
+
+    def _uncache(self, rows):
+        for id_, user_id, _, _, _ in rows:
+            history_cache.discard(user_id, id_)
+
+def _insert_messages(rows):
+    """
+    Insert (id, user_id, message_content, timestamp, from_me) rows in one transaction,
+    skipping duplicates; an id of None is assigned by SQLite. Returns the number inserted.
+    """
+    conn = db_connections.get()
+    with conn:
+        cursor = conn.executemany("""
+            INSERT OR IGNORE INTO messages (id, user_id, message_content, timestamp, from_me, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (id_, user_id, _encode(message_content), timestamp, from_me, _content_hash(message_content))
+            for id_, user_id, message_content, timestamp, from_me in rows
+        ])
+    if cursor.rowcount < len(rows):
+        log.debug(f"Skipped {len(rows) - cursor.rowcount} messages that already exist.")
+    return cursor.rowcount
+
+message_writer = MessageWriter()
 
 def save_message(user_id, message_content, timestamp, from_me):
     """Insert a message into the DB if it doesn't already exist."""
-    conn = sqlite3.connect(CONV_DB_PATH)
-    cursor = conn.cursor()
+    if message_writer.running:
+        row = (message_writer.allocate_ids(), user_id, message_content, timestamp, from_me)
+        if message_writer.write(row):
+            history_cache.add(user_id, row[:1] + row[2:])
+        else:
+            log.debug(f"Message already queued for user {user_id}: {message_content}")
+        return
+    conn = db_connections.get()
     try:
-        cursor.execute("""
-            INSERT INTO messages (user_id, message_content, timestamp, from_me)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, message_content, timestamp, from_me))
-        conn.commit()
+        with conn:
+            cursor = conn.execute("""
+                INSERT INTO messages (user_id, message_content, timestamp, from_me, content_hash)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, _encode(message_content), timestamp, from_me, _content_hash(message_content)))
+        history_cache.add(user_id, (cursor.lastrowid, message_content, timestamp, from_me))
     except sqlite3.IntegrityError:
         log.debug(f"Message already exists for user {user_id}: {message_content}")
     except Exception as e:
         log.error(f"Failed to save message for user {user_id}: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
 
-def get_messages(user_id):
-    """Retrieve all messages for a particular user_id."""
-    conn = sqlite3.connect(CONV_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+def import_messages(rows):
+    """
+    Bulk insert (user_id, message_content, timestamp, from_me) rows, e.g. from a
+    history sync, in one transaction. Returns the number of new messages.
+    """
+    if not rows:
+        return 0
+    first_id = message_writer.allocate_ids(len(rows)) if message_writer.running else None
+    ids = range(first_id, first_id + len(rows)) if first_id is not None else [None] * len(rows)
+    inserted = _insert_messages([(id_,) + tuple(row) for id_, row in zip(ids, rows)])
+    # Imported messages may be older than cached ones, so cached users are reloaded
+    for user_id in {row[0] for row in rows}:
+        history_cache.invalidate(user_id)
+    return inserted
+
+def get_messages(user_id, batch_size=500):
+    """Yield all messages for a particular user_id, oldest first, reading `batch_size` rows at a time."""
+    message_writer.flush()
+    cursor = db_connections.get().execute("""
         SELECT message_content, timestamp, from_me
         FROM messages
         WHERE user_id = ?
         ORDER BY timestamp
     """, (user_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from _decoded(rows)
+    finally:
+        cursor.close()
 
-def get_recent_messages(user_id):
+def get_recent_messages(user_id, limit=MAX_MESSAGES):
     """
-    Retrieve the most recent `max_messages` for a particular user_id, ordered oldest to newest.
+    Retrieve the most recent `limit` messages for a particular user_id, ordered oldest to newest.
     """
-    conn = sqlite3.connect(CONV_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f"""
+    cached = history_cache.recent(user_id, limit)
+    if cached is not None:
+        return cached
+    message_writer.flush()
+    results = db_connections.get().execute("""
         SELECT message_content, timestamp, from_me
         FROM messages
         WHERE user_id = ?
         ORDER BY timestamp DESC
         LIMIT ?
-    """, (user_id, MAX_MESSAGES))
-    results = cursor.fetchall()
-    conn.close()
-    return results[::-1]
+    """, (user_id, limit)).fetchall()
+    return _decoded(results[::-1])
 
 def delete_messages(user_id):
     """Delete all messages for the specified user_id from the database."""
-    conn = sqlite3.connect(CONV_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    message_writer.flush()
+    conn = db_connections.get()
+    with conn:
+        conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM conversation_summaries WHERE user_id = ?", (user_id,))
+    history_cache.invalidate(user_id)
+
+def _read_summary(conn, user_id):
+    row = conn.execute("SELECT summary, last_message_id FROM conversation_summaries WHERE user_id = ?", (user_id,)).fetchone()
+    return row if row else (None, 0)
+
+def get_summary(user_id):
+    """Returns (summary, id of the last summarized message), or (None, 0) if there is none yet."""
+    return history_cache.summary(user_id)
+
+def save_summary(user_id, summary, last_message_id):
+    conn = db_connections.get()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO conversation_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, strftime('%s', 'now'))
+        """, (user_id, summary, last_message_id))
+    history_cache.set_summary(user_id, summary, last_message_id)
+
+def get_messages_after(user_id, message_id, limit=-1):
+    """
+    Retrieve up to `limit` of the newest messages with an id above `message_id`,
+    ordered oldest to newest, as (id, message_content, timestamp, from_me).
+    """
+    message_writer.flush()
+    results = db_connections.get().execute("""
+        SELECT id, message_content, timestamp, from_me
+        FROM messages
+        WHERE user_id = ? AND id > ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, (user_id, message_id, limit)).fetchall()
+    return _decoded(results[::-1], 1)
+
+def get_conversation_context(user_id, limit=MAX_MESSAGES):
+    """
+    The rolling summary of older messages and the recent messages not yet in it:
+    (summary or None, [(message_content, timestamp, from_me), ...] oldest to newest).
+    """
+    cached = history_cache.context(user_id, limit)
+    if cached is not None:
+        return cached
+    summary, last_message_id = get_summary(user_id)
+    rows = get_messages_after(user_id, last_message_id, limit)
+    return summary, [row[1:] for row in rows]
+
+def _search_query(text):
+    """Free text as an FTS5 query matching any of its words, so user input can't break the syntax."""
+    words = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{word}"' for word in words)
+
+def search_messages(query, user_id=None, limit=10):
+    """
+    Full-text search of stored messages, best matches first, optionally for one user.
+    Returns (id, user_id, snippet, timestamp, from_me) rows; empty if search is unavailable.
+    """
+    match = _search_query(query)
+    if not search_available or not match:
+        return []
+    message_writer.flush()
+    rows = db_connections.get().execute(f"""
+        SELECT m.id, m.user_id, snippet(messages_fts, 0, '', '', '...', 24), m.timestamp, m.from_me
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? {"AND messages_fts.user_id = ?" if user_id is not None else ""}
+        ORDER BY rank
+        LIMIT ?
+    """, (match, user_id, limit) if user_id is not None else (match, limit)).fetchall()
+    metrics.inc("search.queries")
+    return rows
+
+def get_retention_users(max_messages, cutoff):
+    """Users with more than `max_messages` messages (0 for no cap) or any message older than `cutoff`."""
+    message_writer.flush()
+    return [row[0] for row in db_connections.get().execute("""
+        SELECT user_id
+        FROM messages
+        GROUP BY user_id
+        HAVING (? > 0 AND COUNT(*) > ?) OR MIN(timestamp) < ?
+    """, (max_messages, max_messages, cutoff))]
+
+def get_expired_messages(user_id, max_messages, cutoff):
+    """
+    The user's messages older than `cutoff` or beyond their newest `max_messages`,
+    oldest first, as (id, message_content, timestamp, from_me).
+    """
+    rows = db_connections.get().execute("""
+        SELECT id, message_content, timestamp, from_me
+        FROM messages
+        WHERE user_id = ? AND (timestamp < ? OR id IN (
+            SELECT id FROM messages
+            WHERE user_id = ? AND ? > 0
+            ORDER BY timestamp DESC, id DESC
+            LIMIT -1 OFFSET ?
+        ))
+        ORDER BY timestamp, id
+    """, (user_id, cutoff, user_id, max_messages, max_messages)).fetchall()
+    return _decoded(rows, 1)
+
+def delete_message_ids(user_id, message_ids):
+    """Delete the given messages of one user in a single transaction."""
+    conn = db_connections.get()
+    with conn:
+        conn.executemany("DELETE FROM messages WHERE id = ?", [(id_,) for id_ in message_ids])
+    history_cache.invalidate(user_id)
+
+def incremental_vacuum(pages):
+    """Return up to `pages` free pages to the file system; returns the (page_count, freelist_count) after."""
+    conn = db_connections.get()
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return conn.execute("PRAGMA page_count").fetchone()[0], conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def _load_history(user_id, limit):
+    """The newest `limit` messages with ids and the summary, read for the history cache."""
+    message_writer.flush()
+    conn = db_connections.get()
+    rows = conn.execute("""
+        SELECT id, message_content, timestamp, from_me
+        FROM messages
+        WHERE user_id = ?
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, (user_id, limit)).fetchall()
+    return _decoded(rows, 1), _read_summary(conn, user_id)
+
+# Recent history of active users; saves, summaries and deletes above write through to it
+history_cache = HistoryCache(_load_history, HISTORY_CACHE_MESSAGES, HISTORY_CACHE_USERS)
 
 def get_recent_messages_formatted(user_id):
     conversation_history = get_recent_messages(user_id)
@@ -0,0 +1,70 @@
+import logging
+import threading
+import time
+from metrics import metrics
+
+class MessageDebouncer:
+    """
+    Collects consecutive items per key and hands them to `flush(key, items)` as one
+    batch once the key has been quiet for `window` seconds. A batch is flushed early
+    when it is `max_wait` seconds old or holds `max_items` items, or on `flush_now`.
+    """
+    def __init__(self, flush, window, max_wait, max_items, name="debounce"):
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self.max_items = max_items
+        self.name = name
+        self._batches = {}  # key -> {"first": monotonic, "due": monotonic, "items": [...]}
+        self._cond = threading.Condition()
+        # Held while batches are taken and flushed, so flush_now can't overtake a
+        # batch the flushing thread has already taken
+        self._flush_lock = threading.Lock()
+
+    def add(self, key, item):
+        with self._cond:
+            now = time.monotonic()
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = {"first": now, "items": []}
+            batch["items"].append(item)
+            batch["due"] = min(now + self.window, batch["first"] + self.max_wait)
+            if len(batch["items"]) >= self.max_items:
+                batch["due"] = now
+            self._cond.notify()
+
+    def start(self):
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def flush_now(self, key):
+        """Flush the key's pending batch, if any, before returning."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._batches.pop(key, None)
+            if batch is not None:
+                self._flush(key, batch["items"])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if any(batch["due"] <= now for batch in self._batches.values()):
+                        break
+                    timeout = min((batch["due"] for batch in self._batches.values()), default=None)
+                    self._cond.wait(None if timeout is None else timeout - now)
+            with self._flush_lock:
+                with self._cond:
+                    now = time.monotonic()
+                    ready = [key for key, batch in self._batches.items() if batch["due"] <= now]
+                    flushed = [(key, self._batches.pop(key)["items"]) for key in ready]
+                for key, items in flushed:
+                    self._flush(key, items)
+
+    def _flush(self, key, items):
+        metrics.inc(f"{self.name}.batches")
+        metrics.inc(f"{self.name}.coalesced_items", len(items) - 1)
+        try:
+            self.flush(key, items)
+        except Exception as e:
+            logging.error(f"Error flushing {self.name} batch for {key}: {e}")
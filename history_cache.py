@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from metrics import metrics
+
+class _History:
+    __slots__ = ("rows", "complete", "summary")
+
+    def __init__(self, rows, complete, summary):
+        self.rows = rows  # (id, message_content, timestamp, from_me), oldest to newest
+        self.complete = complete  # whether rows hold every message of the user
+        self.summary = summary  # (summary or None, id of the last summarized message)
+
+class HistoryCache:
+    """
+    The newest `capacity` messages and the rolling summary of recently active users,
+    kept in memory so history reads on the reply path don't touch SQLite. A user's
+    history is loaded once with `loader(user_id, capacity)`, which returns
+    (rows, (summary, last_message_id)); after that, new messages and summaries are
+    written through. The least recently used users beyond `max_users` are dropped.
+    """
+    def __init__(self, loader, capacity, max_users):
+        self.loader = loader
+        self.capacity = capacity
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> _History
+        # Also held while loading, so a message saved meanwhile is either in the
+        # loaded rows or added after them
+        self._lock = threading.RLock()
+
+    def _history(self, user_id):
+        history = self._users.get(user_id)
+        if history is not None:
+            self._users.move_to_end(user_id)
+            metrics.inc("history_cache.hits")
+            return history
+        metrics.inc("history_cache.misses")
+        rows, summary = self.loader(user_id, self.capacity)
+        history = _History(sorted(rows, key=self._order), len(rows) < self.capacity, summary)
+        self._users[user_id] = history
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        metrics.set_gauge("history_cache.users", len(self._users))
+        return history
+
+    @staticmethod
+    def _order(row):
+        return row[2], row[0]
+
+    def recent(self, user_id, limit):
+        """
+        The newest `limit` messages as (message_content, timestamp, from_me), oldest
+        to newest, or None if more than the cached number of messages is asked for.
+        """
+        if limit > self.capacity:
+            return None
+        with self._lock:
+            rows = self._history(user_id).rows[-limit:] if limit > 0 else []
+        return [row[1:] for row in rows]
+
+    def context(self, user_id, limit):
+        """
+        The summary and up to `limit` of the newest messages after it, as in
+        database.get_conversation_context, or None if the cached rows may not hold them all.
+        """
+        with self._lock:
+            history = self._history(user_id)
+            summary, last_message_id = history.summary
+            rows = [row for row in history.rows if row[0] > last_message_id]
+            # Enough rows, or the cache reaches back to messages already in the summary
+            covered = history.complete or len(rows) < len(history.rows) or 0 < limit <= len(rows)
+        if not covered:
+            return None
+        if limit > 0:
+            rows = rows[-limit:]
+        return summary, [row[1:] for row in rows]
+
+    def summary(self, user_id):
+        with self._lock:
+            return self._history(user_id).summary
+
+    def add(self, user_id, row):
+        """Write through a newly saved message; users not in the cache are left alone."""
+        with self._lock:
+            history = self._users.get(user_id)
+            # Skip a row already loaded from disk, or a duplicate the database ignores
+            if history is None or any(cached[0] == row[0] or cached[1:] == row[1:] for cached in history.rows):
+                return
+            history.rows.append(row)
+            if len(history.rows) > 1 and self._order(history.rows[-2]) > self._order(row):
+                history.rows.sort(key=self._order)
+            if len(history.rows) > self.capacity:
+                del history.rows[:-self.capacity]
+                history.complete = False
+
+    def discard(self, user_id, message_id):
+        """Drop a written-through message the database didn't store."""
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is None or not any(row[0] == message_id for row in history.rows):
+                return
+            if history.complete:
+                history.rows = [row for row in history.rows if row[0] != message_id]
+            else:
+                # It may have pushed an older message out of the cache; reload instead
+                self._users.pop(user_id, None)
+
+    def set_summary(self, user_id, summary, last_message_id):
+        with self._lock:
+            history = self._users.get(user_id)
+            if history is not None:
+                history.summary = (summary, last_message_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
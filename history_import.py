@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+from neonize.utils import log
+from config import HISTORY_IMPORT_BATCH
+from database import import_messages
+from metrics import metrics
+
+def iter_history_messages(history):
+    """
+    Yield (user_id, message_content, timestamp, from_me) for every text message in a
+    HistorySyncEv, one at a time; messages without text are skipped.
+    """
+    for conversation in history.Data.conversations:
+        user_id = conversation.ID.split('@')[0]  # e.g. phone number
+        for message_obj in conversation.messages:
+            message_data = message_obj.message
+            msg = message_data.message
+            # Extract text from different possible fields
+            if hasattr(msg, "conversation") and msg.conversation:
+                message_content = msg.conversation
+            elif hasattr(msg, "extendedTextMessage") and msg.extendedTextMessage.text:
+                message_content = msg.extendedTextMessage.text
+            else:
+                continue
+            yield user_id, message_content, message_data.messageTimestamp, getattr(message_data.key, "fromMe", False)
+
+class HistoryImporter:
+    """
+    Imports history sync events on a background thread, so the Neonize callback
+    returns at once. Messages are streamed out of each event and inserted
+    `batch_size` at a time in one transaction each, skipping those already stored;
+    progress and rows per second are logged after every batch.
+    """
+    def __init__(self, batch_size=HISTORY_IMPORT_BATCH):
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="history-import", daemon=True)
+        thread.start()
+        return thread
+
+    def submit(self, history):
+        self._queue.put(history)
+        metrics.set_gauge("history_import.pending", self._queue.qsize())
+
+    def _run(self):
+        while True:
+            history = self._queue.get()
+            try:
+                self.import_history(history)
+            except Exception as e:
+                log.error(f"History sync import failed: {e}")
+            metrics.set_gauge("history_import.pending", self._queue.qsize())
+
+    def import_history(self, history):
+        """Import one HistorySyncEv; returns the number of new messages."""
+        started = time.monotonic()
+        conversations = len(history.Data.conversations)
+        seen = inserted = 0
+        batch = []
+        for row in iter_history_messages(history):
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                inserted += self._import_batch(batch)
+                seen += len(batch)
+                batch = []
+                self._report(seen, inserted, conversations, started)
+        if batch:
+            inserted += self._import_batch(batch)
+            seen += len(batch)
+        self._report(seen, inserted, conversations, started, done=True)
+        return inserted
+
+    def _import_batch(self, batch):
+        inserted = import_messages(batch)
+        metrics.inc("history_import.rows", len(batch))
+        metrics.inc("history_import.inserted", inserted)
+        return inserted
+
+    def _report(self, seen, inserted, conversations, started, done=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        state = "Imported" if done else "Importing history sync:"
+        log.info(
+            f"{state} {seen} messages from {conversations} conversations, "
+            f"{inserted} new, {seen / elapsed:.0f} rows/s"
+        )
+
+history_importer = HistoryImporter()
@@ -0,0 +1,68 @@
+import heapq
+import itertools
+import threading
+import time
+from metrics import metrics
+
+# Lower values are served first
+PRIORITY_COMMAND = 0
+PRIORITY_MESSAGE = 1
+
+class IntakeQueue:
+    """
+    Bounded, thread-safe priority queue for incoming work.
+    Items with equal priority are served FIFO. Items carry an optional wall-clock
+    deadline and are dropped instead of returned once it has passed. Items sharing
+    a key are always served in the order they were put: a command jumps ahead of
+    other keys' work together with the items queued before it under its key.
+    """
+    def __init__(self, maxsize, name="intake"):
+        self.maxsize = maxsize
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, item, priority=PRIORITY_MESSAGE, deadline=None, key=None):
+        """
+        Add an item. Returns False if the queue is full; commands are always admitted
+        since they are cheap and must not be shed.
+        """
+        with self._cond:
+            if len(self._heap) >= self.maxsize and priority > PRIORITY_COMMAND:
+                metrics.inc(f"{self.name}.dropped.full")
+                return False
+            if key is not None:
+                self._promote(key, priority)
+            heapq.heappush(self._heap, (priority, next(self._counter), time.monotonic(), deadline, key, item))
+            metrics.set_gauge(f"{self.name}.depth", len(self._heap))
+            self._cond.notify()
+            return True
+
+    def _promote(self, key, priority):
+        # Raise items already queued under `key` to `priority`, so a new item can't
+        # be served before them
+        promoted = False
+        for index, entry in enumerate(self._heap):
+            if entry[4] == key and entry[0] > priority:
+                self._heap[index] = (priority,) + entry[1:]
+                promoted = True
+        if promoted:
+            heapq.heapify(self._heap)
+
+    def get(self):
+        """Block until a fresh item is available and return (enqueued_at, item)."""
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, enqueued_at, deadline, _, item = heapq.heappop(self._heap)
+                metrics.set_gauge(f"{self.name}.depth", len(self._heap))
+                if deadline is not None and time.time() > deadline:
+                    metrics.inc(f"{self.name}.dropped.stale")
+                    continue
+                return enqueued_at, item
+
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
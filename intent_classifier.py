@@ -0,0 +1,188 @@
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter, defaultdict
+from config import (
+    INTENT_CONFIDENCE_THRESHOLD,
+    INTENT_SHADOW_RATE,
+    INTENT_MIN_SAMPLES,
+    INTENT_TRAINING_LOG
+)
+from metrics import metrics
+from filelogger import FileLogger
+fileLogger = FileLogger()
+
+NO_TOOL = "no_tool"
+TOOL = "tool"
+ASK_LLM = "ask_llm"
+
+SAMPLE_PREFIX = "[POLL_LLM_FOR_TOOL_CHOICE] [SAMPLE]: "
+
+# Short greetings, thanks and goodbyes never need a tool. Confirmations such as
+# "yes" or "ok" are left out: they may be answering a question about a booking or order.
+SMALL_TALK_PATTERN = re.compile(
+    r"^\W*(hi|hello|hey|moi|hei|terve|moikka|good (morning|evening|night)|huomenta|iltaa|"
+    r"thanks?( you)?( so much)?|thx|kiitos|kiitti|"
+    r"bye|goodbye|moi moi|heippa|see you|nähdään)\W*$",
+    re.IGNORECASE,
+)
+SMALL_TALK_CONFIDENCE = 1.0
+
+# Scenario -> [(tool name, pattern)]. The patterns are broad, so a message matching
+# exactly one of them only passes that tool to the tool poll as a hint.
+TOOL_PATTERNS = {
+    "base": [
+        ("generate_image_tool", re.compile(r"\b(draw|paint|generate|create|make)\b.{0,40}\b(image|picture|photo|drawing|illustration)\b|\bpiirrä\b|\bluo kuva", re.IGNORECASE)),
+        ("edit_image_tool", re.compile(r"\b(edit|change|modify)\b.{0,30}\b(image|picture|photo)\b|\bmuokkaa kuva", re.IGNORECASE)),
+        ("generate_tts_tool", re.compile(r"\b(read (it|this) (out loud|aloud)|voice message|as audio|text to speech)\b|\blue ääneen\b|\bääniviesti", re.IGNORECASE)),
+        ("web_search_tool", re.compile(r"\b(search|google|look up)\b.{0,60}|\b(hae|etsi) netistä\b", re.IGNORECASE)),
+    ],
+}
+
+def _features(text):
+    words = re.findall(r"\w+", text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class IntentDecision:
+    def __init__(self, kind, tool=None, confidence=0.0, source="rules"):
+        self.kind = kind
+        self.tool = tool
+        self.confidence = confidence
+        self.source = source
+    def __repr__(self):
+        return f"IntentDecision({self.kind}, {self.tool}, {self.confidence:.2f}, {self.source})"
+
+class _NaiveBayes:
+    """Multinomial naive Bayes over word uni- and bigrams; trainable incrementally."""
+    def __init__(self):
+        self.class_counts = Counter()
+        self.feature_counts = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+
+    def learn(self, label, text):
+        features = _features(text)
+        self.class_counts[label] += 1
+        self.feature_counts[label].update(features)
+        self.feature_totals[label] += len(features)
+        self.vocabulary.update(features)
+
+    @property
+    def samples(self):
+        return sum(self.class_counts.values())
+
+    def predict(self, text):
+        """Returns (label, probability) of the most likely class."""
+        features = _features(text)
+        total = self.samples
+        vocabulary_size = len(self.vocabulary) or 1
+        log_probs = {}
+        for label, count in self.class_counts.items():
+            counts = self.feature_counts[label]
+            denominator = self.feature_totals[label] + vocabulary_size
+            log_prob = math.log(count / total)
+            for feature in features:
+                log_prob += math.log((counts.get(feature, 0) + 1) / denominator)
+            log_probs[label] = log_prob
+        best = max(log_probs, key=log_probs.get)
+        normalizer = sum(math.exp(value - log_probs[best]) for value in log_probs.values())
+        return best, 1.0 / normalizer
+
+class IntentClassifier:
+    """
+    Local pre-classifier deciding whether a message definitely needs no tool, definitely
+    needs one specific tool, or should be left to the tool-poll LLM call. Keyword rules
+    only settle small talk; a tool is chosen locally only by a naive Bayes model trained
+    from logged tool-poll samples. A single tool keyword match rides along to the poll
+    as a hint in `IntentDecision.tool`.
+    """
+    def __init__(self, threshold=INTENT_CONFIDENCE_THRESHOLD, shadow_rate=INTENT_SHADOW_RATE, min_samples=INTENT_MIN_SAMPLES):
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self.min_samples = min_samples
+        self._models = defaultdict(_NaiveBayes)  # scenario -> model
+        self._lock = threading.Lock()
+
+    def train_from_log(self, path=INTENT_TRAINING_LOG):
+        """Train from `[POLL_LLM_FOR_TOOL_CHOICE] [SAMPLE]` records written by earlier tool polls."""
+        if not os.path.exists(path):
+            return 0
+        trained = 0
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.startswith(SAMPLE_PREFIX):
+                    continue
+                try:
+                    sample = json.loads(line[len(SAMPLE_PREFIX):])
+                except json.JSONDecodeError:
+                    continue
+                self.learn(sample["scenario"], sample["message"], sample["tools"])
+                trained += 1
+        logging.info(f"Intent classifier trained on {trained} logged tool-poll samples.")
+        return trained
+
+    def learn(self, scenario, message, tool_names):
+        # Multi-tool turns are not a single class; leave those to the LLM
+        if len(tool_names) > 1:
+            return
+        with self._lock:
+            self._models[scenario].learn(tool_names[0] if tool_names else NO_TOOL, message)
+
+    def classify(self, scenario, message, available_tools):
+        """Returns an IntentDecision for `message` given the scenario's tool names."""
+        text = message.strip()
+        if not text:
+            return IntentDecision(ASK_LLM)
+        if SMALL_TALK_PATTERN.match(text):
+            if SMALL_TALK_CONFIDENCE < self.threshold:
+                return IntentDecision(ASK_LLM, confidence=SMALL_TALK_CONFIDENCE)
+            return IntentDecision(NO_TOOL, confidence=SMALL_TALK_CONFIDENCE)
+
+        matches = [tool for tool, pattern in TOOL_PATTERNS.get(scenario, []) if tool in available_tools and pattern.search(text)]
+        hint = matches[0] if len(matches) == 1 else None
+
+        with self._lock:
+            model = self._models.get(scenario)
+            if model is None or model.samples < self.min_samples:
+                return IntentDecision(ASK_LLM, hint)
+            label, confidence = model.predict(text)
+        if confidence < self.threshold:
+            return IntentDecision(ASK_LLM, hint, confidence=confidence, source="model")
+        if label == NO_TOOL and hint is None:
+            return IntentDecision(NO_TOOL, confidence=confidence, source="model")
+        if label in available_tools:
+            return IntentDecision(TOOL, label, confidence=confidence, source="model")
+        return IntentDecision(ASK_LLM, hint, confidence=confidence, source="model")
+
+    def should_verify(self):
+        """Whether a confident decision should also be checked against the full tool poll."""
+        return random.random() < self.shadow_rate
+
+    def record_decision(self, scenario, decision):
+        metrics.inc(f"intent.{scenario}.{decision.kind}")
+
+    def record_outcome(self, scenario, message, decision, tool_names):
+        """Learn from a full tool poll and log it if it disagrees with a confident decision."""
+        fileLogger.log(SAMPLE_PREFIX + json.dumps({"scenario": scenario, "message": message, "tools": tool_names}, ensure_ascii=False))
+        self.learn(scenario, message, tool_names)
+        if decision.kind == ASK_LLM:
+            if decision.tool is not None:
+                # How often a keyword hint turns out right
+                metrics.inc(f"intent.{scenario}.hints")
+                if decision.tool in tool_names:
+                    metrics.inc(f"intent.{scenario}.hints_confirmed")
+            return
+        expected = [] if decision.kind == NO_TOOL else [decision.tool]
+        metrics.inc(f"intent.{scenario}.verified")
+        if sorted(tool_names) != expected:
+            metrics.inc(f"intent.{scenario}.disagreements")
+            fileLogger.log(f"[INTENT_CLASSIFIER] [DISAGREEMENT]: {json.dumps({'scenario': scenario, 'message': message, 'decision': repr(decision), 'llm_tools': tool_names}, ensure_ascii=False)}")
+
+intent_classifier = IntentClassifier()
+
+def available_tool_names(tools):
+    return [tool["function"]["name"] for tool in tools]
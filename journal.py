@@ -0,0 +1,197 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from config import JOURNAL_DIR, JOURNAL_SEGMENT_BYTES
+from metrics import metrics
+
+SEGMENT_PATTERN = re.compile(r"^segment-(\d{8})\.jsonl(\.gz)?$")
+INDEX_FILE = "index.jsonl"
+
+def _segment_name(seq):
+    return f"segment-{seq:08d}.jsonl"
+
+class MessageJournal:
+    """
+    Append-only journal of incoming messages.
+    Records are JSON lines written to a size-capped active segment. Full segments are
+    sealed: their chat ids and timestamp range are appended to index.jsonl and the
+    file is gzip-compressed in the background.
+    """
+    def __init__(self, directory=JOURNAL_DIR, segment_bytes=JOURNAL_SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _recover(self):
+        """Resume the newest uncompressed segment and seal any older leftovers."""
+        indexed = {entry["segment"] for entry in read_index(self.directory)}
+        seqs = sorted({int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(self.directory)) if m})
+        self._seq = seqs[-1] if seqs else 0
+        active_path = os.path.join(self.directory, _segment_name(self._seq))
+        if not os.path.exists(active_path) or _segment_name(self._seq) in indexed:
+            self._seq += 1
+        for seq in seqs:
+            name = _segment_name(seq)
+            if seq < self._seq and os.path.exists(os.path.join(self.directory, name)):
+                if name not in indexed:
+                    self._write_index_entry(name, _scan_segment(os.path.join(self.directory, name)))
+                self._compress(name)
+        self._open_segment()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, _segment_name(self._seq))
+        self._meta = _scan_segment(path) if os.path.exists(path) else _empty_meta()
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def append(self, chat, timestamp, payload):
+        """Append one record. `payload` must be JSON serializable."""
+        line = json.dumps({"ts": timestamp, "chat": chat, "data": payload}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line.encode("utf-8"))
+            _update_meta(self._meta, chat, timestamp)
+            if self._size >= self.segment_bytes:
+                self._seal()
+        metrics.inc("journal.records")
+
+    def append_message(self, message):
+        """Append a neonize MessageEv as its serialized protobuf."""
+        self.append(
+            chat=message.Info.MessageSource.Chat.User,
+            timestamp=message.Info.Timestamp // 1000,
+            payload={
+                "id": message.Info.ID,
+                "pb": base64.b64encode(message.SerializeToString()).decode("ascii"),
+            },
+        )
+
+    def _seal(self):
+        self._file.close()
+        name = _segment_name(self._seq)
+        self._write_index_entry(name, self._meta)
+        threading.Thread(target=self._compress, args=(name,), daemon=True).start()
+        self._seq += 1
+        self._open_segment()
+        metrics.inc("journal.segments_sealed")
+
+    def _write_index_entry(self, name, meta):
+        entry = {
+            "segment": name,
+            "first_ts": meta["first_ts"],
+            "last_ts": meta["last_ts"],
+            "count": meta["count"],
+            "chats": sorted(meta["chats"]),
+        }
+        with open(os.path.join(self.directory, INDEX_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _compress(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            os.remove(path)
+        except Exception as e:
+            logging.error(f"Failed to compress journal segment {name}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _empty_meta():
+    return {"first_ts": None, "last_ts": None, "count": 0, "chats": set()}
+
+def _update_meta(meta, chat, timestamp):
+    if meta["first_ts"] is None or timestamp < meta["first_ts"]:
+        meta["first_ts"] = timestamp
+    if meta["last_ts"] is None or timestamp > meta["last_ts"]:
+        meta["last_ts"] = timestamp
+    meta["count"] += 1
+    meta["chats"].add(chat)
+
+def _scan_segment(path):
+    meta = _empty_meta()
+    for record in _read_segment(path):
+        _update_meta(meta, record["chat"], record["ts"])
+    return meta
+
+def _read_segment(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line after a crash; skip it
+                continue
+
+def read_index(directory=JOURNAL_DIR):
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def iter_records(directory=JOURNAL_DIR, chat=None, since=None, until=None):
+    """
+    Yield journal records in write order, optionally filtered by chat and by an
+    inclusive timestamp range. Sealed segments that cannot match are skipped via
+    the index.
+    """
+    index = {entry["segment"]: entry for entry in read_index(directory)}
+    # Sealed segments are listed under their uncompressed name, as in the index
+    names = sorted({m.group(0)[:-3] if m.group(2) else m.group(0) for m in map(SEGMENT_PATTERN.match, os.listdir(directory)) if m})
+    for name in names:
+        entry = index.get(name)
+        if entry and entry["count"]:
+            if chat is not None and chat not in entry["chats"]:
+                continue
+            if since is not None and entry["last_ts"] < since:
+                continue
+            if until is not None and entry["first_ts"] > until:
+                continue
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            path += ".gz"
+        if not os.path.exists(path):
+            continue  # segment was removed after listing
+        for record in _read_segment(path):
+            if chat is not None and record["chat"] != chat:
+                continue
+            if since is not None and record["ts"] < since:
+                continue
+            if until is not None and record["ts"] > until:
+                continue
+            yield record
+
+def iter_messages(directory=JOURNAL_DIR, chat=None, since=None, until=None):
+    """Yield journaled messages as neonize MessageEv objects for replay."""
+    from neonize.events import MessageEv
+    for record in iter_records(directory, chat, since, until):
+        pb = record["data"].get("pb")
+        if pb:
+            yield MessageEv.FromString(base64.b64decode(pb))
+
+def replay(handler, directory=JOURNAL_DIR, chat=None, since=None, until=None, speed=None):
+    """
+    Call `handler(message)` for every journaled message. With `speed` set, the
+    original gaps between messages are reproduced, divided by `speed`.
+    """
+    previous_ts = None
+    for message in iter_messages(directory, chat, since, until):
+        timestamp = message.Info.Timestamp / 1000
+        if speed and previous_ts is not None and timestamp > previous_ts:
+            time.sleep((timestamp - previous_ts) / speed)
+        previous_ts = timestamp
+        handler(message)
@@ -1,54 +1,284 @@
+import asyncio
+import hashlib
+import json
 import logging
-from database import get_recent_messages_formatted
+from database import get_conversation_context, get_recent_messages_formatted
 from config import (
-    OPENAI_API_KEY,
+    SCENARIO,
     OPENAI_MODEL_NAME,
-    AI_ASSISTANT_NAME
+    AI_ASSISTANT_NAME,
+    SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS,
+    PROMPT_HISTORY_MAX_MESSAGES,
+    PHRASE_VARIATIONS
 )
+from prompts import PHRASE_GENERATION_PROMPT, SUMMARY_PROMPT
+from phrases import detect_language, phrase_cache
+from response_cache import response_cache, caching_enabled
+from openai_client import client, async_client, resilient_client
+from prompt_assembler import prompt_assembler
 import openai
 from openai.types.chat import ChatCompletion
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+WAIT_MESSAGE_PROMPT = """Please produce exactly one short sentence that says something along the lines of: \"Please wait, just one moment\" but in the same language the user wrote in. Keep it very short."""
+ERROR_MESSAGE_PROMPT = """Please produce exactly one short sentence that says something along the lines of: \"An error occurred, please try again later\" but in the same language the user wrote in. Keep it very short."""
 
-def _call_openai_api(system_prompt, user_message):
+def _build_messages(system_prompt, user_message):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+
+def _fallback_reply(user_message, cache_key=None, fallback_kind="error"):
+    """
+    Reply used when the API can't be reached: a cached response for the same prompt,
+    even if expired, or else a local phrase in the user's language.
+    """
+    if cache_key is not None and response_cache is not None:
+        cached = response_cache.get("completion", cache_key, user_message, allow_expired=True)
+        if cached is not None:
+            return cached
+    return phrase_cache.get(fallback_kind, detect_language(user_message)) or phrase_cache.get(fallback_kind, "en")
+
+def _call_openai_api(system_prompt, user_message, fallback_kind="error", cache_key=None):
+    cache_key = cache_key or system_prompt
+    cache = caching_enabled()
+    if cache:
+        cached = response_cache.get("completion", cache_key, user_message)
+        if cached is not None:
+            return cached
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-        completion: ChatCompletion = client.chat.completions.create(
+        completion: ChatCompletion = resilient_client.call(
+            "completion",
+            client.chat.completions.create,
             model=OPENAI_MODEL_NAME,
-            messages=messages,
+            messages=_build_messages(system_prompt, user_message),
         )
-        return completion.choices[0].message.content.strip()
+        content = completion.choices[0].message.content.strip()
+        if cache:
+            response_cache.put("completion", cache_key, user_message, content)
+        return content
+    except Exception as e:
+        logging.error(f"OpenAI API Request Failed: {e}")
+        return _fallback_reply(user_message, cache_key, fallback_kind)
+
+async def _call_openai_api_async(system_prompt, user_message, fallback_kind="error", cache_key=None):
+    cache_key = cache_key or system_prompt
+    cache = caching_enabled()
+    if cache:
+        cached = response_cache.get("completion", cache_key, user_message)
+        if cached is not None:
+            return cached
+    try:
+        completion: ChatCompletion = await resilient_client.call_async(
+            "completion",
+            async_client.chat.completions.create,
+            model=OPENAI_MODEL_NAME,
+            messages=_build_messages(system_prompt, user_message),
+        )
+        content = completion.choices[0].message.content.strip()
+        if cache:
+            response_cache.put("completion", cache_key, user_message, content)
+        return content
     except Exception as e:
         logging.error(f"OpenAI API Request Failed: {e}")
-        return "Error with OpenAI API request."
+        return _fallback_reply(user_message, cache_key, fallback_kind)
+
+def _format_final_prompt(prompt_base, history, scraped_text, tool_usage_result, user_text):
+    """
+    Fill the scenario prompt, fitting history, session content and tool results to their
+    token budgets. `history` is the (summary, recent rows) pair from get_conversation_context.
+    """
+    final_prompt = prompt_assembler.assemble(
+        prompt_base,
+        sections={
+            "previous_messages": history,
+            "scraped_text": scraped_text,
+            "tool_usage_result": tool_usage_result,
+        },
+        defaults={
+            "scraped_text": "No additional content provided.",
+            "tool_usage_result": "No tools were used.",
+        },
+        fixed={"ai_assistant_name": AI_ASSISTANT_NAME},
+        user_message=user_text,
+    )
+    logging.debug(f"Final prompt generated: {final_prompt}")
+    return final_prompt
+
+def _final_cache_key(prompt_base, scraped_text, tool_usage_result):
+    """
+    What a final response is cached under instead of its full prompt: the scenario, the
+    static template and a digest of the session content and tool results. The history
+    in the prompt changes every turn, so keying on it would never hit.
+    """
+    digest = hashlib.sha256(json.dumps([scraped_text or "", tool_usage_result or ""]).encode("utf-8")).hexdigest()
+    return json.dumps([SCENARIO, prompt_base, digest])
 
 def generate_final_response(prompt_base, user_id, scraped_text, user_text, tool_usage_result):
     """
     Generate the final response for the user.
     """
-    # Format the prompt
-    final_prompt = prompt_base.format(
-        ai_assistant_name=AI_ASSISTANT_NAME,
-        previous_messages=get_recent_messages_formatted(user_id),
-        scraped_text=scraped_text or "No additional content provided.",
-        tool_usage_result=tool_usage_result or "No tools were used.",
-    )
+    history = get_conversation_context(user_id, PROMPT_HISTORY_MAX_MESSAGES)
+    final_prompt = _format_final_prompt(prompt_base, history, scraped_text, tool_usage_result, user_text)
+    return _call_openai_api(final_prompt, user_text, cache_key=_final_cache_key(prompt_base, scraped_text, tool_usage_result)).strip()
 
-    logging.debug(f"Final prompt generated: {final_prompt}")
-    return _call_openai_api(final_prompt, user_text).strip()
+async def generate_final_response_async(prompt_base, user_id, scraped_text, user_text, tool_usage_result):
+    """
+    Async version of generate_final_response.
+    """
+    history = await asyncio.to_thread(get_conversation_context, user_id, PROMPT_HISTORY_MAX_MESSAGES)
+    final_prompt = _format_final_prompt(prompt_base, history, scraped_text, tool_usage_result, user_text)
+    return (await _call_openai_api_async(final_prompt, user_text, cache_key=_final_cache_key(prompt_base, scraped_text, tool_usage_result))).strip()
+
+TOOL_RESULTS_IN_THREAD = "Any tool results are provided as tool messages after the user's message."
+
+def _assistant_tool_call_message(message):
+    return {
+        "role": "assistant",
+        "content": message.content,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+            }
+            for tool_call in message.tool_calls
+        ],
+    }
+
+def _tool_result_messages(tool_calls, results):
+    return [
+        {"role": "tool", "tool_call_id": tool_call.id, "content": result}
+        for tool_call, result in zip(tool_calls, results)
+    ]
+
+def generate_response_with_tools(prompt_base, user_id, scraped_text, user_text, tools, run_tools):
+    """
+    Generate the final response in a single request that also offers the scenario's tools.
+    If the model answers directly, that answer is returned. Otherwise `run_tools(tool_calls)`
+    must return one result string per call; the results are appended to the same message
+    thread and the model is asked again.
+    """
+    history = get_conversation_context(user_id, PROMPT_HISTORY_MAX_MESSAGES)
+    final_prompt = _format_final_prompt(prompt_base, history, scraped_text, TOOL_RESULTS_IN_THREAD, user_text)
+    messages = _build_messages(final_prompt, user_text)
+    try:
+        for round_number in range(SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS + 1):
+            # On the last round tools are withheld so the model has to answer
+            offer_tools = tools if round_number < SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS else openai.NOT_GIVEN
+            completion = resilient_client.call(
+                "completion",
+                client.beta.chat.completions.parse,
+                model=OPENAI_MODEL_NAME,
+                messages=messages,
+                tools=offer_tools,
+            )
+            message = completion.choices[0].message
+            if not message.tool_calls:
+                return message.content.strip()
+            logging.info(f"Model requested {len(message.tool_calls)} tool call(s) in round {round_number + 1}.")
+            messages.append(_assistant_tool_call_message(message))
+            messages.extend(_tool_result_messages(message.tool_calls, run_tools(message.tool_calls)))
+    except Exception as e:
+        logging.error(f"OpenAI API Request Failed: {e}")
+    return _fallback_reply(user_text)
+
+async def generate_response_with_tools_async(prompt_base, user_id, scraped_text, user_text, tools, run_tools):
+    """
+    Async version of generate_response_with_tools; `run_tools` must be a coroutine function.
+    """
+    history = await asyncio.to_thread(get_conversation_context, user_id, PROMPT_HISTORY_MAX_MESSAGES)
+    final_prompt = _format_final_prompt(prompt_base, history, scraped_text, TOOL_RESULTS_IN_THREAD, user_text)
+    messages = _build_messages(final_prompt, user_text)
+    try:
+        for round_number in range(SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS + 1):
+            offer_tools = tools if round_number < SINGLE_ROUND_TRIP_MAX_TOOL_ROUNDS else openai.NOT_GIVEN
+            completion = await resilient_client.call_async(
+                "completion",
+                async_client.beta.chat.completions.parse,
+                model=OPENAI_MODEL_NAME,
+                messages=messages,
+                tools=offer_tools,
+            )
+            message = completion.choices[0].message
+            if not message.tool_calls:
+                return message.content.strip()
+            logging.info(f"Model requested {len(message.tool_calls)} tool call(s) in round {round_number + 1}.")
+            messages.append(_assistant_tool_call_message(message))
+            messages.extend(_tool_result_messages(message.tool_calls, await run_tools(message.tool_calls)))
+    except Exception as e:
+        logging.error(f"OpenAI API Request Failed: {e}")
+    return _fallback_reply(user_text)
+
+def _learn_phrases(language, response):
+    try:
+        text = response.strip()
+        if text.startswith("```json"):
+            text = text[len("```json"):]
+        phrase_cache.add_language(language, json.loads(text.strip("`")))
+    except (ValueError, AttributeError) as e:
+        logging.error(f"Could not parse generated phrases for {language}: {e}")
+
+def _phrase(kind, user_text):
+    """
+    A cached wait/error phrase in the language of `user_text`. Phrases for a language
+    seen for the first time are generated with one LLM call and kept for later turns.
+    Returns None if the language can't be detected.
+    """
+    language = detect_language(user_text)
+    if language is None:
+        return None
+    if not phrase_cache.has_language(language):
+        with phrase_cache.language_lock(language):
+            if not phrase_cache.has_language(language):
+                prompt = PHRASE_GENERATION_PROMPT.format(variations=PHRASE_VARIATIONS, language=language)
+                _learn_phrases(language, _call_openai_api(prompt, user_text))
+    return phrase_cache.get(kind, language)
+
+async def _phrase_async(kind, user_text):
+    language = detect_language(user_text)
+    if language is None:
+        return None
+    if not phrase_cache.has_language(language):
+        async with phrase_cache.async_language_lock(language):
+            if not phrase_cache.has_language(language):
+                prompt = PHRASE_GENERATION_PROMPT.format(variations=PHRASE_VARIATIONS, language=language)
+                _learn_phrases(language, await _call_openai_api_async(prompt, user_text))
+    return phrase_cache.get(kind, language)
 
 def generate_wait_message(user_text=None, user_id=None):
     if user_text is None:
         user_text = get_recent_messages_formatted(user_id=user_id)
-    prompt = """Please produce exactly one short sentence that says something along the lines of: \"Please wait, just one moment\" but in the same language the user wrote in. Keep it very short."""
-    return _call_openai_api(prompt, user_text).strip()
+    return _phrase("wait", user_text) or _call_openai_api(WAIT_MESSAGE_PROMPT, user_text, fallback_kind="wait").strip()
+
+async def generate_wait_message_async(user_text=None, user_id=None):
+    if user_text is None:
+        user_text = await asyncio.to_thread(get_recent_messages_formatted, user_id)
+    return await _phrase_async("wait", user_text) or (await _call_openai_api_async(WAIT_MESSAGE_PROMPT, user_text, fallback_kind="wait")).strip()
 
 def generate_error_message(user_text=None, user_id=None):
     if user_text is None:
         user_text = get_recent_messages_formatted(user_id=user_id)
-    prompt = """Please produce exactly one short sentence that says something along the lines of: \"An error occurred, please try again later\" but in the same language the user wrote in. Keep it very short."""
-    return _call_openai_api(prompt, user_text).strip()
+    return _phrase("error", user_text) or _call_openai_api(ERROR_MESSAGE_PROMPT, user_text).strip()
 
+async def generate_error_message_async(user_text=None, user_id=None):
+    if user_text is None:
+        user_text = await asyncio.to_thread(get_recent_messages_formatted, user_id)
+    return await _phrase_async("error", user_text) or (await _call_openai_api_async(ERROR_MESSAGE_PROMPT, user_text)).strip()
+
+def generate_summary(previous_summary, transcript):
+    """
+    Fold `transcript` into `previous_summary` for the rolling conversation summary.
+    Returns None if the API call fails, so a fallback reply never becomes the summary.
+    """
+    try:
+        completion: ChatCompletion = resilient_client.call(
+            "summary",
+            client.chat.completions.create,
+            model=OPENAI_MODEL_NAME,
+            messages=_build_messages(SUMMARY_PROMPT.format(previous_summary=previous_summary or "No summary yet."), transcript),
+        )
+        return completion.choices[0].message.content.strip()
+    except Exception as e:
+        logging.error(f"OpenAI summary request failed: {e}")
+        return None
@@ -11,9 +11,13 @@ from neonize.events import (
     event
 )
 from neonize.utils.enum import Presence
-from database import init_db
+from database import init_db, db_connections, message_writer
+from retention import conversation_retention
+from session_store import init_session_db, start_session_maintenance
 from whatsapp import on_message, on_history_sync, on_message
 from config import CONV_DB_PATH, NEO_DB_PATH
+from metrics import start_metrics_reporter
+from intent_classifier import intent_classifier
 
 def configure_logging():
     logger = logging.getLogger()
@@ -36,14 +40,14 @@ def main():
     stop_event = event
 
     def interrupted(*_):
-        """Signal handler for Ctrl+C."""
+        """Signal handler for Ctrl+C and termination; queued messages are written on the way out."""
         stop_event.set()
 
     signal.signal(signal.SIGINT, interrupted)
+    signal.signal(signal.SIGTERM, interrupted)
 
     # Create the DB directory if it doesn't exist
     os.makedirs(os.path.dirname(CONV_DB_PATH), exist_ok=True)
-    os.makedirs("messages", exist_ok=True)
     os.makedirs("downloads", exist_ok=True)
     os.makedirs("converted", exist_ok=True)
     os.makedirs("images", exist_ok=True)
@@ -51,6 +55,16 @@ def main():
 
     # Initialize DB
     init_db()
+    message_writer.start()
+    conversation_retention.start()
+    init_session_db()
+    start_session_maintenance()
+
+    # Learn tool choices from earlier tool polls
+    intent_classifier.train_from_log()
+
+    # Periodically report queue depths and wait times
+    start_metrics_reporter()
 
     # Create the client
     client = NewClient(NEO_DB_PATH)
@@ -78,6 +92,8 @@ def main():
     # Keep the program running until a signal is received
     stop_event.wait()
     logging.info("Exiting...")
+    message_writer.stop()
+    db_connections.close_all()
 
 if __name__ == "__main__":
     main()
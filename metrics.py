@@ -0,0 +1,71 @@
+import json
+import logging
+import threading
+import time
+from config import METRICS_PATH, METRICS_REPORT_INTERVAL
+
+class Metrics:
+    """
+    Thread-safe in-process counters, gauges and timings.
+    A snapshot is periodically logged and written to METRICS_PATH as JSON.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}  # name -> [count, total_seconds, max_seconds]
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timestamp": int(time.time()),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {
+                    name: {
+                        "count": count,
+                        "avg": total / count if count else 0.0,
+                        "max": max_seconds,
+                    }
+                    for name, (count, total, max_seconds) in self._timings.items()
+                },
+            }
+
+metrics = Metrics()
+
+def write_metrics_snapshot():
+    """Write the current metrics snapshot to METRICS_PATH and return it."""
+    snapshot = metrics.snapshot()
+    try:
+        with open(METRICS_PATH, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+    except Exception as e:
+        logging.error(f"Failed to write metrics snapshot: {e}")
+    return snapshot
+
+def start_metrics_reporter(interval=METRICS_REPORT_INTERVAL):
+    """Start a daemon thread that reports metrics every `interval` seconds."""
+    def reporter():
+        while True:
+            time.sleep(interval)
+            snapshot = write_metrics_snapshot()
+            logging.debug(f"Metrics: {snapshot}")
+
+    thread = threading.Thread(target=reporter, name="metrics-reporter", daemon=True)
+    thread.start()
+    return thread
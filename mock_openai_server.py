@@ -0,0 +1,62 @@
+"""
+Minimal OpenAI-compatible server for exercising timeouts, retries, hedging and the
+circuit breaker locally. Point the bot at it with OPENAI_BASE_URL=http://127.0.0.1:8400/v1.
+
+    python mock_openai_server.py --latency 0.2 --jitter 1.0 --error-rate 0.3 --error-status 429
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def _completion(model, content):
+    return {
+        "id": f"chatcmpl-mock-{random.randint(1, 9999999)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content, "tool_calls": None}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+class MockHandler(BaseHTTPRequestHandler):
+    options = None
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.options.latency + random.uniform(0, self.options.jitter))
+        if random.random() < self.options.error_rate:
+            headers = {"Retry-After": "1"} if self.options.error_status == 429 else None
+            self._send(self.options.error_status, {"error": {"message": "Injected failure", "type": "mock_error"}}, headers)
+            return
+        if self.path.endswith("/chat/completions"):
+            self._send(200, _completion(request.get("model", "mock"), self.options.reply))
+        else:
+            self._send(404, {"error": {"message": f"Not mocked: {self.path}", "type": "not_found"}})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--latency", type=float, default=0.1, help="base response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="status code of failed requests")
+    parser.add_argument("--reply", default="Mock reply.", help="assistant message content")
+    MockHandler.options = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", MockHandler.options.port), MockHandler)
+    print(f"Mock OpenAI server on http://127.0.0.1:{MockHandler.options.port}/v1")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from config import (
+    SCENARIO,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_DEADLINES,
+    OPENAI_MAX_RETRIES,
+    OPENAI_BACKOFF_BASE,
+    OPENAI_BACKOFF_CAP,
+    OPENAI_HEDGE_KINDS,
+    OPENAI_HEDGE_MIN_SAMPLES,
+    OPENAI_BREAKER_FAILURES,
+    OPENAI_BREAKER_RESET
+)
+from metrics import metrics
+
+# One shared client pair; retries are done by ResilientClient, not the SDK.
+# OPENAI_BASE_URL points both at any OpenAI-compatible server, e.g. a local mock.
+client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+async_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+
+# Rate limits, server errors, timeouts and connection failures are worth retrying
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+# Returned by CircuitBreaker.allow to the one call let through while half-open
+PROBE = "probe"
+
+class CircuitOpenError(Exception):
+    """Raised without calling the API while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and fails calls fast for
+    `reset_timeout` seconds. After that, a single probe call is let through; its
+    success closes the breaker and its failure reopens it.
+    """
+    def __init__(self, failure_threshold=OPENAI_BREAKER_FAILURES, reset_timeout=OPENAI_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        False while the call must fail fast, PROBE for the single call let through while
+        half-open, else True. The probe must end with record_success, record_failure
+        or release_probe.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return PROBE
+
+    def release_probe(self):
+        """Let another probe through after the probe ended without a success or failure."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info("OpenAI circuit breaker closed.")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+        metrics.set_gauge("openai.circuit_open", 0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            half_open = self._opened_at is not None
+            if half_open or self._failures >= self.failure_threshold:
+                if not half_open:
+                    logging.error(f"OpenAI circuit breaker opened after {self._failures} failures.")
+                self._opened_at = time.monotonic()
+            self._probing = False
+        metrics.set_gauge("openai.circuit_open", 1 if self._opened_at is not None else 0)
+
+class LatencyTracker:
+    """Recent call latencies per call type, for the hedging threshold."""
+    def __init__(self, window=200):
+        self._samples = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def observe(self, kind, seconds):
+        with self._lock:
+            self._samples.setdefault(kind, deque(maxlen=self._window)).append(seconds)
+
+    def p95(self, kind, min_samples=OPENAI_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = sorted(self._samples.get(kind, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+class ResilientClient:
+    """
+    Runs OpenAI calls with a deadline per call type, jittered exponential backoff on
+    rate limits and server errors, optional hedging, and a shared circuit breaker.
+    `kind` selects the deadline from OPENAI_DEADLINES; for kinds in OPENAI_HEDGE_KINDS
+    a second identical request is sent once the first runs past the p95 latency, and
+    whichever answers first is used.
+    """
+    def __init__(self, deadlines=OPENAI_DEADLINES, max_retries=OPENAI_MAX_RETRIES, hedge_kinds=OPENAI_HEDGE_KINDS):
+        self.deadlines = deadlines
+        self.max_retries = max_retries
+        self.hedge_kinds = hedge_kinds
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="openai-hedge")
+        self._prompt_tokens = {}  # kind -> (prompt tokens, cached prompt tokens) so far
+        self._usage_lock = threading.Lock()
+
+    def _backoff(self, attempt, error):
+        retry_after = None
+        if isinstance(error, openai.APIStatusError):
+            try:
+                retry_after = float(error.response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(OPENAI_BACKOFF_CAP, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+    def _should_retry(self, kind, attempt, delay, deadline, error):
+        metrics.inc(f"openai.{kind}.errors")
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            return False
+        logging.warning(f"OpenAI {kind} call failed ({error}); retry {attempt + 1} in {delay:.1f} s.")
+        metrics.inc(f"openai.{kind}.retries")
+        return True
+
+    def _check_breaker(self, kind):
+        """Raise CircuitOpenError if the breaker rejects the call; returns whether it is the probe."""
+        permit = self.breaker.allow()
+        if not permit:
+            metrics.inc(f"openai.{kind}.short_circuited")
+            raise CircuitOpenError(f"OpenAI circuit breaker is open; skipping {kind} call.")
+        return permit == PROBE
+
+    def _succeeded(self, kind, started, result):
+        elapsed = time.monotonic() - started
+        self.breaker.record_success()
+        self.latency.observe(kind, elapsed)
+        metrics.observe(f"openai.{kind}", elapsed)
+        self._record_usage(kind, result)
+
+    def _record_usage(self, kind, result):
+        """Count prompt tokens and the share served from the prompt cache, per scenario."""
+        usage = getattr(result, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if not prompt_tokens:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        name = f"openai.{SCENARIO}.{kind}"
+        metrics.inc(f"{name}.prompt_tokens", prompt_tokens)
+        metrics.inc(f"{name}.cached_tokens", cached_tokens)
+        with self._usage_lock:
+            total, cached = self._prompt_tokens.get(kind, (0, 0))
+            total, cached = total + prompt_tokens, cached + cached_tokens
+            self._prompt_tokens[kind] = (total, cached)
+        metrics.set_gauge(f"{name}.cache_hit_rate", round(cached / total, 3))
+
+    def _hedge_delay(self, kind):
+        return self.latency.p95(kind) if kind in self.hedge_kinds else None
+
+    def _call_hedged(self, kind, func, kwargs, timeout):
+        delay = self._hedge_delay(kind)
+        if delay is None or delay >= timeout:
+            return func(**kwargs, timeout=timeout)
+        primary = self._executor.submit(func, **kwargs, timeout=timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        metrics.inc(f"openai.{kind}.hedged")
+        hedge = self._executor.submit(func, **kwargs, timeout=timeout - delay)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is not None:
+            return (hedge if first is primary else primary).result()
+        return first.result()
+
+    def call(self, kind, func, **kwargs):
+        """Call `func(**kwargs)`, an OpenAI SDK method, under the policies for `kind`."""
+        probe = self._check_breaker(kind)
+        deadline = time.monotonic() + self.deadlines[kind]
+        attempt = 0
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    result = self._call_hedged(kind, func, kwargs, deadline - started)
+                except RETRYABLE_ERRORS as e:
+                    delay = self._backoff(attempt, e)
+                    if not self._should_retry(kind, attempt, delay, deadline, e):
+                        # One failure per call, however many attempts it took
+                        self.breaker.record_failure()
+                        raise
+                    attempt += 1
+                    time.sleep(delay)
+                    continue
+                self._succeeded(kind, started, result)
+                return result
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    async def _call_hedged_async(self, kind, func, kwargs, timeout):
+        delay = self._hedge_delay(kind)
+        if delay is None or delay >= timeout:
+            return await func(**kwargs, timeout=timeout)
+        primary = asyncio.ensure_future(func(**kwargs, timeout=timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        metrics.inc(f"openai.{kind}.hedged")
+        hedge = asyncio.ensure_future(func(**kwargs, timeout=timeout - delay))
+        done, pending = await asyncio.wait({primary, hedge}, return_when=asyncio.FIRST_COMPLETED)
+        first = done.pop()
+        if first.exception() is not None:
+            return await (hedge if first is primary else primary)
+        for task in pending:
+            task.cancel()
+        return first.result()
+
+    async def call_async(self, kind, func, **kwargs):
+        """Async version of call; `func` is an async SDK method."""
+        probe = self._check_breaker(kind)
+        deadline = time.monotonic() + self.deadlines[kind]
+        attempt = 0
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    result = await self._call_hedged_async(kind, func, kwargs, deadline - started)
+                except RETRYABLE_ERRORS as e:
+                    delay = self._backoff(attempt, e)
+                    if not self._should_retry(kind, attempt, delay, deadline, e):
+                        # One failure per call, however many attempts it took
+                        self.breaker.record_failure()
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                    continue
+                self._succeeded(kind, started, result)
+                return result
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+resilient_client = ResilientClient()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+from config import PHRASES_PATH
+from prompts import DEFAULT_PHRASES
+from metrics import metrics
+
+PHRASE_KINDS = ("wait", "error", "busy")
+
+# Unicode ranges for scripts that identify a language on their own
+SCRIPT_LANGUAGES = [
+    (re.compile(r"[぀-ヿ]"), "ja"),
+    (re.compile(r"[가-힯]"), "ko"),
+    (re.compile(r"[一-鿿]"), "zh"),
+    (re.compile(r"[Ѐ-ӿ]"), "ru"),
+    (re.compile(r"[؀-ۿ]"), "ar"),
+    (re.compile(r"[֐-׿]"), "he"),
+    (re.compile(r"[Ͱ-Ͽ]"), "el"),
+    (re.compile(r"[฀-๿]"), "th"),
+    (re.compile(r"[ऀ-ॿ]"), "hi"),
+]
+
+# Common short words for Latin-script languages
+STOPWORDS = {
+    "en": "the and is are you i to a of in it that this for what how can please thanks thank hello hi my me do have with not".split(),
+    "fi": "ja on ei se että mitä miten voi voitko kiitos hei moi minä sinä mä sä olen oot kanssa tämä tää mikä kuinka onko paljon".split(),
+    "sv": "och är det att jag du inte en ett på med för vad hur kan tack hej mig har som".split(),
+    "de": "und ist der die das nicht ich du ein eine mit für was wie kann bitte danke hallo mir habe sie".split(),
+    "fr": "et est le la les je tu un une pas avec pour que quoi comment merci bonjour moi ai vous ce".split(),
+    "es": "y es el la los las yo tu un una no con para que qué cómo gracias hola por favor mi tengo".split(),
+    "it": "e è il la lo gli io tu un una non con per che cosa come grazie ciao mi ho sono".split(),
+    "pt": "e é o a os as eu você um uma não com para que como obrigado obrigada olá meu tenho".split(),
+    "nl": "en is de het een ik jij je niet met voor wat hoe kan dank bedankt hallo mij heb".split(),
+    "et": "ja on ei see et mis kuidas saab aitäh tere mina sina mul kas palun".split(),
+    "pl": "i jest to nie że ja ty z dla co jak dziękuję cześć mi mam się".split(),
+}
+STOPWORD_LANGUAGES = {}
+for _language, _words in STOPWORDS.items():
+    for _word in _words:
+        STOPWORD_LANGUAGES.setdefault(_word, []).append(_language)
+
+def detect_language(text):
+    """
+    Guess the ISO 639-1 language code of `text` from its script or common words.
+    Returns None when the text gives no clear answer.
+    """
+    if not text:
+        return None
+    text = re.sub(r"https?://\S+", " ", text)
+    for pattern, language in SCRIPT_LANGUAGES:
+        if pattern.search(text):
+            return language
+    scores = {}
+    for word in re.findall(r"\w+", text.lower()):
+        for language in STOPWORD_LANGUAGES.get(word, ()):
+            scores[language] = scores.get(language, 0) + 1
+    if not scores:
+        return None
+    ranked = sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        return None
+    return ranked[0][0]
+
+class PhraseCache:
+    """
+    Wait, error and busy phrases per language with a few variations each.
+    Built-in languages come from prompts.DEFAULT_PHRASES; phrases generated for other
+    languages are added with `add_language` and persisted to PHRASES_PATH.
+    """
+    def __init__(self, path=PHRASES_PATH):
+        self.path = path
+        self._phrases = {language: dict(phrases) for language, phrases in DEFAULT_PHRASES.items()}
+        self._lock = threading.Lock()
+        self._language_locks = {}  # language -> lock held while its phrases are generated
+        self._async_language_locks = {}  # the same for coroutines on the async pipeline's loop
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._phrases.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to load cached phrases from {self.path}: {e}")
+
+    def _save(self):
+        generated = {language: phrases for language, phrases in self._phrases.items() if language not in DEFAULT_PHRASES}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(generated, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def has_language(self, language):
+        with self._lock:
+            return language in self._phrases
+
+    def get(self, kind, language):
+        """A random variation of the `kind` phrase in `language`, or None if not cached."""
+        with self._lock:
+            variations = self._phrases.get(language, {}).get(kind)
+        if not variations:
+            metrics.inc("phrases.misses")
+            return None
+        metrics.inc("phrases.hits")
+        return random.choice(variations)
+
+    def add_language(self, language, phrases):
+        """Store generated phrases for `language`; `phrases` maps each kind to a list of strings."""
+        if not all(isinstance(phrases.get(kind), list) and phrases[kind] for kind in PHRASE_KINDS):
+            raise ValueError(f"Incomplete phrases for language {language}")
+        with self._lock:
+            self._phrases[language] = {kind: [str(text) for text in phrases[kind]] for kind in PHRASE_KINDS}
+            try:
+                self._save()
+            except OSError as e:
+                logging.error(f"Failed to persist phrases for {language}: {e}")
+        logging.info(f"Cached wait/error/busy phrases for language {language}.")
+
+    def language_lock(self, language):
+        """Lock to hold while generating phrases for `language`, so it's only done once."""
+        with self._lock:
+            return self._language_locks.setdefault(language, threading.Lock())
+
+    def async_language_lock(self, language):
+        """Async version of language_lock, for use on one event loop."""
+        with self._lock:
+            return self._async_language_locks.setdefault(language, asyncio.Lock())
+
+phrase_cache = PhraseCache()
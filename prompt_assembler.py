@@ -0,0 +1,119 @@
+import logging
+from config import (
+    OPENAI_MODEL_NAME,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_SECTION_BUDGETS,
+    PROMPT_SECTION_PRIORITY,
+    PROMPT_HISTORY_MESSAGE_TOKENS
+)
+from tokens import count_tokens, truncate_to_tokens
+from metrics import metrics
+
+TRUNCATED_MARKER = "\n[...truncated]"
+OMITTED_TEXT = "[Omitted to fit the prompt budget.]"
+
+def _format_history_line(content, from_me):
+    return f"{'ASSISTANT' if from_me else 'USER'}: {content}"
+
+def fit_history(rows, budget, message_budget=PROMPT_HISTORY_MESSAGE_TOKENS, model=OPENAI_MODEL_NAME, summary=None):
+    """
+    Format (content, timestamp, from_me) rows, oldest first, keeping the newest
+    messages that fit `budget` tokens. Each message is cut to `message_budget` tokens.
+    A `summary` of earlier messages goes first and takes at most half the budget.
+    Returns the text and whether anything was cut or left out.
+    """
+    header = None
+    used = 0
+    truncated = False
+    if summary:
+        summary_text, truncated = fit_text(summary, budget // 2, model)
+        header = f"SUMMARY OF EARLIER CONVERSATION: {summary_text}"
+        used = count_tokens(header, model) + 1
+    lines = []
+    for content, _, from_me in reversed(rows):
+        if count_tokens(content, model) > message_budget:
+            content = truncate_to_tokens(content, message_budget, model) + TRUNCATED_MARKER
+            truncated = True
+        line = _format_history_line(content, from_me)
+        cost = count_tokens(line, model) + 1  # newline
+        if used + cost > budget:
+            truncated = True
+            break
+        lines.append(line)
+        used += cost
+    if header:
+        lines.append(header)
+    return "\n".join(reversed(lines)), truncated
+
+def fit_text(text, budget, model=OPENAI_MODEL_NAME):
+    """
+    Cut `text` to `budget` tokens, marking it as truncated if anything was cut.
+    Returns the text and whether it was cut.
+    """
+    if count_tokens(text, model) <= budget:
+        return text, False
+    marker_cost = count_tokens(TRUNCATED_MARKER, model)
+    if budget <= marker_cost:
+        return "", True
+    return truncate_to_tokens(text, budget - marker_cost, model) + TRUNCATED_MARKER, True
+
+class PromptAssembler:
+    """
+    Fills a prompt template's sections within token budgets. Each section is first
+    fitted to its own budget; if the prompt is still over the total budget, sections
+    are shrunk or omitted starting from the lowest priority. Token counts per section
+    are logged and added to metrics for every prompt.
+    """
+    def __init__(self, total_budget=PROMPT_TOKEN_BUDGET, section_budgets=PROMPT_SECTION_BUDGETS, priority=PROMPT_SECTION_PRIORITY, model=OPENAI_MODEL_NAME):
+        self.total_budget = total_budget
+        self.section_budgets = section_budgets
+        self.priority = priority  # highest priority first
+        self.model = model
+
+    def _fit(self, name, value, budget):
+        if name == "previous_messages":
+            summary, rows = value
+            return fit_history(rows, budget, model=self.model, summary=summary)
+        return fit_text(value, budget, self.model)
+
+    @staticmethod
+    def _has_content(name, value):
+        if name == "previous_messages":
+            return bool(value and (value[0] or value[1]))
+        return bool(value)
+
+    def assemble(self, template, sections, defaults=None, fixed=None, user_message=""):
+        """
+        Format `template` with `sections` (name -> text, or a (summary, rows) pair
+        for "previous_messages") fitted to budget. `defaults` fill empty sections and
+        `fixed` fields are inserted as is. `user_message` only counts toward the total.
+        """
+        defaults = defaults or {}
+        fixed = fixed or {}
+        used_sections = [name for name in self.priority if "{" + name + "}" in template]
+        base_tokens = count_tokens(template.format(**fixed, **{name: "" for name in used_sections}), self.model)
+        user_tokens = count_tokens(user_message, self.model)
+        remaining = self.total_budget - base_tokens - user_tokens
+
+        fitted = {}
+        token_counts = {"template": base_tokens, "user_message": user_tokens}
+        for name in used_sections:
+            value = sections.get(name) if self._has_content(name, sections.get(name)) else None
+            text, truncated = self._fit(name, value, min(self.section_budgets[name], max(remaining, 0))) if value else ("", False)
+            if value and not text:
+                text = OMITTED_TEXT
+                metrics.inc(f"prompt.{name}.omitted")
+            elif truncated:
+                metrics.inc(f"prompt.{name}.truncated")
+            fitted[name] = text or defaults.get(name, "")
+            token_counts[name] = count_tokens(fitted[name], self.model)
+            remaining -= token_counts[name]
+
+        prompt = template.format(**fixed, **fitted)
+        for name, tokens in token_counts.items():
+            metrics.inc(f"prompt.{name}.tokens", tokens)
+        metrics.inc("prompt.count")
+        logging.info(f"Prompt tokens by section: {token_counts} (total {sum(token_counts.values())} of {self.total_budget})")
+        return prompt
+
+prompt_assembler = PromptAssembler()
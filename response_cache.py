@@ -0,0 +1,226 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from config import (
+    SCENARIO,
+    OPENAI_MODEL_NAME,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_SEMANTIC_THRESHOLD
+)
+from scenarios import SCENARIOS
+from retrieval import embed_text, cosine_similarity
+from metrics import metrics
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text or "").strip()
+
+class MemoryCacheBackend:
+    """In-process LRU of cache entries."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, created_at):
+        with self._lock:
+            self._entries[key] = (value, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class SQLiteCacheBackend:
+    """
+    Cache entries in SQLite, shared between restarts; least recently used are evicted.
+    Hits are recorded in memory and their last use written `touch_batch` at a time,
+    or before the next eviction, instead of one transaction per read.
+    """
+    def __init__(self, path, max_entries, touch_batch=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self._initialized = False
+        self._touched = {}  # key -> last use not yet written
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        if not self._initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    created_at REAL,
+                    last_used REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, created_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                with self._lock:
+                    self._touched[key] = time.time()
+                    full = len(self._touched) >= self.touch_batch
+                if full:
+                    self._write_touched(conn)
+                    conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    def _write_touched(self, conn):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        conn.executemany("UPDATE response_cache SET last_used = ? WHERE key = ?", [(used, key) for key, used in touched.items()])
+
+    def put(self, key, value, created_at):
+        conn = self._connect()
+        try:
+            # Pending uses go in first, so eviction sees them
+            self._write_touched(conn)
+            conn.execute("""
+                INSERT OR REPLACE INTO response_cache (key, value, created_at, last_used)
+                VALUES (?, ?, ?, ?)
+            """, (key, value, created_at, created_at))
+            conn.execute("""
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            conn.commit()
+        finally:
+            conn.close()
+
+class ResponseCache:
+    """
+    Caches LLM results keyed on the normalized (namespace, model, system prompt, user message).
+    Callers whose prompt embeds per-turn context pass a stable key in its place, such as
+    the template and a digest of the context the answer depends on.
+    With a semantic threshold above 0, a miss falls back to the most similar cached user
+    message under the same system prompt, compared with local embeddings. Entries expire
+    after `ttl` seconds; `backend` bounds the number of entries.
+    """
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL, semantic_threshold=RESPONSE_CACHE_SEMANTIC_THRESHOLD, semantic_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._semantic = OrderedDict()  # prefix -> deque of (embedding, key)
+        self._semantic_entries = semantic_entries
+        self._semantic_size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefix(namespace, system_prompt, model):
+        return hashlib.sha256(json.dumps([namespace, model, _normalize(system_prompt)]).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(prefix, user_message):
+        return hashlib.sha256(f"{prefix}:{_normalize(user_message).lower()}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key, allow_expired=False):
+        # Expired entries are kept until evicted, so they can still serve as outage fallbacks
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if not allow_expired and time.time() - created_at > self.ttl:
+            return None
+        return value
+
+    def _similar_key(self, prefix, user_message):
+        query = embed_text(user_message)
+        with self._lock:
+            candidates = list(self._semantic.get(prefix, ()))
+        best_key, best_score = None, self.semantic_threshold
+        for embedding, key in candidates:
+            score = cosine_similarity(query, embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, namespace, system_prompt, user_message, model=OPENAI_MODEL_NAME, semantic=True, allow_expired=False):
+        """
+        Returns the cached value, or None on a miss. `semantic=False` allows exact hits
+        only; `allow_expired` also returns entries past their TTL.
+        """
+        prefix = self._prefix(namespace, system_prompt, model)
+        value = self._lookup(self._key(prefix, user_message), allow_expired)
+        if value is not None:
+            metrics.inc(f"response_cache.{namespace}.hits")
+            return value
+        if semantic and self.semantic_threshold > 0:
+            key = self._similar_key(prefix, user_message)
+            value = self._lookup(key, allow_expired) if key else None
+            if value is not None:
+                metrics.inc(f"response_cache.{namespace}.semantic_hits")
+                return value
+        metrics.inc(f"response_cache.{namespace}.misses")
+        return None
+
+    def put(self, namespace, system_prompt, user_message, value, model=OPENAI_MODEL_NAME, semantic=True):
+        prefix = self._prefix(namespace, system_prompt, model)
+        key = self._key(prefix, user_message)
+        self.backend.put(key, value, time.time())
+        if semantic and self.semantic_threshold > 0:
+            embedding = embed_text(user_message)
+            with self._lock:
+                self._semantic.setdefault(prefix, deque()).append((embedding, key))
+                self._semantic.move_to_end(prefix)
+                self._semantic_size += 1
+                while self._semantic_size > self._semantic_entries:
+                    oldest = next(iter(self._semantic.values()))
+                    oldest.popleft()
+                    self._semantic_size -= 1
+                    if not oldest:
+                        self._semantic.popitem(last=False)
+
+def _create_response_cache():
+    if RESPONSE_CACHE == "off":
+        return None
+    if RESPONSE_CACHE == "sqlite":
+        return ResponseCache(SQLiteCacheBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES))
+    if RESPONSE_CACHE != "memory":
+        logging.warning(f"Unknown RESPONSE_CACHE {RESPONSE_CACHE!r}; using the in-memory cache.")
+    return ResponseCache(MemoryCacheBackend(RESPONSE_CACHE_MAX_ENTRIES))
+
+response_cache = _create_response_cache()
+
+def caching_enabled():
+    """Whether LLM results may be cached for the active scenario."""
+    return response_cache is not None and SCENARIOS[SCENARIO].cache_responses
+
+def cacheable_tool_calls(tool_names):
+    """Tool-poll results that call one of the scenario's stateful tools are never cached."""
+    return not set(tool_names) & set(SCENARIOS[SCENARIO].stateful_tools)
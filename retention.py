@@ -0,0 +1,115 @@
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from config import (
+    ARCHIVE_DIR,
+    RETENTION_MAX_MESSAGES,
+    RETENTION_MAX_AGE_DAYS,
+    RETENTION_INTERVAL,
+    RETENTION_VACUUM_PAGES
+)
+from database import get_retention_users, get_expired_messages, delete_message_ids, delete_messages, incremental_vacuum
+from metrics import metrics
+
+# Held while a user's messages are archived, so a reset can't be undone by a run in progress
+_archive_lock = threading.Lock()
+
+def _archive_path(user_id, directory=ARCHIVE_DIR):
+    return os.path.join(directory, re.sub(r"[^\w.-]", "_", user_id) + ".jsonl.gz")
+
+def archive_messages(user_id, rows, directory=ARCHIVE_DIR):
+    """
+    Append (id, message_content, timestamp, from_me) rows to the user's archive, one
+    gzip member per call, and sync it to disk.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(_archive_path(user_id, directory), "ab") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as archive:
+            for id_, content, timestamp, from_me in rows:
+                line = json.dumps({"id": id_, "content": content, "ts": timestamp, "from_me": bool(from_me)}, ensure_ascii=False)
+                archive.write((line + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+def iter_archived_messages(user_id, since=None, until=None, directory=ARCHIVE_DIR):
+    """
+    Yield the user's archived messages as (id, message_content, timestamp, from_me)
+    in the order they were archived, optionally limited to timestamps in [since, until).
+    """
+    path = _archive_path(user_id, directory)
+    if not os.path.exists(path):
+        return
+    seen = set()  # a run interrupted before its delete archives the same rows again
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            record = json.loads(line)
+            if record["id"] in seen:
+                continue
+            seen.add(record["id"])
+            if since is not None and record["ts"] < since:
+                continue
+            if until is not None and record["ts"] >= until:
+                continue
+            yield record["id"], record["content"], record["ts"], record["from_me"]
+
+def clear_user_history(user_id, directory=ARCHIVE_DIR):
+    """Delete the user's messages, summary and archive, e.g. on !reset."""
+    with _archive_lock:
+        delete_messages(user_id)
+        try:
+            os.remove(_archive_path(user_id, directory))
+        except FileNotFoundError:
+            pass
+
+class ConversationRetention:
+    """
+    Keeps the messages table bounded. Every `interval` seconds, messages older than
+    `max_age_days` or beyond each user's newest `max_messages` are appended to the
+    user's compressed archive and deleted, and up to `vacuum_pages` free pages are
+    returned to the file system. A limit of 0 disables it.
+    """
+    def __init__(self, max_messages=RETENTION_MAX_MESSAGES, max_age_days=RETENTION_MAX_AGE_DAYS, interval=RETENTION_INTERVAL, vacuum_pages=RETENTION_VACUUM_PAGES):
+        self.max_messages = max_messages
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Conversation retention failed: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self):
+        """Archive and delete expired messages, then vacuum; returns the number archived."""
+        cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days > 0 else 0
+        archived = 0
+        for user_id in get_retention_users(self.max_messages, cutoff):
+            with _archive_lock:
+                rows = get_expired_messages(user_id, self.max_messages, cutoff)
+                if not rows:
+                    continue
+                # Archived before deleting, so a crash in between loses nothing
+                archive_messages(user_id, rows)
+                delete_message_ids(user_id, [row[0] for row in rows])
+            archived += len(rows)
+        page_count, free_pages = incremental_vacuum(self.vacuum_pages)
+        metrics.inc("retention.archived", archived)
+        metrics.set_gauge("conversation_db.pages", page_count)
+        metrics.set_gauge("conversation_db.free_pages", free_pages)
+        if archived:
+            logging.info(f"Archived {archived} messages; conversation database is {page_count} pages, {free_pages} free.")
+        return archived
+
+conversation_retention = ConversationRetention()
@@ -0,0 +1,161 @@
+import math
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from config import (
+    RETRIEVAL_TOP_K,
+    RETRIEVAL_TOKEN_BUDGET,
+    RETRIEVAL_CHUNK_WORDS,
+    RETRIEVAL_CHUNK_OVERLAP,
+    RETRIEVAL_VECTOR_WEIGHT
+)
+from tokens import count_tokens
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+EMBEDDING_DIMS = 512
+
+def tokenize(text):
+    return WORD_PATTERN.findall(text.lower())
+
+def embed_text(text, dims=EMBEDDING_DIMS):
+    """
+    Local embedding: hashed character trigrams of each word, L2-normalized.
+    Returns a sparse {dimension: weight} dict; no model or network call needed.
+    """
+    counts = Counter()
+    for word in tokenize(text):
+        padded = f"#{word}#"
+        for i in range(max(1, len(padded) - 2)):
+            counts[zlib.crc32(padded[i:i + 3].encode("utf-8")) % dims] += 1
+    norm = math.sqrt(sum(value * value for value in counts.values()))
+    return {dim: value / norm for dim, value in counts.items()} if norm else {}
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(dim, 0.0) for dim, value in a.items())
+
+class Chunk:
+    def __init__(self, position, item_type, source, text):
+        self.position = position
+        self.item_type = item_type
+        self.source = source
+        self.text = text
+
+def chunk_items(items, chunk_words=RETRIEVAL_CHUNK_WORDS, overlap=RETRIEVAL_CHUNK_OVERLAP):
+    """Split session content items into overlapping word windows."""
+    chunks = []
+    step = max(1, chunk_words - overlap)
+    for item in items:
+        words = item.content.split()
+        for start in range(0, max(1, len(words)), step):
+            text = " ".join(words[start:start + chunk_words])
+            if text:
+                chunks.append(Chunk(len(chunks), item.type, item.source, text))
+            if start + chunk_words >= len(words):
+                break
+    return chunks
+
+class SessionIndex:
+    """BM25 index over session chunks, optionally blended with local vector similarity."""
+    def __init__(self, chunks, vector_weight=RETRIEVAL_VECTOR_WEIGHT, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.vector_weight = vector_weight
+        self.k1 = k1
+        self.b = b
+        self.term_counts = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.doc_freq = Counter()
+        for counts in self.term_counts:
+            self.doc_freq.update(counts.keys())
+        self.vectors = [embed_text(chunk.text) for chunk in chunks] if vector_weight > 0 else None
+
+    def _bm25(self, query_terms):
+        n = len(self.chunks)
+        scores = [0.0] * n
+        for term in set(query_terms):
+            df = self.doc_freq.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i, counts in enumerate(self.term_counts):
+                tf = counts.get(term)
+                if tf:
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avg_length or 1))
+                    scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k):
+        """Return up to `top_k` (score, chunk) pairs, best first."""
+        scores = self._bm25(tokenize(query))
+        best = max(scores, default=0.0)
+        if best > 0:
+            scores = [score / best for score in scores]
+        if self.vectors is not None:
+            query_vector = embed_text(query)
+            scores = [
+                (1 - self.vector_weight) * score + self.vector_weight * cosine_similarity(query_vector, vector)
+                for score, vector in zip(scores, self.vectors)
+            ]
+        ranked = sorted(zip(scores, self.chunks), key=lambda pair: pair[0], reverse=True)
+        return [(score, chunk) for score, chunk in ranked[:top_k] if score > 0]
+
+def _format_item(item_type, source, text):
+    return f"[{item_type.upper()}] {source}\n{text}"
+
+class SessionRetriever:
+    """
+    Selects the session content relevant to a message. Indexes are cached per user
+    and rebuilt when the user's session items change.
+    """
+    def __init__(self, max_users=256):
+        self.max_users = max_users
+        self._indexes = OrderedDict()  # user_id -> (signature, SessionIndex)
+        self._lock = threading.Lock()
+
+    def _index_for(self, user_id, items):
+        signature = tuple((item.source, item.created_at, len(item.content)) for item in items)
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached and cached[0] == signature:
+                self._indexes.move_to_end(user_id)
+                return cached[1]
+        index = SessionIndex(chunk_items(items))
+        with self._lock:
+            self._indexes[user_id] = (signature, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def build_context(self, user_id, items, query, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+        """
+        Returns session content for the prompt. Small sessions are included whole;
+        larger ones are reduced to the top-k chunks for `query` within `token_budget`.
+        """
+        if not items:
+            return ""
+        full_text = "\n".join(_format_item(item.type, item.source, item.content) for item in items)
+        if count_tokens(full_text) <= token_budget:
+            return full_text
+
+        index = self._index_for(user_id, items)
+        selected = []
+        used = 0
+        for _, chunk in index.search(query or "", top_k):
+            cost = count_tokens(chunk.text)
+            if used + cost > token_budget:
+                continue
+            selected.append(chunk)
+            used += cost
+        # Present chunks in document order so neighbouring chunks read naturally
+        selected.sort(key=lambda chunk: chunk.position)
+        return "\n".join(_format_item(chunk.item_type, chunk.source, chunk.text) for chunk in selected)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+session_retriever = SessionRetriever()
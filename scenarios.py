@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from config import SEARCH_HISTORY_TOOL
 from prompts import BASE_FINAL_RESPONSE_PROMPT, HAIRDRESSER_FINAL_RESPONSE_PROMPT, CAR_PARTS_RETAILER_FINAL_RESPONSE_PROMPT, BOOKSTORE_FINAL_RESPONSE_PROMPT
 import openai
 
@@ -14,9 +15,24 @@ class GenerateTTSTool(BaseModel):
 class WebSearchTool(BaseModel):
     query: str
 
+class SearchHistoryTool(BaseModel):
+    query: str
+
+SEARCH_HISTORY_TOOL_SCHEMA = openai.pydantic_function_tool(
+    SearchHistoryTool,
+    name="search_history_tool",
+    description="Search the user's earlier messages with you for something they mentioned before that isn't in the recent conversation. Only provide the search words.",
+)
+
 class Scenario:
     name = "base"
     final_response_prompt = BASE_FINAL_RESPONSE_PROMPT
+    # Whether LLM responses may be served from the response cache
+    cache_responses = True
+    # Tools acting on per-user data; tool polls that pick one are never cached
+    stateful_tools = ()
+    # Whether search_history_tool is offered in addition to `tools`
+    search_history = SEARCH_HISTORY_TOOL
     tools = [
         openai.pydantic_function_tool(
             GenerateImageTool,
@@ -40,6 +56,10 @@ class Scenario:
         ),
     ]
 
+    def __init__(self):
+        if self.search_history:
+            self.tools = self.tools + [SEARCH_HISTORY_TOOL_SCHEMA]
+
 class CheckAppointmentCalendarTool(BaseModel):
     start_date: str
     end_date: str
@@ -61,6 +81,7 @@ class CancelAppointmentTool(BaseModel):
 class HairdresserScenario(Scenario):
     name = "hairdresser"
     final_response_prompt = HAIRDRESSER_FINAL_RESPONSE_PROMPT
+    stateful_tools = ("get_order_history_tool", "book_appointment_tool", "cancel_appointment_tool")
     tools = [
         openai.pydantic_function_tool(
             CheckAppointmentCalendarTool,
@@ -106,6 +127,7 @@ class CheckCarPartOrderTool(BaseModel):
 
 class CarPartsRetailerScenario(Scenario):
     name = "car_parts_retailer"
+    stateful_tools = ("place_car_part_order_tool", "check_car_part_order_tool")
     final_response_prompt = CAR_PARTS_RETAILER_FINAL_RESPONSE_PROMPT
     tools = [
         openai.pydantic_function_tool(
@@ -151,6 +173,7 @@ class CancelBookTool(BaseModel):
 
 class BookstoreScenario(Scenario):
     name = "bookstore"
+    stateful_tools = ("view_book_order_history_tool", "reserve_book_tool", "cancel_book_tool")
     final_response_prompt = BOOKSTORE_FINAL_RESPONSE_PROMPT
     tools = [
         openai.pydantic_function_tool(
@@ -0,0 +1,193 @@
+import email.utils
+import re
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import SCRAPE_CACHE_PATH, SCRAPE_CACHE_TTL, SCRAPE_CACHE_MAX_BYTES
+from sqlite_connections import SQLiteConnections
+from metrics import metrics
+
+# Query parameters that only track where a link was shared
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|igshid)$", re.IGNORECASE)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url):
+    """Cache key for `url`: lowercase scheme and host, no default port, fragment or tracking parameters, sorted query."""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:  # malformed port or IPv6 host; the fetch reports the error
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(key)))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+def _cache_control(headers):
+    directives = {}
+    for directive in (headers.get("cache-control") or "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+def freshness(headers, default_ttl=SCRAPE_CACHE_TTL):
+    """
+    Seconds a response stays fresh, from Cache-Control max-age or Expires, else
+    `default_ttl`; None if it must not be stored at all.
+    """
+    directives = _cache_control(headers)
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            age = int(headers.get("age") or 0)
+            return max(int(directives["max-age"]) - age, 0)
+        except ValueError:
+            pass
+    if headers.get("expires"):
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["expires"]).timestamp()
+            return max(expires - time.time(), 0)
+        except (TypeError, ValueError):
+            return 0
+    return default_ttl
+
+class ScrapeEntry:
+    __slots__ = ("key", "text", "etag", "last_modified", "expires_at", "body_bytes")
+
+    def __init__(self, key, text, etag, last_modified, expires_at, body_bytes):
+        self.key = key
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.body_bytes = body_bytes
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+    def conditional_headers(self):
+        """Headers asking the server to answer 304 if the page hasn't changed."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class ScrapeCache:
+    """
+    Extracted text of scraped pages in SQLite, keyed by normalized URL, with the
+    ETag and Last-Modified headers for conditional revalidation. Entries are fresh
+    for as long as Cache-Control or Expires allow, else `ttl` seconds; the least
+    recently used are evicted beyond `max_bytes` of text.
+    """
+    def __init__(self, path=SCRAPE_CACHE_PATH, ttl=SCRAPE_CACHE_TTL, max_bytes=SCRAPE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._connections = SQLiteConnections(path)
+        self._initialized = False
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+
+    def _conn(self):
+        conn = self._connections.get()
+        if not self._initialized:
+            with self._lock:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS scrape_cache (
+                        key TEXT PRIMARY KEY,
+                        text TEXT,
+                        etag TEXT,
+                        last_modified TEXT,
+                        expires_at REAL,
+                        body_bytes INTEGER,
+                        size INTEGER,
+                        last_used REAL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_scrape_cache_last_used ON scrape_cache (last_used)")
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def get(self, url):
+        """The cached entry for `url`, fresh or not, or None."""
+        key = normalize_url(url)
+        conn = self._conn()
+        row = conn.execute("SELECT text, etag, last_modified, expires_at, body_bytes FROM scrape_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE scrape_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return ScrapeEntry(key, *row)
+
+    def put(self, url, text, headers, body_bytes):
+        """Store the text extracted from a 200 response, unless its headers forbid it."""
+        ttl = freshness(headers, self.ttl)
+        if ttl is None:
+            metrics.inc("scrape_cache.not_stored")
+            return
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO scrape_cache (key, text, etag, last_modified, expires_at, body_bytes, size, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (normalize_url(url), text, headers.get("etag"), headers.get("last-modified"), now + ttl, body_bytes, size, now))
+        self._evict(conn)
+
+    def refresh(self, entry, headers):
+        """Extend a revalidated entry after a 304, with validators and freshness from the new headers."""
+        ttl = freshness(headers, self.ttl)
+        conn = self._conn()
+        with conn:
+            if ttl is None:
+                conn.execute("DELETE FROM scrape_cache WHERE key = ?", (entry.key,))
+                return
+            conn.execute("""
+                UPDATE scrape_cache SET etag = ?, last_modified = ?, expires_at = ?, last_used = ? WHERE key = ?
+            """, (headers.get("etag") or entry.etag, headers.get("last-modified") or entry.last_modified, time.time() + ttl, time.time(), entry.key))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM scrape_cache").fetchone()[0]
+        metrics.set_gauge("scrape_cache.bytes", total)
+        if total <= self.max_bytes:
+            return
+        with conn:
+            evicted = 0
+            for key, size in conn.execute("SELECT key, size FROM scrape_cache ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM scrape_cache WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        metrics.inc("scrape_cache.evictions", evicted)
+        metrics.set_gauge("scrape_cache.bytes", total)
+
+    def record(self, outcome, entry=None):
+        """
+        Count a lookup as "hit" (served fresh), "revalidated" (304), "stale" (served
+        after a failed fetch) or "miss"; everything but a miss saved the page download.
+        """
+        metrics.inc(f"scrape_cache.{outcome}")
+        with self._lock:
+            self._lookups += 1
+            if outcome != "miss":
+                self._hits += 1
+            hit_rate = self._hits / self._lookups
+        metrics.set_gauge("scrape_cache.hit_rate", round(hit_rate, 3))
+        if entry is not None and outcome != "miss":
+            metrics.inc("scrape_cache.bytes_saved", entry.body_bytes or 0)
+
+scrape_cache = ScrapeCache() if SCRAPE_CACHE_MAX_BYTES > 0 else None
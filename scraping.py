@@ -1,34 +1,109 @@
+import asyncio
 import requests
+import httpx
 from bs4 import BeautifulSoup
+from scrape_cache import scrape_cache
+
+# Shared async HTTP client, created lazily inside the running event loop
+_async_http_client = None
+
+def extract_text(html):
+    """
+    Extracts text only from relevant semantic tags and includes image alt text.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    # General case: extract text only from relevant semantic tags
+    semantic_tags = [
+        "article", "section", "header", "footer", "main", "nav", "aside",
+        "h1", "h2", "h3", "h4", "h5", "h6", "p", "blockquote", "figcaption",
+        "table", "thead", "tbody", "tfoot", "tr", "th", "td",
+        "ul", "ol", "li", "dl", "dt", "dd"
+    ]
+    semantic_elements = soup.find_all(semantic_tags)
+    text = "\n".join(elem.get_text(separator=" ") for elem in semantic_elements)
+
+    # Include image alt texts
+    image_alts = [img.get("alt", "") for img in soup.find_all("img") if img.get("alt")]
+    if image_alts:
+        text += "\n\nImage Descriptions:\n" + "\n".join(image_alts)
+
+    # Clean up excessive whitespace
+    return " ".join(text.split())
+
+def _cached_entry(url):
+    """The cached entry for `url`, fresh or stale, or None if there is none or caching is off."""
+    if scrape_cache is None:
+        return None
+    return scrape_cache.get(url)
+
+def _from_cache(entry, resp):
+    """Text for a response with a cached entry: the cached text on 304, else None."""
+    if entry is not None and resp.status_code == 304:
+        scrape_cache.refresh(entry, resp.headers)
+        scrape_cache.record("revalidated", entry)
+        return entry.text
+    return None
+
+def _store(url, entry, resp, text):
+    if scrape_cache is None:
+        return
+    scrape_cache.record("miss", entry)
+    scrape_cache.put(url, text, resp.headers, len(resp.content))
 
 def scrape_text(url):
     """
     Fetches the URL and processes text based on site type.
     If the site is 'nettimokki', extracts specific sections and applies replacements.
     Otherwise, extracts text only from relevant semantic tags and includes image alt text.
+    Pages are served from the scrape cache while fresh and revalidated once stale;
+    if the fetch fails, a stale cached copy is returned.
     """
+    entry = None
     try:
-        resp = requests.get(url, timeout=10)
+        entry = _cached_entry(url)
+        if entry is not None and entry.fresh:
+            scrape_cache.record("hit", entry)
+            return entry.text
+        resp = requests.get(url, timeout=10, headers=entry.conditional_headers() if entry else None)
+        cached_text = _from_cache(entry, resp)
+        if cached_text is not None:
+            return cached_text
         resp.raise_for_status()  # Raise error if not 200
-        soup = BeautifulSoup(resp.text, "html.parser")
-        # General case: extract text only from relevant semantic tags
-        semantic_tags = [
-            "article", "section", "header", "footer", "main", "nav", "aside",
-            "h1", "h2", "h3", "h4", "h5", "h6", "p", "blockquote", "figcaption",
-            "table", "thead", "tbody", "tfoot", "tr", "th", "td",
-            "ul", "ol", "li", "dl", "dt", "dd"
-        ]
-        semantic_elements = soup.find_all(semantic_tags)
-        text = "\n".join(elem.get_text(separator=" ") for elem in semantic_elements)
-
-        # Include image alt texts
-        image_alts = [img.get("alt", "") for img in soup.find_all("img") if img.get("alt")]
-        if image_alts:
-            text += "\n\nImage Descriptions:\n" + "\n".join(image_alts)
-
-        # Clean up excessive whitespace
-        text = " ".join(text.split())
+        text = extract_text(resp.text)
+        _store(url, entry, resp, text)
+        return text
+    except Exception as e:
+        if entry is not None:
+            scrape_cache.record("stale", entry)
+            return entry.text
+        return f"Could not scrape the link: {e}"
 
+def _get_async_http_client():
+    global _async_http_client
+    if _async_http_client is None:
+        _async_http_client = httpx.AsyncClient(timeout=10, follow_redirects=True)
+    return _async_http_client
+
+async def scrape_text_async(url):
+    """
+    Async version of scrape_text. HTML parsing and cache access run in worker threads.
+    """
+    entry = None
+    try:
+        entry = await asyncio.to_thread(_cached_entry, url)
+        if entry is not None and entry.fresh:
+            scrape_cache.record("hit", entry)
+            return entry.text
+        resp = await _get_async_http_client().get(url, headers=entry.conditional_headers() if entry else None)
+        cached_text = await asyncio.to_thread(_from_cache, entry, resp)
+        if cached_text is not None:
+            return cached_text
+        resp.raise_for_status()  # Raise error if not 2xx
+        text = await asyncio.to_thread(extract_text, resp.text)
+        await asyncio.to_thread(_store, url, entry, resp, text)
         return text
     except Exception as e:
+        if entry is not None:
+            scrape_cache.record("stale", entry)
+            return entry.text
         return f"Could not scrape the link: {e}"
@@ -0,0 +1,61 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from metrics import metrics
+
+class SendScheduler:
+    """
+    Delay queue for outgoing WhatsApp sends. Workers hand off "send this at time T"
+    and move on to the next message instead of sleeping through humanization delays.
+    Sends run on one scheduler thread in time order; sends to the same chat never
+    go out earlier than one scheduled before them, so per-chat order is kept.
+    """
+    def __init__(self, name="send-scheduler"):
+        self.name = name
+        self._heap = []  # (send_at, sequence, key, func, args, kwargs)
+        self._sequence = itertools.count()
+        self._last_send_at = {}  # key -> latest scheduled send time
+        self._pending = {}  # key -> number of queued sends
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def schedule(self, key, send_at, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` at `send_at` (epoch seconds), but not before earlier
+        sends for the same `key`. Returns the time the send is scheduled for.
+        """
+        with self._condition:
+            send_at = max(send_at, self._last_send_at.get(key, 0.0))
+            self._last_send_at[key] = send_at
+            self._pending[key] = self._pending.get(key, 0) + 1
+            heapq.heappush(self._heap, (send_at, next(self._sequence), key, func, args, kwargs))
+            metrics.set_gauge("send_scheduler.pending", len(self._heap))
+            self._condition.notify()
+        return send_at
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                send_at, _, key, func, args, kwargs = heapq.heappop(self._heap)
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+                    del self._last_send_at[key]
+                metrics.set_gauge("send_scheduler.pending", len(self._heap))
+            metrics.observe("send_scheduler.lateness", max(0.0, time.time() - send_at))
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Scheduled send to {key} failed: {e}")
+
+send_scheduler = SendScheduler()
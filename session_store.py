@@ -0,0 +1,260 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    SESSION_DB_PATH,
+    SESSION_USER_BYTES,
+    SESSION_GLOBAL_BYTES,
+    SESSION_IDLE_TTL,
+    SESSION_DISK_TTL
+)
+from metrics import metrics
+
+# --- Session Content Item Class ---
+class UserSessionContentItem:
+    def __init__(self, type_: str, source: str, content: str, created_at=None):
+        self.type = type_  # 'link', 'document', 'image'
+        self.source = source  # filename or url
+        self.content = content
+        self.created_at = created_at or int(time.time())
+    def __repr__(self):
+        return f"[{self.type}] {self.source}: {self.content[:60]}..."
+    @property
+    def size(self):
+        return len(self.content.encode("utf-8"))
+
+class _Session:
+    def __init__(self, items, latest_image, spilled=0):
+        self.items = items  # oldest to newest
+        self.spilled = spilled  # number of older items only on disk
+        self.latest_image = latest_image
+        self.bytes = sum(item.size for item in items)
+        self.last_access = time.monotonic()
+
+def init_session_db():
+    """Initialize the session content database."""
+    conn = sqlite3.connect(SESSION_DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            type TEXT,
+            source TEXT,
+            content TEXT,
+            created_at INTEGER
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_items_user ON session_items (user_id, id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_images (
+            user_id TEXT PRIMARY KEY,
+            image_path TEXT,
+            updated_at INTEGER
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+class SessionStore:
+    """
+    Per-user session content (scraped pages, documents, image descriptions) and the
+    latest image path. Every item is written through to SQLite, so sessions survive
+    restarts; memory only holds a cache bounded by a per-user and a global byte budget.
+    A user's older items beyond their budget stay on disk and are read back by
+    get_items when needed. Users idle for longer than the TTL, or least recently used
+    beyond the global budget, are evicted from memory and reloaded from disk on their
+    next access.
+    """
+    def __init__(self, user_bytes=SESSION_USER_BYTES, global_bytes=SESSION_GLOBAL_BYTES, idle_ttl=SESSION_IDLE_TTL):
+        self.user_bytes = user_bytes
+        self.global_bytes = global_bytes
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # user_id -> _Session, least recently used first
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        return sqlite3.connect(SESSION_DB_PATH)
+
+    def _load(self, user_id):
+        """Load the newest items that fit the per-user budget from disk."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT type, source, content, created_at
+                FROM session_items
+                WHERE user_id = ?
+                ORDER BY id DESC
+            """, (user_id,))
+            items = []
+            total = 0
+            spilled = 0
+            for type_, source, content, created_at in rows:
+                item = UserSessionContentItem(type_, source, content, created_at)
+                if items and total + item.size > self.user_bytes:
+                    spilled = conn.execute("SELECT COUNT(*) FROM session_items WHERE user_id = ?", (user_id,)).fetchone()[0] - len(items)
+                    break
+                items.append(item)
+                total += item.size
+            row = conn.execute("SELECT image_path FROM session_images WHERE user_id = ?", (user_id,)).fetchone()
+        finally:
+            conn.close()
+        metrics.inc("session_store.disk_loads")
+        return _Session(items[::-1], row[0] if row else None, spilled)
+
+    def _load_spilled(self, user_id, count):
+        """Read the user's `count` oldest items, the ones kept only on disk."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT type, source, content, created_at
+                FROM session_items
+                WHERE user_id = ?
+                ORDER BY id
+                LIMIT ?
+            """, (user_id, count)).fetchall()
+        finally:
+            conn.close()
+        metrics.inc("session_store.spilled_loads")
+        return [UserSessionContentItem(*row) for row in rows]
+
+    def _session(self, user_id):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._load(user_id)
+            self._sessions[user_id] = session
+            self._bytes += session.bytes
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_access = time.monotonic()
+        return session
+
+    def _trim_user(self, session):
+        # Keep at least the newest item even if it alone exceeds the budget
+        while len(session.items) > 1 and session.bytes > self.user_bytes:
+            evicted = session.items.pop(0)
+            session.spilled += 1
+            session.bytes -= evicted.size
+            self._bytes -= evicted.size
+            metrics.inc("session_store.evicted_items")
+
+    def _evict(self, keep_user_id=None):
+        now = time.monotonic()
+        for user_id in list(self._sessions):
+            session = self._sessions[user_id]
+            over_budget = self._bytes > self.global_bytes
+            idle = now - session.last_access > self.idle_ttl
+            if not (over_budget or idle):
+                break  # Ordered by last access, so the rest are newer
+            if user_id == keep_user_id:
+                continue
+            del self._sessions[user_id]
+            self._bytes -= session.bytes
+            metrics.inc("session_store.evicted_sessions")
+        metrics.set_gauge("session_store.bytes", self._bytes)
+        metrics.set_gauge("session_store.sessions", len(self._sessions))
+
+    def add_item(self, user_id, item: UserSessionContentItem):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                INSERT INTO session_items (user_id, type, source, content, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (user_id, item.type, item.source, item.content, item.created_at))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            # A session loaded from disk now already holds the item
+            cached = user_id in self._sessions
+            session = self._session(user_id)
+            if cached:
+                session.items.append(item)
+                session.bytes += item.size
+                self._bytes += item.size
+                self._trim_user(session)
+            self._evict(keep_user_id=user_id)
+
+    def get_items(self, user_id):
+        """All of the user's session items, oldest first, reading those beyond the memory budget from disk."""
+        with self._lock:
+            session = self._session(user_id)
+            items = list(session.items)
+            spilled = session.spilled
+            self._evict(keep_user_id=user_id)
+        if spilled:
+            items = self._load_spilled(user_id, spilled) + items
+        return items
+
+    def set_latest_image(self, user_id, image_path):
+        conn = self._connect()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO session_images (user_id, image_path, updated_at)
+                VALUES (?, ?, ?)
+            """, (user_id, image_path, int(time.time())))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._session(user_id).latest_image = image_path
+
+    def get_latest_image(self, user_id):
+        with self._lock:
+            return self._session(user_id).latest_image
+
+    def clear(self, user_id):
+        """Remove all session content and the latest image for a user."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM session_items WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM session_images WHERE user_id = ?", (user_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session:
+                self._bytes -= session.bytes
+
+    def purge_expired(self, max_age=SESSION_DISK_TTL):
+        """Delete on-disk items older than `max_age` seconds and drop idle sessions from memory."""
+        cutoff = int(time.time()) - max_age
+        conn = self._connect()
+        try:
+            deleted = conn.execute("DELETE FROM session_items WHERE created_at < ?", (cutoff,)).rowcount
+            conn.execute("DELETE FROM session_images WHERE updated_at < ?", (cutoff,))
+            conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            # Cached sessions may hold purged items; reload them on next access
+            if deleted:
+                self._sessions.clear()
+                self._bytes = 0
+            self._evict()
+        if deleted:
+            logging.info(f"Purged {deleted} expired session items.")
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+session_store = SessionStore()
+
+def start_session_maintenance(interval=3600):
+    """Periodically purge expired session content in a background thread."""
+    def maintain():
+        while True:
+            time.sleep(interval)
+            try:
+                session_store.purge_expired()
+            except Exception as e:
+                logging.error(f"Session maintenance failed: {e}")
+
+    thread = threading.Thread(target=maintain, name="session-maintenance", daemon=True)
+    thread.start()
+    return thread
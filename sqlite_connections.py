@@ -0,0 +1,52 @@
+import logging
+import sqlite3
+import threading
+from config import SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_STATEMENT_CACHE
+
+class SQLiteConnections:
+    """
+    One long-lived connection to `path` per thread, so calls don't pay for opening
+    the database and keep their prepared statements (up to SQLITE_STATEMENT_CACHE per
+    connection). Connections use WAL, so readers don't block on a writer, with
+    synchronous=NORMAL and the configured page cache and memory-mapped I/O sizes.
+    `setup(conn)`, if given, runs on every new connection, e.g. to register functions.
+    """
+    def __init__(self, path, setup=None):
+        self.path = path
+        self.setup = setup
+        self._local = threading.local()
+        self._connections = []
+        self._generation = 0  # bumped by close_all, so threads reopen afterwards
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, cached_statements=SQLITE_STATEMENT_CACHE, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.setup:
+            self.setup(conn)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def get(self):
+        """This thread's connection. Use it as a context manager to commit or roll back a transaction."""
+        if getattr(self._local, "generation", None) != self._generation:
+            self._local.conn = self._open()
+            self._local.generation = self._generation
+        return self._local.conn
+
+    def close_all(self):
+        """Checkpoint the WAL and close every connection, e.g. on shutdown."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.close()
+            except sqlite3.Error as e:
+                logging.warning(f"Closing SQLite connection to {self.path} failed: {e}")
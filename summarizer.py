@@ -0,0 +1,63 @@
+import logging
+import queue
+import threading
+from config import SUMMARY_BATCH_MESSAGES, SUMMARY_TAIL_MESSAGES, SUMMARY_INPUT_TOKENS
+from database import get_summary, save_summary, get_messages_after
+from llm import generate_summary
+from prompt_assembler import fit_history
+from metrics import metrics
+
+class ConversationSummarizer:
+    """
+    Keeps a rolling summary of each conversation off the reply path. Once at least
+    `batch` messages have built up beyond the newest `tail` ones, they are folded into
+    the user's summary with one LLM call on a background thread; prompts then use the
+    summary plus the messages after it, so their size stays roughly constant.
+    """
+    def __init__(self, batch=SUMMARY_BATCH_MESSAGES, tail=SUMMARY_TAIL_MESSAGES):
+        self.batch = batch
+        self.tail = tail
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="summarizer", daemon=True)
+        thread.start()
+        return thread
+
+    def notify(self, user_id):
+        """Check the user's conversation for messages to summarize; returns immediately."""
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._queue.put(user_id)
+
+    def _run(self):
+        while True:
+            user_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(user_id)
+            try:
+                self.summarize(user_id)
+            except Exception as e:
+                logging.error(f"Summarizing conversation of {user_id} failed: {e}")
+
+    def summarize(self, user_id):
+        """Fold older unsummarized messages into the summary if enough have built up."""
+        summary, last_message_id = get_summary(user_id)
+        rows = sorted(get_messages_after(user_id, last_message_id))  # by id, so the boundary is exact
+        if len(rows) < self.batch + self.tail:
+            return False
+        folded = rows[:-self.tail]
+        transcript, _ = fit_history([row[1:] for row in folded], SUMMARY_INPUT_TOKENS)
+        new_summary = generate_summary(summary, transcript)
+        if not new_summary:
+            return False
+        save_summary(user_id, new_summary, folded[-1][0])
+        metrics.inc("summarizer.summaries")
+        logging.info(f"Folded {len(folded)} messages into the conversation summary of {user_id}.")
+        return True
+
+conversation_summarizer = ConversationSummarizer()
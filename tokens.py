@@ -0,0 +1,37 @@
+from functools import lru_cache
+from config import OPENAI_MODEL_NAME
+
+try:
+    import tiktoken
+except ImportError:  # Listed in requirements.txt; the estimate is only a fallback
+    tiktoken = None
+
+@lru_cache(maxsize=None)
+def _encoding(model=OPENAI_MODEL_NAME):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text, model=OPENAI_MODEL_NAME):
+    """Count tokens locally with tiktoken, or estimate ~4 characters per token without it."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model=OPENAI_MODEL_NAME):
+    """Cut `text` down to at most `max_tokens` tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
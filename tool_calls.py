@@ -1,56 +1,153 @@
+import asyncio
+import json
 import random
 import base64
 import mimetypes
 import os
 from PIL import Image
 import io
-from config import (
-    OPENAI_MODEL_NAME,
-    OPENAI_API_KEY
-)
-import openai
-from openai.types.chat import ParsedFunctionToolCall
+from config import OPENAI_MODEL_NAME
+from openai.types.chat.parsed_function_tool_call import ParsedFunction, ParsedFunctionToolCall
+from types import SimpleNamespace
 import logging
-from scraping import scrape_text
+from scraping import scrape_text, scrape_text_async
+from response_cache import response_cache, caching_enabled, cacheable_tool_calls
 from ddgs import DDGS
 from filelogger import FileLogger
 fileLogger = FileLogger()
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+from openai_client import client, async_client, resilient_client
 
-def poll_llm_for_tool_choice(user_message, past_user_message, user_context, available_tools) -> ParsedFunctionToolCall | None:
-    """
-    Poll the LLM to decide which tool to call for a user request.
-    Returns the tool call(s) and arguments if any.
-    """
-    system_prompt = f"""Select zero or one tool to call based on the user message.
+# Static instructions come first so every poll shares a cacheable prompt prefix
+TOOL_POLL_INSTRUCTIONS = """Select zero or more tools to call based on the user message.
     We don't want to call tools for every user message, only when necessary.
+    If the user asks for several things at once, call every tool needed in one response.
     If you don't need to call a tool, just return an empty list.
-    Here is the past user message:
+    """
+
+def _tool_poll_messages(user_message, past_user_message, user_context, hint_tool=None):
+    system_prompt = TOOL_POLL_INSTRUCTIONS + f"""Here is the user given additional context:
     ---
-    {past_user_message}
+    {user_context}
     ---
-    Here is the user given additional context:
+    Here is the past user message:
     ---
-    {user_context}
+    {past_user_message}
     ---
     """
+    if hint_tool:
+        system_prompt += f"The message contains keywords of {hint_tool}; call it only if the user actually asks for it.\n"
     messages = []
     messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": user_message})
+    return messages
+
+def _tool_calls(completion):
+    fileLogger.log(f"[POLL_LLM_FOR_TOOL_CHOICE] [COMPLETION]: {str(completion)}")
+    tool_calls = completion.choices[0].message.tool_calls or []
+    fileLogger.log(f"[POLL_LLM_FOR_TOOL_CHOICE] [TOOL_CALLS]: {str(tool_calls)}")
+    return tool_calls
+
+def _tool_choice_options(available_tools, forced_tool):
+    """Offer all tools, or only `forced_tool` with the model required to call it."""
+    if forced_tool is None:
+        return {"tools": available_tools}
+    return {
+        "tools": [tool for tool in available_tools if tool["function"]["name"] == forced_tool],
+        "tool_choice": {"type": "function", "function": {"name": forced_tool}},
+    }
+
+def _poll_cache_key(messages, available_tools, forced_tool):
+    """The poll's system prompt plus the offered tools, as the cache's system prompt."""
+    tool_names = [tool["function"]["name"] for tool in available_tools]
+    return json.dumps([messages[0]["content"], tool_names, forced_tool])
+
+def _cached_tool_calls(cache_key, user_message):
+    if not caching_enabled():
+        return None
+    # Tool arguments come from the exact message, so similar messages can't share them
+    cached = response_cache.get("tool_poll", cache_key, user_message, semantic=False)
+    if cached is None:
+        return None
+    # Parsed arguments are only read by attribute, so a namespace stands in for the pydantic model
+    return [
+        ParsedFunctionToolCall(
+            id=call["id"],
+            type="function",
+            function=ParsedFunction(name=call["name"], arguments=call["arguments"], parsed_arguments=SimpleNamespace(**json.loads(call["arguments"]))),
+        )
+        for call in json.loads(cached)
+    ]
+
+def _cache_tool_calls(cache_key, user_message, tool_calls):
+    if not caching_enabled() or not cacheable_tool_calls([tool_call.function.name for tool_call in tool_calls]):
+        return
+    calls = [{"id": tool_call.id, "name": tool_call.function.name, "arguments": tool_call.function.arguments} for tool_call in tool_calls]
+    response_cache.put("tool_poll", cache_key, user_message, json.dumps(calls), semantic=False)
+
+def poll_llm_for_tool_choice(user_message, past_user_message, user_context, available_tools, forced_tool=None, hint_tool=None) -> list[ParsedFunctionToolCall]:
+    """
+    Poll the LLM to decide which tools to call for a user request.
+    Returns all tool calls with their parsed arguments; empty if none are needed.
+    With `forced_tool` the tool is already chosen and the LLM only fills in its arguments;
+    `hint_tool` is a tool the message's keywords point to, left for the LLM to confirm.
+    """
+    messages = _tool_poll_messages(user_message, past_user_message, user_context, hint_tool)
+    cache_key = _poll_cache_key(messages, available_tools, forced_tool)
+    cached = _cached_tool_calls(cache_key, user_message)
+    if cached is not None:
+        return cached
     try:
-        completion = client.beta.chat.completions.parse(
+        completion = resilient_client.call(
+            "tool_poll",
+            client.beta.chat.completions.parse,
             model=OPENAI_MODEL_NAME,
             messages=messages,
-            tools=available_tools,
+            **_tool_choice_options(available_tools, forced_tool),
         )
-        fileLogger.log(f"[POLL_LLM_FOR_TOOL_CHOICE] [COMPLETION]: {str(completion)}")
-        tool_call = completion.choices[0].message.tool_calls[0] or None
-        fileLogger.log(f"[POLL_LLM_FOR_TOOL_CHOICE] [TOOL_CALLS]: {str(tool_call)}")
-        return tool_call
+        tool_calls = _tool_calls(completion)
+        _cache_tool_calls(cache_key, user_message, tool_calls)
+        return tool_calls
     except Exception as e:
         logging.error(f"Tool polling LLM failed: {e}")
-        return None
+        return []
+
+async def poll_llm_for_tool_choice_async(user_message, past_user_message, user_context, available_tools, forced_tool=None, hint_tool=None) -> list[ParsedFunctionToolCall]:
+    """
+    Async version of poll_llm_for_tool_choice.
+    """
+    messages = _tool_poll_messages(user_message, past_user_message, user_context, hint_tool)
+    cache_key = _poll_cache_key(messages, available_tools, forced_tool)
+    cached = _cached_tool_calls(cache_key, user_message)
+    if cached is not None:
+        return cached
+    try:
+        completion = await resilient_client.call_async(
+            "tool_poll",
+            async_client.beta.chat.completions.parse,
+            model=OPENAI_MODEL_NAME,
+            messages=messages,
+            **_tool_choice_options(available_tools, forced_tool),
+        )
+        tool_calls = _tool_calls(completion)
+        _cache_tool_calls(cache_key, user_message, tool_calls)
+        return tool_calls
+    except Exception as e:
+        logging.error(f"Tool polling LLM failed: {e}")
+        return []
+
+def _upload(file_path):
+    """File contents as an SDK upload; unlike an open file it can be resent on retries."""
+    with open(file_path, "rb") as f:
+        return (os.path.basename(file_path), f.read())
+
+def _save_tts_audio(content):
+    filename = f"tts_output_{random.randint(1, 9999999)}.mp3"
+    filepath = os.path.join("audio", filename)
+    with open(filepath, "wb") as audio_file:
+        audio_file.write(content)
+    logging.info(f"Audio saved to {filepath}")
+    return filepath
 
 def text_to_speech_with_openai(text):
     """
@@ -58,43 +155,80 @@ def text_to_speech_with_openai(text):
     Returns the audio file path.
     """
     try:
-        response = client.audio.speech.create(
+        response = resilient_client.call(
+            "tts",
+            client.audio.speech.create,
+            model="gpt-4o-mini-tts",
+            input=text,
+            voice="alloy",
+            response_format="mp3",
+        )
+        return _save_tts_audio(response.content)
+    except Exception as e:
+        logging.error(f"OpenAI TTS API Request Failed: {e}")
+        return None
+
+async def text_to_speech_with_openai_async(text):
+    """
+    Async version of text_to_speech_with_openai.
+    """
+    try:
+        response = await resilient_client.call_async(
+            "tts",
+            async_client.audio.speech.create,
             model="gpt-4o-mini-tts",
             input=text,
             voice="alloy",
             response_format="mp3",
         )
-        filename = f"tts_output_{random.randint(1, 9999999)}.mp3"
-        filepath = os.path.join("audio", filename)
-        with open(filepath, "wb") as audio_file:
-            audio_file.write(response.content)
-        logging.info(f"Audio saved to {filepath}")
-        return filepath
+        return await asyncio.to_thread(_save_tts_audio, response.content)
     except Exception as e:
         logging.error(f"OpenAI TTS API Request Failed: {e}")
         return None
 
+def _save_b64_image(b64_json, prefix):
+    image_data = base64.b64decode(b64_json)
+    image = Image.open(io.BytesIO(image_data))
+    filename = f"{prefix}_{random.randint(1, 9999999)}.png"
+    filepath = os.path.join("images", filename)
+    image.save(filepath)
+    return filepath
+
 def generate_image_with_openai(prompt):
     """
     Generate an image from a prompt using OpenAI's image API (GPT-Image-1).
     """
     try:
-        response = client.images.generate(
+        response = resilient_client.call(
+            "image",
+            client.images.generate,
             prompt=prompt,
             model="gpt-image-1",
             quality="medium",
             n=1
         )
-        image_data = base64.b64decode(response.data[0].b64_json)
-        image = Image.open(io.BytesIO(image_data))
-        filename = f"gptimage1_generated_{random.randint(1, 9999999)}.png"
-        filepath = os.path.join("images", filename)
-        image.save(filepath)
-        return filepath
+        return _save_b64_image(response.data[0].b64_json, "gptimage1_generated")
     except Exception as e:
         logging.error(f"OpenAI Image Generation Failed: {e}")
         return None
 
+async def generate_image_with_openai_async(prompt):
+    """
+    Async version of generate_image_with_openai.
+    """
+    try:
+        response = await resilient_client.call_async(
+            "image",
+            async_client.images.generate,
+            prompt=prompt,
+            model="gpt-image-1",
+            quality="medium",
+            n=1
+        )
+        return await asyncio.to_thread(_save_b64_image, response.data[0].b64_json, "gptimage1_generated")
+    except Exception as e:
+        logging.error(f"OpenAI Image Generation Failed: {e}")
+        return None
 
 def edit_image_with_openai(image_path, prompt):
     """
@@ -102,48 +236,86 @@ def edit_image_with_openai(image_path, prompt):
     Requires an input image file path and a prompt.
     """
     try:
-        with open(image_path, "rb") as image_file:
-            response = client.images.edit(
-                image=image_file,
-                prompt=prompt,
-                model="gpt-image-1",
-                quality="medium",
-                n=1
-            )
-        image_data = base64.b64decode(response.data[0].b64_json)
-        image = Image.open(io.BytesIO(image_data))
-        filename = f"gptimage1_edited_{random.randint(1, 9999999)}.png"
-        filepath = os.path.join("images", filename)
-        image.save(filepath)
-        return filepath
+        response = resilient_client.call(
+            "image",
+            client.images.edit,
+            image=_upload(image_path),
+            prompt=prompt,
+            model="gpt-image-1",
+            quality="medium",
+            n=1
+        )
+        return _save_b64_image(response.data[0].b64_json, "gptimage1_edited")
     except Exception as e:
         logging.error(f"OpenAI Image Editing Failed: {e}")
         return None
 
-def describe_image_with_gpt(image_path_or_url, prompt_text="Describe the image.", detail="low"):
+async def edit_image_with_openai_async(image_path, prompt):
     """
-    Describe an image using OpenAI's GPT-4o Vision API via openai-python.
-    Accepts a local image file path or an image URL.
+    Async version of edit_image_with_openai.
     """
+    try:
+        response = await resilient_client.call_async(
+            "image",
+            async_client.images.edit,
+            image=await asyncio.to_thread(_upload, image_path),
+            prompt=prompt,
+            model="gpt-image-1",
+            quality="medium",
+            n=1
+        )
+        return await asyncio.to_thread(_save_b64_image, response.data[0].b64_json, "gptimage1_edited")
+    except Exception as e:
+        logging.error(f"OpenAI Image Editing Failed: {e}")
+        return None
+
+def _vision_messages(image_path_or_url, prompt_text, detail):
     # Determine if input is a file path or URL
+    image_url = image_path_or_url
     if os.path.isfile(image_path_or_url):
         mime_type, _ = mimetypes.guess_type(image_path_or_url)
         with open(image_path_or_url, "rb") as img_file:
             b64_image = base64.b64encode(img_file.read()).decode("utf-8")
         image_url = f"data:{mime_type};base64,{b64_image}"
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt_text},
+                {"type": "image_url", "image_url": {"url": image_url, "detail": detail}},
+            ],
+        }
+    ]
 
+def describe_image_with_gpt(image_path_or_url, prompt_text="Describe the image.", detail="low"):
+    """
+    Describe an image using OpenAI's GPT-4o Vision API via openai-python.
+    Accepts a local image file path or an image URL.
+    """
     try:
-        completion = client.chat.completions.create(
+        completion = resilient_client.call(
+            "vision",
+            client.chat.completions.create,
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt_text},
-                        {"type": "image_url", "image_url": {"url": image_url, "detail": detail}},
-                    ],
-                }
-            ],
+            messages=_vision_messages(image_path_or_url, prompt_text, detail),
+            max_tokens=300,
+        )
+        return completion.choices[0].message.content.strip()
+    except Exception as e:
+        logging.error(f"OpenAI Vision API Request Failed: {e}")
+        return "Error with OpenAI Vision API request."
+
+async def describe_image_with_gpt_async(image_path_or_url, prompt_text="Describe the image.", detail="low"):
+    """
+    Async version of describe_image_with_gpt.
+    """
+    try:
+        messages = await asyncio.to_thread(_vision_messages, image_path_or_url, prompt_text, detail)
+        completion = await resilient_client.call_async(
+            "vision",
+            async_client.chat.completions.create,
+            model="gpt-4o",
+            messages=messages,
             max_tokens=300,
         )
         return completion.choices[0].message.content.strip()
@@ -157,8 +329,18 @@ def transcribe_audio_with_whisper(audio_file_path):
     Accepts a local audio file path. Optionally, a prompt for better accuracy.
     """
     try:
-        with open(audio_file_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(model="whisper-1", file=audio_file)
+        transcription = resilient_client.call("transcription", client.audio.transcriptions.create, model="whisper-1", file=_upload(audio_file_path))
+        return transcription.text.strip()
+    except Exception as e:
+        logging.error(f"OpenAI Whisper API Request Failed: {e}")
+        return "Error with OpenAI Whisper API request."
+
+async def transcribe_audio_with_whisper_async(audio_file_path):
+    """
+    Async version of transcribe_audio_with_whisper.
+    """
+    try:
+        transcription = await resilient_client.call_async("transcription", async_client.audio.transcriptions.create, model="whisper-1", file=await asyncio.to_thread(_upload, audio_file_path))
         return transcription.text.strip()
     except Exception as e:
         logging.error(f"OpenAI Whisper API Request Failed: {e}")
@@ -181,4 +363,26 @@ def web_search(query):
         fileLogger.log(f"[WEB_SEARCH] [RESULTS]: {str(results)}")
         return results
     except Exception as e:
-        return [{"error": f"Web search failed: {e}"}]
\ No newline at end of file
+        return [{"error": f"Web search failed: {e}"}]
+
+async def web_search_async(query):
+    """
+    Async version of web_search. The top results are scraped concurrently.
+    """
+    try:
+        ddgs = await asyncio.to_thread(lambda: DDGS().text(query, max_results=3, backend="duckduckgo"))
+        fileLogger.log(f"[WEB_SEARCH] [DDGS RESULTS]: {str(ddgs)}")
+        texts = await asyncio.gather(
+            *(scrape_text_async(result['href']) for result in ddgs),
+            return_exceptions=True,
+        )
+        results = []
+        for result, text in zip(ddgs, texts):
+            if isinstance(text, Exception):
+                results.append({"url": result['href'], "snippet": f"Failed to scrape: {text}"})
+            else:
+                results.append({"url": result['href'], "snippet": text})
+        fileLogger.log(f"[WEB_SEARCH] [RESULTS]: {str(results)}")
+        return results
+    except Exception as e:
+        return [{"error": f"Web search failed: {e}"}]
@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from config import SCENARIO, TOOL_TIMEOUT, TOOL_MAX_WORKERS, SEARCH_HISTORY_RESULTS
+from send_scheduler import send_scheduler
+from llm import generate_wait_message, generate_wait_message_async
+from session_store import session_store
+from database import search_messages
+from tool_calls import (
+    text_to_speech_with_openai,
+    generate_image_with_openai,
+    edit_image_with_openai,
+    web_search,
+    text_to_speech_with_openai_async,
+    generate_image_with_openai_async,
+    edit_image_with_openai_async,
+    web_search_async
+)
+import tool_calls_dummy as dummy
+from metrics import metrics
+
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_MAX_WORKERS, thread_name_prefix="tool")
+
+class ToolContext:
+    """Per-turn state handed to tool handlers."""
+    def __init__(self, client, chat, sender_id, user_message):
+        self.client = client
+        self.chat = chat
+        self.sender_id = sender_id
+        self.user_message = user_message
+
+class ToolSpec:
+    """
+    A tool handler and its argument validation.
+    `required` lists arguments that must be present and non-empty; `missing_message`
+    is returned to the model when one is missing. Tools sharing a `resource` run one
+    after another in the order the model requested them; all others run in parallel.
+    A call running past `timeout` seconds is reported as timed out, and the calls
+    queued after it on the same resource are not run.
+    """
+    def __init__(self, name, handler, required=(), missing_message=None, async_handler=None, timeout=TOOL_TIMEOUT, resource=None):
+        self.name = name
+        self.handler = handler
+        self.required = required
+        self.missing_message = missing_message or f"Missing arguments for {name}."
+        self.async_handler = async_handler
+        self.timeout = timeout
+        self.resource = resource
+
+    def validate(self, args):
+        """Returns an error message if a required argument is missing, else None."""
+        for field in self.required:
+            value = getattr(args, field, None)
+            if value is None or value == "":
+                return self.missing_message
+        return None
+
+# --- Base scenario handlers ---
+
+def _format_search_results(search_results):
+    result_strings = []
+    for result in search_results:
+        url = result.get("url", "")
+        snippet = result.get("snippet", "")
+        result_strings.append(f"{url}\n{snippet}\n")
+    return "\n".join(result_strings)
+
+def _web_search(ctx, args):
+    return _format_search_results(web_search(args.query))
+
+async def _web_search_async(ctx, args):
+    return _format_search_results(await web_search_async(args.query))
+
+TTS_SENT = "Audio generated successfully. It will be sent before this message. Please act like you just generated and sent the audio successfully for the user."
+IMAGE_SENT = "Image generated successfully. It will be sent before this message. Please act like you just generated and sent the image successfully for the user."
+EDITED_IMAGE_SENT = "Image edited successfully. It will be sent before this message. Please act like you just generated and sent the edited image successfully for the user."
+
+def _generate_tts(ctx, args):
+    audio_path = text_to_speech_with_openai(args.text)
+    if not audio_path:
+        return "Error generating audio."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_audio, ctx.chat, audio_path)
+    return TTS_SENT
+
+async def _generate_tts_async(ctx, args):
+    audio_path = await text_to_speech_with_openai_async(args.text)
+    if not audio_path:
+        return "Error generating audio."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_audio, ctx.chat, audio_path)
+    return TTS_SENT
+
+def _generate_image(ctx, args):
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_message, ctx.chat, generate_wait_message(user_text=ctx.user_message, user_id=ctx.sender_id))
+    image_path = generate_image_with_openai(args.prompt)
+    session_store.set_latest_image(ctx.sender_id, image_path)
+    if not image_path:
+        return "Error generating image."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_image, ctx.chat, image_path)
+    return IMAGE_SENT
+
+async def _generate_image_async(ctx, args):
+    wait_message = await generate_wait_message_async(user_text=ctx.user_message, user_id=ctx.sender_id)
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_message, ctx.chat, wait_message)
+    image_path = await generate_image_with_openai_async(args.prompt)
+    await asyncio.to_thread(session_store.set_latest_image, ctx.sender_id, image_path)
+    if not image_path:
+        return "Error generating image."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_image, ctx.chat, image_path)
+    return IMAGE_SENT
+
+def _edit_image(ctx, args):
+    image_path = session_store.get_latest_image(ctx.sender_id)
+    if not image_path:
+        return "Missing image path or prompt for image editing."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_message, ctx.chat, generate_wait_message(user_text=ctx.user_message, user_id=ctx.sender_id))
+    edited_image_path = edit_image_with_openai(image_path, args.prompt)
+    if not edited_image_path:
+        return "Error editing image."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_image, ctx.chat, edited_image_path)
+    return EDITED_IMAGE_SENT
+
+async def _edit_image_async(ctx, args):
+    image_path = await asyncio.to_thread(session_store.get_latest_image, ctx.sender_id)
+    if not image_path:
+        return "Missing image path or prompt for image editing."
+    wait_message = await generate_wait_message_async(user_text=ctx.user_message, user_id=ctx.sender_id)
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_message, ctx.chat, wait_message)
+    edited_image_path = await edit_image_with_openai_async(image_path, args.prompt)
+    if not edited_image_path:
+        return "Error editing image."
+    send_scheduler.schedule(ctx.sender_id, time.time(), ctx.client.send_image, ctx.chat, edited_image_path)
+    return EDITED_IMAGE_SENT
+
+# --- History search, offered in any scenario with search_history ---
+
+def _search_history(ctx, args):
+    results = search_messages(args.query, user_id=ctx.sender_id, limit=SEARCH_HISTORY_RESULTS)
+    if not results:
+        return "No earlier messages matched the search."
+    lines = []
+    for _, _, snippet, timestamp, from_me in results:
+        date = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"[{date}] {'ASSISTANT' if from_me else 'USER'}: {snippet}")
+    return "Earlier messages matching the search, best match first:\n" + "\n".join(lines)
+
+async def _search_history_async(ctx, args):
+    return await asyncio.to_thread(_search_history, ctx, args)
+
+# --- Hairdresser scenario handlers ---
+
+def _check_appointment_calendar(ctx, args):
+    result = dummy.dummy_check_appointment_calendar_tool(args.start_date, args.end_date)
+    return f"Available slots: {result['available_slots']}\n{result['message']}"
+
+def _get_services(ctx, args):
+    result = dummy.dummy_get_services_tool(args.gender)
+    return f"Services for {args.gender}: {result['services']}"
+
+def _get_order_history(ctx, args):
+    result = dummy.dummy_get_order_history_tool(args.phone_number)
+    return f"Order history: {result['history']}"
+
+def _book_appointment(ctx, args):
+    result = dummy.dummy_book_appointment_tool(args.phone_number, args.service, args.preferred_time)
+    return f"{result['message']} (Confirmation: {result['confirmation_number']})"
+
+def _cancel_appointment(ctx, args):
+    return dummy.dummy_cancel_appointment_tool(args.phone_number)["message"]
+
+# --- Car parts retailer scenario handlers ---
+
+def _find_car_info_with_plate(ctx, args):
+    result = dummy.dummy_find_car_info_with_plate_tool(args.license_plate)
+    return f"Car info: {result['car']}"
+
+def _find_compatible_part(ctx, args):
+    result = dummy.dummy_find_compatible_part_tool(args.license_plate, args.part_type)
+    return f"Compatible parts: {result['compatible_parts']}"
+
+def _place_car_part_order(ctx, args):
+    result = dummy.dummy_place_car_part_order_tool(args.phone_number, args.part_id, args.quantity)
+    return f"Order placed: {result['order_id']} (Est. delivery: {result['estimated_delivery']})"
+
+def _check_car_part_order(ctx, args):
+    result = dummy.dummy_check_car_part_order_tool(args.phone_number)
+    return f"Orders: {result['orders']}"
+
+# --- Bookstore scenario handlers ---
+
+def _view_book_order_history(ctx, args):
+    result = dummy.dummy_view_book_order_history_tool(args.phone_number)
+    return f"Book order history: {result['orders']}"
+
+def _suggest_books(ctx, args):
+    result = dummy.dummy_suggest_books_tool(getattr(args, "genre", None), getattr(args, "author", None))
+    return f"Suggestions: {result['suggestions']}"
+
+def _check_book_stock(ctx, args):
+    result = dummy.dummy_check_book_stock_tool(args.title, getattr(args, "author", None))
+    return f"Book stock: {result}"
+
+def _reserve_book(ctx, args):
+    result = dummy.dummy_reserve_book_tool(args.phone_number, args.title)
+    return f"Book reserved: {result['reservation_id']} (Pickup by {result['pickup_deadline']})"
+
+def _cancel_book(ctx, args):
+    return dummy.dummy_cancel_book_tool(args.phone_number, args.title)["message"]
+
+# Scenario name -> ToolSpecs of its own tools. Tool names match the schemas in scenarios.py.
+_SCENARIO_TOOLS = {
+    "base": [
+        ToolSpec("web_search_tool", _web_search, ("query",), "No search query provided.", _web_search_async, timeout=30),
+        ToolSpec("generate_tts_tool", _generate_tts, ("text",), "No text provided for TTS generation.", _generate_tts_async),
+        ToolSpec("generate_image_tool", _generate_image, ("prompt",), "No prompt provided for image generation.", _generate_image_async, timeout=180, resource="image"),
+        ToolSpec("edit_image_tool", _edit_image, ("prompt",), "Missing image path or prompt for image editing.", _edit_image_async, timeout=180, resource="image"),
+    ],
+    "hairdresser": [
+        ToolSpec("check_appointment_calendar_tool", _check_appointment_calendar, ("start_date", "end_date"), "Missing start or end date for appointment calendar check."),
+        ToolSpec("get_services_tool", _get_services, ("gender",), "No gender provided for get services tool."),
+        ToolSpec("get_order_history_tool", _get_order_history, ("phone_number",), "No phone number provided for order history retrieval."),
+        ToolSpec("book_appointment_tool", _book_appointment, ("phone_number", "service", "preferred_time"), "Missing arguments for booking appointment.", resource="appointment"),
+        ToolSpec("cancel_appointment_tool", _cancel_appointment, ("phone_number",), "No phone number provided for cancel appointment.", resource="appointment"),
+    ],
+    "car_parts_retailer": [
+        ToolSpec("find_car_info_with_plate_tool", _find_car_info_with_plate, ("license_plate",), "No license plate provided for car info retrieval."),
+        ToolSpec("find_compatible_part_tool", _find_compatible_part, ("license_plate", "part_type"), "Missing license plate or part type for compatible part search."),
+        ToolSpec("place_car_part_order_tool", _place_car_part_order, ("phone_number", "part_id", "quantity"), "Missing arguments for placing car part order.", resource="order"),
+        ToolSpec("check_car_part_order_tool", _check_car_part_order, ("phone_number",), "No phone number provided for checking car part order.", resource="order"),
+    ],
+    "bookstore": [
+        ToolSpec("view_book_order_history_tool", _view_book_order_history, ("phone_number",), "No phone number provided for order history retrieval."),
+        ToolSpec("suggest_books_tool", _suggest_books),
+        ToolSpec("check_book_stock_tool", _check_book_stock, ("title",), "No title provided for book stock check."),
+        ToolSpec("reserve_book_tool", _reserve_book, ("phone_number", "title"), "Missing phone number or title for reserving book.", resource="reservation"),
+        ToolSpec("cancel_book_tool", _cancel_book, ("phone_number", "title"), "Missing phone number or title for cancelling book reservation.", resource="reservation"),
+    ],
+}
+SEARCH_HISTORY_SPEC = ToolSpec("search_history_tool", _search_history, ("query",), "No search query provided.", _search_history_async)
+# Scenario name -> tool name -> ToolSpec, with the history search every scenario can offer
+TOOL_REGISTRY = {scenario: {spec.name: spec for spec in specs + [SEARCH_HISTORY_SPEC]} for scenario, specs in _SCENARIO_TOOLS.items()}
+
+def _group_tool_calls(tool_calls, specs):
+    """Split tool calls into groups that may run concurrently, keeping request order within a group."""
+    groups = {}
+    for position, tool_call in enumerate(tool_calls):
+        spec = specs.get(tool_call.function.name)
+        key = spec.resource if spec and spec.resource else position
+        groups.setdefault(key, []).append((position, tool_call, spec))
+    return list(groups.values())
+
+def _prepare(tool_call, spec):
+    """Returns (args, error) for a tool call."""
+    if spec is None:
+        logging.error(f"No handler registered for tool {tool_call.function.name}.")
+        return None, f"Unknown tool {tool_call.function.name}."
+    args = tool_call.function.parsed_arguments
+    error = spec.validate(args)
+    if error:
+        logging.error(f"Invalid arguments for {spec.name}: {error}")
+    return args, error
+
+def _format_results(tool_calls, results):
+    return "\n\n".join(f"{tool_call.function.name}: {result}" for tool_call, result in zip(tool_calls, results))
+
+def _skip_after_timeout(calls, spec, results):
+    for position, tool_call, _ in calls:
+        results[position] = f"Not run: {spec.name} timed out before it."
+
+def _submit_next(calls, ctx, results, running):
+    """Submit the next valid call from the `calls` iterator of one group to the tool executor."""
+    for position, tool_call, spec in calls:
+        args, error = _prepare(tool_call, spec)
+        if error:
+            results[position] = error
+            continue
+        logging.info(f"Processing {spec.name} tool call.")
+        metrics.inc(f"tools.{spec.name}.calls")
+        future = tool_executor.submit(spec.handler, ctx, args)
+        running[future] = (calls, position, spec, time.monotonic() + spec.timeout)
+        return
+
+def execute_tool_calls(tool_calls, ctx: ToolContext, scenario=SCENARIO):
+    """
+    Runs all tool calls from the model, independent ones concurrently, and returns
+    one result string per call. A call exceeding its tool's timeout is reported as
+    timed out and its late result is discarded; later calls in its group are not run.
+    """
+    specs = TOOL_REGISTRY.get(scenario, {})
+    results = {}
+    running = {}  # future -> (remaining calls of its group, position, spec, deadline)
+    for group in _group_tool_calls(tool_calls, specs):
+        _submit_next(iter(group), ctx, results, running)
+    while running:
+        timeout = min(deadline for _, _, _, deadline in running.values()) - time.monotonic()
+        done, _ = wait(running, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            calls, position, spec, _ = running.pop(future)
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                logging.error(f"Tool {spec.name} failed: {e}")
+                results[position] = f"Tool failed: {e}"
+            _submit_next(calls, ctx, results, running)
+        now = time.monotonic()
+        for future, (calls, position, spec, deadline) in list(running.items()):
+            if deadline <= now:
+                # The handler thread can't be interrupted; whatever it returns is ignored
+                del running[future]
+                logging.error(f"Tool {spec.name} timed out.")
+                metrics.inc(f"tools.{spec.name}.timeouts")
+                results[position] = "Tool timed out."
+                _skip_after_timeout(calls, spec, results)
+    return [results[position] for position in range(len(tool_calls))]
+
+def run_tool_calls(tool_calls, ctx: ToolContext, scenario=SCENARIO):
+    """Runs all tool calls and returns their combined results for the final prompt."""
+    return _format_results(tool_calls, execute_tool_calls(tool_calls, ctx, scenario))
+
+async def _run_group_async(group, ctx, results):
+    for index, (position, tool_call, spec) in enumerate(group):
+        args, error = _prepare(tool_call, spec)
+        if error:
+            results[position] = error
+            continue
+        logging.info(f"Processing {spec.name} tool call.")
+        metrics.inc(f"tools.{spec.name}.calls")
+        try:
+            if spec.async_handler:
+                coroutine = spec.async_handler(ctx, args)
+            else:
+                coroutine = asyncio.to_thread(spec.handler, ctx, args)
+            results[position] = await asyncio.wait_for(coroutine, timeout=spec.timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Tool {spec.name} timed out.")
+            metrics.inc(f"tools.{spec.name}.timeouts")
+            results[position] = "Tool timed out."
+            _skip_after_timeout(group[index + 1:], spec, results)
+            return
+        except Exception as e:
+            logging.error(f"Tool {spec.name} failed: {e}")
+            results[position] = f"Tool failed: {e}"
+
+async def execute_tool_calls_async(tool_calls, ctx: ToolContext, scenario=SCENARIO):
+    """Async version of execute_tool_calls."""
+    specs = TOOL_REGISTRY.get(scenario, {})
+    results = {}
+    await asyncio.gather(*(_run_group_async(group, ctx, results) for group in _group_tool_calls(tool_calls, specs)))
+    return [results[position] for position in range(len(tool_calls))]
+
+async def run_tool_calls_async(tool_calls, ctx: ToolContext, scenario=SCENARIO):
+    """Async version of run_tool_calls."""
+    return _format_results(tool_calls, await execute_tool_calls_async(tool_calls, ctx, scenario))
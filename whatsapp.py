@@ -1,4 +1,5 @@
 import re
+import asyncio
 import time
 import random
 from collections import defaultdict, deque
@@ -9,51 +10,115 @@ from neonize.utils.enum import ReceiptType, ChatPresence, ChatPresenceMedia
 from neonize.utils import log
 import pdfplumber
 from docx import Document
-import threading
-import queue
-from database import save_message, delete_messages, get_recent_messages_formatted
+from database import save_message, get_recent_messages_formatted
+from retention import clear_user_history
 from scenarios import SCENARIOS
-from scraping import scrape_text
+from scraping import scrape_text, scrape_text_async
 import os
 from llm import (
     generate_wait_message,
     generate_final_response,
-    generate_error_message
+    generate_error_message,
+    generate_response_with_tools,
+    generate_wait_message_async,
+    generate_final_response_async,
+    generate_error_message_async,
+    generate_response_with_tools_async
 )
 from tool_calls import (
     describe_image_with_gpt,
     poll_llm_for_tool_choice,
-    text_to_speech_with_openai,
-    generate_image_with_openai,
-    edit_image_with_openai,
     transcribe_audio_with_whisper,
-    web_search
+    describe_image_with_gpt_async,
+    poll_llm_for_tool_choice_async,
+    transcribe_audio_with_whisper_async
 )
-from config import SKIP_HISTORY_SYNC, SCENARIO, SCRAPE_USER_LINKS, DOWNLOAD_USER_FILES
+from tool_registry import (
+    ToolContext,
+    run_tool_calls,
+    run_tool_calls_async,
+    execute_tool_calls,
+    execute_tool_calls_async
+)
+from config import (
+    SKIP_HISTORY_SYNC,
+    SCENARIO,
+    SCRAPE_USER_LINKS,
+    DOWNLOAD_USER_FILES,
+    MESSAGE_WORKERS,
+    EXECUTION_MODE,
+    ASYNC_MAX_CONCURRENCY,
+    INTAKE_QUEUE_SIZE,
+    MESSAGE_MAX_AGE,
+    BUSY_REPLY_INTERVAL,
+    DEBOUNCE_WINDOW,
+    DEBOUNCE_MAX_WAIT,
+    DEBOUNCE_MAX_MESSAGES,
+    SINGLE_ROUND_TRIP,
+    INTENT_CLASSIFIER
+)
+from prompts import BUSY_MESSAGE
+from intake_queue import PRIORITY_COMMAND, PRIORITY_MESSAGE
+from worker_pool import ShardedWorkerPool
+from debounce import MessageDebouncer
+from journal import MessageJournal
+from session_store import UserSessionContentItem, session_store
+from retrieval import session_retriever
+from intent_classifier import IntentDecision, intent_classifier, available_tool_names, NO_TOOL, TOOL, ASK_LLM
+from async_pipeline import AsyncPipeline, run_blocking
+from send_scheduler import send_scheduler
+from phrases import detect_language, phrase_cache
+from summarizer import conversation_summarizer
+from history_import import history_importer
+from metrics import metrics
 from filelogger import FileLogger
 fileLogger = FileLogger()
 
-# --- Session Content Item Class ---
-class UserSessionContentItem:
-    def __init__(self, type_: str, source: str, content: str):
-        self.type = type_  # 'link', 'document', 'image'
-        self.source = source  # filename or url
-        self.content = content
-    def __repr__(self):
-        return f"[{self.type}] {self.source}: {self.content[:60]}..."
+# Raw incoming messages, kept for debugging and traffic replay
+message_journal = MessageJournal()
 
-# Global message queue for processing incoming messages sequentially
-message_queue = queue.Queue()
+def get_message_text(message: MessageEv):
+    return (message.Message.conversation or
+            message.Message.extendedTextMessage.text or
+            message.Message.imageMessage.caption or
+            message.Message.documentMessage.caption or
+            "")
 
-def process_message(client: NewClient, message: MessageEv):
+def process_messages(client: NewClient, messages: list):
+    """
+    Answers a batch of consecutive messages from one chat with a single LLM turn.
+    """
+    try:
+        texts = [prepare_message(client, message) for message in messages]
+        texts = [text for text in texts if text is not None]
+        if not texts:
+            return
+
+        chat = messages[-1].Info.MessageSource.Chat
+        sender_id = chat.User
+        text = "\n".join(text for text in texts if text)
+        if len(texts) > 1:
+            log.info(f"Coalesced {len(texts)} messages from {sender_id} into one turn.")
+
+        log.info(f"Generating final response for {sender_id}...")
+        handle_final_response(client, chat, sender_id, text)
+        record_user_response(sender_id)
+
+        # After responding, send paused notification
+        send_scheduler.schedule(sender_id, time.time(), client.send_chat_presence, jid=chat, state=ChatPresence.CHAT_PRESENCE_PAUSED, media=ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT)
+
+    except Exception as e:
+        log.error(f"Error in process_messages handler: {e}")
+
+def prepare_message(client: NewClient, message: MessageEv):
+    """
+    Runs the per-message steps of a turn: checks, read receipt, commands, DB save,
+    links and attachments. Returns the text to answer, or None to not answer it.
+    """
     try:
         chat = message.Info.MessageSource.Chat
         sender_id = message.Info.MessageSource.Chat.User
-        text = (message.Message.conversation or
-                message.Message.extendedTextMessage.text or
-                message.Message.imageMessage.caption or
-                message.Message.documentMessage.caption or
-                "")
+        text = get_message_text(message)
         from_me = message.Info.MessageSource.IsFromMe
         is_group = message.Info.MessageSource.IsGroup
         is_edit = message.IsEdit
@@ -64,14 +129,8 @@ def process_message(client: NewClient, message: MessageEv):
         log.info(f"Message from {sender_name} ({sender_id}): {text}")
         log.debug(f"Raw message info: {message}")
 
-        # Save raw message object to a file
-        message_filename = f"messages/{int(time.time())}.txt"
-        with open(message_filename, "w", encoding="utf-8") as file:
-            file.write(str(message))
-        log.debug(f"Saved raw message to {message_filename}")
-
         # Check if the message is older than one minute
-        if time.time() - timestamp > 60:
+        if time.time() - timestamp > MESSAGE_MAX_AGE:
             log.info(f"Message from {sender_name} ({sender_id}) is older than one minute; skipping further processing.")
             return
 
@@ -119,18 +178,11 @@ def process_message(client: NewClient, message: MessageEv):
         if message.Info.Type == "media" and not message.Info.MediaType == "url":
             text = handle_file(client, message, text, sender_id)
 
-        log.info(f"Generating final response for {sender_id}...")
-        handle_final_response(client, chat, sender_id, text)
-        record_user_response(sender_id)
-
-        # After responding, send paused notification
-        client.send_chat_presence(jid=chat, state=ChatPresence.CHAT_PRESENCE_PAUSED, media=ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT)
+        return text
 
     except Exception as e:
-        log.error(f"Error in process_message handler: {e}")
-
-USER_SCRAPED_CONTENT = defaultdict(list)  # user_id -> list of UserSessionContentItem
-USER_LATEST_IMAGE = defaultdict(lambda: None)  # user_id -> latest image path
+        log.error(f"Error in prepare_message handler: {e}")
+        return None
 
 # Rate limiting: user_id -> deque of timestamps (seconds)
 user_message_timestamps = defaultdict(lambda: deque(maxlen=5))
@@ -160,18 +212,17 @@ def handle_link(client: NewClient, message: MessageEv, sender_id, sender_name, t
     link = links_found[0]
     log.info(f"Link detected: {link}")
 
-    # Send wait message
+    # Send wait message after a random delay, scraping meanwhile
     wait_message = generate_wait_message(user_text=text, user_id=sender_id)
-    time.sleep(random.uniform(2, 5))  # Add random delay before sending wait message
-    client.reply_message(wait_message, message)
-    save_message(sender_id, wait_message, int(time.time()), True)
-    log.info(f"Sent wait message to {sender_name} for link processing: {wait_message}")
+    send_at = send_scheduler.schedule(sender_id, time.time() + random.uniform(2, 5), client.reply_message, wait_message, message)
+    save_message(sender_id, wait_message, int(send_at), True)
+    log.info(f"Scheduled wait message to {sender_name} for link processing: {wait_message}")
 
     # Scrape the link and store the content
     scraped_content = scrape_text(link)
     log.debug(f"Scraped content (first 200 chars): {scraped_content[:200]}...")
     # Add to session context
-    USER_SCRAPED_CONTENT[sender_id].append(UserSessionContentItem(
+    session_store.add_item(sender_id, UserSessionContentItem(
         type_="link",
         source=link,
         content=scraped_content
@@ -206,14 +257,8 @@ def convert_docx_to_markdown(docx_path):
     except Exception as e:
         return f"Error reading DOCX: {e}"
 
-def handle_file(client: NewClient, message: MessageEv, user_text: str, sender_id: str):
-    """Handles file attachments (downloads the file, converts, and saves as text, and adds to session context)."""
-    log.info(f"Handling file attachment for user {sender_id}.")
-
-    if not DOWNLOAD_USER_FILES:
-        log.info(f"File downloading is disabled; skipping file handling for {sender_id}.")
-        return user_text
-
+def get_attachment_file_name(message: MessageEv):
+    """Returns the local file name to download an attachment to, or None if unsupported."""
     file_name = None
     document_msg = getattr(message.Message, "documentMessage", None)
     image_msg = getattr(message.Message, "imageMessage", None)
@@ -229,74 +274,90 @@ def handle_file(client: NewClient, message: MessageEv, user_text: str, sender_id
         file_name = f"{int(time.time())}_{uuid.uuid4()}.ogg"
     else:
         log.info("Unknown message type; skipping file handling.")
+    return file_name
+
+def convert_document_to_markdown(file_path, file_extension):
+    """Converts a downloaded PDF, DOCX or TXT file to text. Returns None for other types."""
+    if file_extension == ".pdf":
+        return convert_pdf_to_markdown(file_path)
+    elif file_extension == ".docx":
+        return convert_docx_to_markdown(file_path)
+    elif file_extension == ".txt":
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except Exception as e:
+            return f"Error reading TXT: {e}"
+    return None
+
+def add_file_to_session(sender_id, file_name, item_type, submission_markdown):
+    """Adds converted file content to the user's session context and saves documents to disk."""
+    session_store.add_item(sender_id, UserSessionContentItem(
+        type_=item_type,
+        source=file_name,
+        content=submission_markdown
+    ))
+
+    if item_type == "document":
+        log.info(f"Added document content for {sender_id}.")
+        base_filename = os.path.splitext(os.path.basename(file_name))[0]
+        txt_filename = f"{base_filename}.txt"
+        txt_filepath = os.path.join("converted", txt_filename)
+        try:
+            with open(txt_filepath, "w", encoding="utf-8") as f:
+                f.write(submission_markdown)
+            log.info(f"Converted file saved to: {txt_filepath}")
+        except Exception as e:
+            log.error(f"Error saving converted file: {e}")
 
+def handle_file(client: NewClient, message: MessageEv, user_text: str, sender_id: str):
+    """Handles file attachments (downloads the file, converts, and saves as text, and adds to session context)."""
+    log.info(f"Handling file attachment for user {sender_id}.")
+
+    if not DOWNLOAD_USER_FILES:
+        log.info(f"File downloading is disabled; skipping file handling for {sender_id}.")
+        return user_text
+
+    file_name = get_attachment_file_name(message)
     if not file_name:
         log.info("No file name found in the message; skipping file handling.")
         return
 
     log.info(f"File name detected: {file_name}")
     chat = message.Info.MessageSource.Chat
+    file_path = f"./downloads/{file_name}"
 
     try:
-        client.download_any(message=message.Message, path=f"./downloads/{file_name}")
+        client.download_any(message=message.Message, path=file_path)
         log.info(f"Downloaded file: {file_name}")
     except Exception as e:
         log.error(f"Failed to download file: {e}")
-        client.send_message(chat, generate_error_message(user_text=user_text, user_id=sender_id))
+        send_scheduler.schedule(sender_id, time.time(), client.send_message, chat, generate_error_message(user_text=user_text, user_id=sender_id))
         return
 
     file_extension = os.path.splitext(file_name)[1].lower()
-    submission_markdown = None
-    item_type = None
     if file_extension == ".jpeg":
-        submission_markdown = describe_image_with_gpt(f"./downloads/{file_name}")
+        submission_markdown = describe_image_with_gpt(file_path)
         item_type = "image"
-        USER_LATEST_IMAGE[sender_id] = f"./downloads/{file_name}"
+        session_store.set_latest_image(sender_id, file_path)
     elif file_extension == ".ogg":
-        submission_markdown = transcribe_audio_with_whisper(f"./downloads/{file_name}")
-        item_type = "audio"
-        return submission_markdown  # Return early for audio files
-    elif file_extension == ".pdf":
-        submission_markdown = convert_pdf_to_markdown(f"./downloads/{file_name}")
-        item_type = "document"
-    elif file_extension == ".docx":
-        submission_markdown = convert_docx_to_markdown(f"./downloads/{file_name}")
-        item_type = "document"
-    elif file_extension == ".txt":
-        try:
-            with open(f"./downloads/{file_name}", "r", encoding="utf-8") as f:
-                submission_markdown = f.read()
-            item_type = "document"
-        except Exception as e:
-            submission_markdown = f"Error reading TXT: {e}"
-            item_type = "document"
+        return transcribe_audio_with_whisper(file_path)  # Return early for audio files
     else:
-        log.error(f"Unsupported file type: {file_extension}")
-        client.send_message(chat, generate_error_message(user_text=user_text, user_id=sender_id))
-        return
+        submission_markdown = convert_document_to_markdown(file_path, file_extension)
+        item_type = "document"
+        if submission_markdown is None:
+            log.error(f"Unsupported file type: {file_extension}")
+            send_scheduler.schedule(sender_id, time.time(), client.send_message, chat, generate_error_message(user_text=user_text, user_id=sender_id))
+            return
 
-    if not item_type == "audio":
-        # Add to session context
-        USER_SCRAPED_CONTENT[sender_id].append(UserSessionContentItem(
-            type_=item_type,
-            source=file_name,
-            content=submission_markdown
-        ))
+    add_file_to_session(sender_id, file_name, item_type, submission_markdown)
+    return user_text
 
-    if item_type == "document":
-        log.info(f"Added document content for {sender_id}.")
-        base_filename = os.path.splitext(os.path.basename(file_name))[0]
-        txt_filename = f"{base_filename}.txt"
-        txt_filepath = os.path.join("converted", txt_filename)
-        try:
-            with open(txt_filepath, "w", encoding="utf-8") as f:
-                f.write(submission_markdown)
-            log.info(f"Converted file saved to: {txt_filepath}")
-        except Exception as e:
-            log.error(f"Error saving converted file: {e}")
 
-    return user_text
+COMMANDS = ("!reset",)
 
+def is_command(text: str):
+    return text.startswith(COMMANDS)
 
 def handle_commands(client: NewClient, chat: JID, sender_id: str, text: str):
     """
@@ -306,248 +367,292 @@ def handle_commands(client: NewClient, chat: JID, sender_id: str, text: str):
     log.debug(f"Command {text} from {sender_id} is allowed.")
 
     if text.startswith("!reset"):
-        client.send_message(chat, "[SYSTEM] Cleared conversation history!")
-        delete_messages(sender_id)
+        send_scheduler.schedule(sender_id, time.time(), client.send_message, chat, "[SYSTEM] Cleared conversation history!")
+        clear_user_history(sender_id)
         log.info(f"Cleared conversation history for {sender_id} due to '!reset' command.")
-        USER_SCRAPED_CONTENT[sender_id] = ""
+        session_store.clear(sender_id)
+        session_retriever.forget(sender_id)
         log.debug(f"Cleared scraped content for {sender_id}.")
         return True
 
     return False
 
 def handle_final_response(client: NewClient, chat: JID, sender_id: str, text: str):
-    """Generates and sends the final response using the LLM."""
-    # Start timer for total response delay
-    min_total_delay = random.uniform(2, 5)
-    start_time = time.time()
-    # Concatenate all session content for user
-    session_items = USER_SCRAPED_CONTENT.get(sender_id, [])
-    scraped_text = "\n".join([
-        f"[{item.type.upper()}] {item.source}\n{item.content}" for item in session_items
-    ])
-    tool_usage_result = process_llm_tools(text, scraped_text, client, chat, sender_id)
-    final_answer = generate_final_response(SCENARIOS[SCENARIO].final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tool_usage_result=tool_usage_result)
+    """Generates the final response using the LLM and schedules it to be sent."""
+    # The reply goes out no sooner than a random 2-5 s after the turn started
+    send_at = time.time() + random.uniform(2, 5)
+    # Only the session content relevant to this message goes into the prompt
+    session_items = session_store.get_items(sender_id)
+    scraped_text = session_retriever.build_context(sender_id, session_items, text)
+    scenario = SCENARIOS[SCENARIO]
+    if not SINGLE_ROUND_TRIP:
+        tool_usage_result = process_llm_tools(text, scraped_text, client, chat, sender_id)
+        final_answer = generate_final_response(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tool_usage_result=tool_usage_result)
+    elif classify_intent(text)[0].kind == NO_TOOL:
+        # Small talk doesn't need the tool schemas in the request
+        final_answer = generate_final_response(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tool_usage_result="No tool calls needed.")
+    else:
+        ctx = ToolContext(client, chat, sender_id, text)
+        final_answer = generate_response_with_tools(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tools=scenario.tools, run_tools=lambda tool_calls: execute_tool_calls(tool_calls, ctx))
     log.debug(f"Final answer generated: {final_answer}")
-    elapsed = time.time() - start_time
-    remaining = min_total_delay - elapsed
-    if remaining > 0:
-        time.sleep(remaining)
-    client.send_message(to=chat, message=final_answer)
-    save_message(user_id=sender_id, message_content=final_answer, timestamp=int(time.time()), from_me=True)
-    log.info(f"Sent final response to {sender_id}.")
+    send_at = send_scheduler.schedule(sender_id, send_at, client.send_message, to=chat, message=final_answer)
+    save_message(user_id=sender_id, message_content=final_answer, timestamp=int(send_at), from_me=True)
+    conversation_summarizer.notify(sender_id)
+    log.info(f"Scheduled final response to {sender_id}.")
+
+def classify_intent(user_message: str):
+    """
+    Locally pre-classifies the message before any tool-poll call.
+    Returns the decision and whether it should be verified against the full poll.
+    """
+    if not INTENT_CLASSIFIER:
+        return IntentDecision(ASK_LLM), False
+    scenario = SCENARIOS[SCENARIO]
+    decision = intent_classifier.classify(scenario.name, user_message, available_tool_names(scenario.tools))
+    intent_classifier.record_decision(scenario.name, decision)
+    return decision, decision.kind != ASK_LLM and intent_classifier.should_verify()
 
 def process_llm_tools(user_message: str, scraped_text: str, client: NewClient, chat: JID, sender_id: str):
     """
     Handles entire LLM tool processing flow.
     """
+    decision, verify = classify_intent(user_message)
+    if decision.kind == NO_TOOL and not verify:
+        log.info(f"Intent classifier skipped the tool poll: {decision}")
+        return "No tool calls needed."
+    forced_tool = decision.tool if decision.kind == TOOL and not verify else None
+    hint_tool = decision.tool if decision.kind == ASK_LLM else None
 
-    tool_call = poll_llm_for_tool_choice(user_message, get_recent_messages_formatted(sender_id), scraped_text, SCENARIOS[SCENARIO].tools)
+    tool_calls = poll_llm_for_tool_choice(user_message, get_recent_messages_formatted(sender_id), scraped_text, SCENARIOS[SCENARIO].tools, forced_tool=forced_tool, hint_tool=hint_tool)
+    if forced_tool is None:
+        intent_classifier.record_outcome(SCENARIOS[SCENARIO].name, user_message, decision, [tool_call.function.name for tool_call in tool_calls])
 
-    if not tool_call:
+    if not tool_calls:
         log.info("No tool calls needed for user message.")
         return "No tool calls needed."
 
-    if SCENARIO == "base":
-        if tool_call.function.name == "web_search_tool":
-            log.info("Processing web search tool call.")
-            search_query = getattr(tool_call.function.parsed_arguments, "query", None)
-            if not search_query:
-                log.error("No search query provided in tool call arguments.")
-                return "No search query provided."
-            search_results = web_search(search_query)
-            log.debug(f"Web search results: {search_results}")
-            result_strings = []
-            for result in search_results:
-                url = result.get("url", "")
-                snippet = result.get("snippet", "")
-                result_strings.append(f"{url}\n{snippet}\n")
-            return tool_call.function.name + ": " + "\n".join(result_strings)
-        elif tool_call.function.name == "generate_tts_tool":
-            log.info("Processing text-to-speech tool call.")
-            text = getattr(tool_call.function.parsed_arguments, "text", None)
-            if not text:
-                log.error("No text provided for TTS generation.")
-                return "No text provided for TTS generation."
-            audio_path = text_to_speech_with_openai(text)
-            if not audio_path:
-                return "Error generating audio."
-            client.send_audio(chat, audio_path)
-            return f"{tool_call.function.name}: Audio generated successfully. It will be sent before this message. Please act like you just generated and sent the audio successfully for the user."
-        elif tool_call.function.name == "generate_image_tool":
-            log.info("Processing image generation tool call.")
-            prompt = getattr(tool_call.function.parsed_arguments, "prompt", None)
-            if not prompt:
-                log.error("No prompt provided for image generation.")
-                return "No prompt provided for image generation."
-            client.send_message(chat, generate_wait_message(user_text=user_message, user_id=chat.User))
-            image_path = generate_image_with_openai(prompt)
-            USER_LATEST_IMAGE[sender_id] = image_path
-            if not image_path:
-                return "Error generating image."
-            client.send_image(chat, image_path)
-            return f"{tool_call.function.name}: Image generated successfully. It will be sent before this message. Please act like you just generated and sent the image successfully for the user."
-        elif tool_call.function.name == "edit_image_tool":
-            log.info("Processing image editing tool call.")
-            prompt = getattr(tool_call.function.parsed_arguments, "prompt", None)
-            image_path = USER_LATEST_IMAGE.get(sender_id, None)
-            if not image_path or not prompt:
-                log.error("Missing image path or prompt for image editing.")
-                return "Missing image path or prompt for image editing."
-            client.send_message(chat, generate_wait_message(user_text=user_message, user_id=chat.User))
-            edited_image_path = edit_image_with_openai(image_path, prompt)
-            if not edited_image_path:
-                return "Error editing image."
-            client.send_image(chat, edited_image_path)
-            return f"{tool_call.function.name}: Image edited successfully. It will be sent before this message. Please act like you just generated and sent the edited image successfully for the user."
-    elif SCENARIO == "hairdresser":
-        from tool_calls_dummy import (
-            dummy_check_appointment_calendar_tool,
-            dummy_get_services_tool,
-            dummy_get_order_history_tool,
-            dummy_book_appointment_tool,
-            dummy_cancel_appointment_tool,
-        )
-        if tool_call.function.name == "check_appointment_calendar_tool":
-            log.info("Processing check appointment calendar tool call.")
-            start_date = getattr(tool_call.function.parsed_arguments, "start_date", None)
-            end_date = getattr(tool_call.function.parsed_arguments, "end_date", None)
-            if not start_date or not end_date:
-                log.error("Missing start or end date for appointment calendar check.")
-                return "Missing start or end date for appointment calendar check."
-            result = dummy_check_appointment_calendar_tool(start_date, end_date)
-            return f"Available slots: {result['available_slots']}\n{result['message']}"
-        elif tool_call.function.name == "get_services_tool":
-            log.info("Processing get services tool call.")
-            gender = getattr(tool_call.function.parsed_arguments, "gender", None)
-            if not gender:
-                log.error("No gender provided for get services tool.")
-                return "No gender provided for get services tool."
-            result = dummy_get_services_tool(gender)
-            return f"Services for {gender}: {result['services']}"
-        elif tool_call.function.name == "get_order_history_tool":
-            log.info("Processing get order history tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            if not phone_number:
-                log.error("No phone number provided for order history retrieval.")
-                return "No phone number provided for order history retrieval."
-            result = dummy_get_order_history_tool(phone_number)
-            return f"Order history: {result['history']}"
-        elif tool_call.function.name == "book_appointment_tool":
-            log.info("Processing book appointment tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            service = getattr(tool_call.function.parsed_arguments, "service", None)
-            preferred_time = getattr(tool_call.function.parsed_arguments, "preferred_time", None)
-            if not phone_number or not service or not preferred_time:
-                log.error("Missing arguments for booking appointment.")
-                return "Missing arguments for booking appointment."
-            result = dummy_book_appointment_tool(phone_number, service, preferred_time)
-            return f"{result['message']} (Confirmation: {result['confirmation_number']})"
-        elif tool_call.function.name == "cancel_appointment_tool":
-            log.info("Processing cancel appointment tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            if not phone_number:
-                log.error("No phone number provided for cancel appointment.")
-                return "No phone number provided for cancel appointment."
-            result = dummy_cancel_appointment_tool(phone_number)
-            return result["message"]
-    elif SCENARIO == "car_parts_retailer":
-        from tool_calls_dummy import (
-            dummy_find_car_info_with_plate_tool,
-            dummy_find_compatible_part_tool,
-            dummy_place_car_part_order_tool,
-            dummy_check_car_part_order_tool,
-        )
-        if tool_call.function.name == "find_car_info_with_plate_tool":
-            log.info("Processing find car info with plate tool call.")
-            license_plate = getattr(tool_call.function.parsed_arguments, "license_plate", None)
-            if not license_plate:
-                log.error("No license plate provided for car info retrieval.")
-                return "No license plate provided for car info retrieval."
-            result = dummy_find_car_info_with_plate_tool(license_plate)
-            return f"Car info: {result['car']}"
-        elif tool_call.function.name == "find_compatible_part_tool":
-            log.info("Processing find compatible part tool call.")
-            license_plate = getattr(tool_call.function.parsed_arguments, "license_plate", None)
-            part_type = getattr(tool_call.function.parsed_arguments, "part_type", None)
-            if not license_plate or not part_type:
-                log.error("Missing license plate or part type for compatible part search.")
-                return "Missing license plate or part type for compatible part search."
-            result = dummy_find_compatible_part_tool(license_plate, part_type)
-            return f"Compatible parts: {result['compatible_parts']}"
-        elif tool_call.function.name == "place_car_part_order_tool":
-            log.info("Processing place car part order tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            part_id = getattr(tool_call.function.parsed_arguments, "part_id", None)
-            quantity = getattr(tool_call.function.parsed_arguments, "quantity", None)
-            if not phone_number or not part_id or quantity is None:
-                log.error("Missing arguments for placing car part order.")
-                return "Missing arguments for placing car part order."
-            result = dummy_place_car_part_order_tool(phone_number, part_id, quantity)
-            return f"Order placed: {result['order_id']} (Est. delivery: {result['estimated_delivery']})"
-        elif tool_call.function.name == "check_car_part_order_tool":
-            log.info("Processing check car part order tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            if not phone_number:
-                log.error("No phone number provided for checking car part order.")
-                return "No phone number provided for checking car part order."
-            result = dummy_check_car_part_order_tool(phone_number)
-            return f"Orders: {result['orders']}"
-    elif SCENARIO == "bookstore":
-        from tool_calls_dummy import (
-            dummy_view_book_order_history_tool,
-            dummy_suggest_books_tool,
-            dummy_check_book_stock_tool,
-            dummy_reserve_book_tool,
-            dummy_cancel_book_tool,
+    return run_tool_calls(tool_calls, ToolContext(client, chat, sender_id, user_message))
+
+# --- Async pipeline (EXECUTION_MODE = "async") ---
+# Coroutine twins of the handlers above. OpenAI and HTTP calls are awaited directly,
+# blocking neonize calls run on the bounded executor and disk/SQLite work on threads.
+
+async def process_messages_async(client: NewClient, messages: list):
+    """Async version of process_messages."""
+    try:
+        texts = [await prepare_message_async(client, message) for message in messages]
+        texts = [text for text in texts if text is not None]
+        if not texts:
+            return
+
+        chat = messages[-1].Info.MessageSource.Chat
+        sender_id = chat.User
+        text = "\n".join(text for text in texts if text)
+        if len(texts) > 1:
+            log.info(f"Coalesced {len(texts)} messages from {sender_id} into one turn.")
+
+        log.info(f"Generating final response for {sender_id}...")
+        await handle_final_response_async(client, chat, sender_id, text)
+        record_user_response(sender_id)
+
+        # After responding, send paused notification
+        send_scheduler.schedule(sender_id, time.time(), client.send_chat_presence, jid=chat, state=ChatPresence.CHAT_PRESENCE_PAUSED, media=ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT)
+
+    except Exception as e:
+        log.error(f"Error in process_messages_async handler: {e}")
+
+async def prepare_message_async(client: NewClient, message: MessageEv):
+    """Async version of prepare_message."""
+    try:
+        chat = message.Info.MessageSource.Chat
+        sender_id = message.Info.MessageSource.Chat.User
+        text = get_message_text(message)
+        from_me = message.Info.MessageSource.IsFromMe
+        is_group = message.Info.MessageSource.IsGroup
+        is_edit = message.IsEdit
+        is_viewonce = message.IsViewOnce or message.IsViewOnceV2 or message.IsViewOnceV2Extension
+        timestamp = message.Info.Timestamp // 1000
+        sender_name = message.Info.Pushname or "User"
+
+        log.info(f"Message from {sender_name} ({sender_id}): {text}")
+        log.debug(f"Raw message info: {message}")
+
+        # Check if the message is older than one minute
+        if time.time() - timestamp > MESSAGE_MAX_AGE:
+            log.info(f"Message from {sender_name} ({sender_id}) is older than one minute; skipping further processing.")
+            return
+
+        # Mark as read
+        await run_blocking(
+            client.mark_read,
+            message.Info.ID,
+            chat=chat,
+            sender=message.Info.MessageSource.Sender,
+            receipt=ReceiptType.READ
         )
-        if tool_call.function.name == "view_book_order_history_tool":
-            log.info("Processing view book order history tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            if not phone_number:
-                log.error("No phone number provided for order history retrieval.")
-                return "No phone number provided for order history retrieval."
-            result = dummy_view_book_order_history_tool(phone_number)
-            return f"Book order history: {result['orders']}"
-        elif tool_call.function.name == "suggest_books_tool":
-            log.info("Processing suggest books tool call.")
-            genre = getattr(tool_call.function.parsed_arguments, "genre", None)
-            author = getattr(tool_call.function.parsed_arguments, "author", None)
-            result = dummy_suggest_books_tool(genre, author)
-            return f"Suggestions: {result['suggestions']}"
-        elif tool_call.function.name == "check_book_stock_tool":
-            log.info("Processing check book stock tool call.")
-            title = getattr(tool_call.function.parsed_arguments, "title", None)
-            author = getattr(tool_call.function.parsed_arguments, "author", None)
-            if not title:
-                log.error("No title provided for book stock check.")
-                return "No title provided for book stock check."
-            result = dummy_check_book_stock_tool(title, author)
-            return f"Book stock: {result}"
-        elif tool_call.function.name == "reserve_book_tool":
-            log.info("Processing reserve book tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            title = getattr(tool_call.function.parsed_arguments, "title", None)
-            if not phone_number or not title:
-                log.error("Missing phone number or title for reserving book.")
-                return "Missing phone number or title for reserving book."
-            result = dummy_reserve_book_tool(phone_number, title)
-            return f"Book reserved: {result['reservation_id']} (Pickup by {result['pickup_deadline']})"
-        elif tool_call.function.name == "cancel_book_tool":
-            log.info("Processing cancel book tool call.")
-            phone_number = getattr(tool_call.function.parsed_arguments, "phone_number", None)
-            title = getattr(tool_call.function.parsed_arguments, "title", None)
-            if not phone_number or not title:
-                log.error("Missing phone number or title for cancelling book reservation.")
-                return "Missing phone number or title for cancelling book reservation."
-            result = dummy_cancel_book_tool(phone_number, title)
-            return result["message"]
-    return "Something went wrong with tool processing."
+        log.debug(f"Marked message {message.Info.ID} as read.")
+
+        # Rate limiting: only respond if under the limit
+        if not can_respond_to_user(sender_id):
+            log.info(f"Rate limit reached for {sender_id}; skipping response.")
+            return
+
+        # Skip messages from the bot itself
+        if chat.User == sender_id and from_me:
+            log.info(f"Skipping message from bot itself: {sender_id}")
+            return
+
+        # Skip group, edit, and view once messages
+        if is_group or is_edit or is_viewonce:
+            log.info(f"Skipping group/edit/view once message from {sender_id}.")
+            return
+
+        # Send typing notification (composing)
+        await run_blocking(client.send_chat_presence, jid=chat, state=ChatPresence.CHAT_PRESENCE_COMPOSING, media=ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT)
+
+        # Check for a command and process it if present.
+        if await handle_commands_async(client, chat, sender_id, text):
+            await run_blocking(client.send_chat_presence, jid=chat, state=ChatPresence.CHAT_PRESENCE_PAUSED, media=ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT)
+            return
+
+        # Save the incoming message to the DB
+        await asyncio.to_thread(save_message, sender_id, text, timestamp, from_me)
+        log.debug(f"Saved incoming message for user {sender_id} at timestamp {timestamp}.")
+
+        # Process links (if any)
+        await handle_link_async(client, message, sender_id, sender_name, text)
+
+        # Process file attachments if present
+        if message.Info.Type == "media" and not message.Info.MediaType == "url":
+            text = await handle_file_async(client, message, text, sender_id)
+
+        return text
+
+    except Exception as e:
+        log.error(f"Error in prepare_message_async handler: {e}")
+        return None
+
+async def handle_link_async(client: NewClient, message: MessageEv, sender_id, sender_name, text):
+    """Async version of handle_link."""
+    links_found = re.findall(r'(https?://\S+)', text)
+    if not links_found:
+        return
+
+    if not SCRAPE_USER_LINKS:
+        log.info(f"Link scraping is disabled; skipping link processing for {sender_id}.")
+        return
+
+    link = links_found[0]
+    log.info(f"Link detected: {link}")
+
+    # Send the wait message after a random delay while the page is being scraped
+    async def send_wait_message():
+        wait_message = await generate_wait_message_async(user_text=text, user_id=sender_id)
+        send_at = send_scheduler.schedule(sender_id, time.time() + random.uniform(2, 5), client.reply_message, wait_message, message)
+        await asyncio.to_thread(save_message, sender_id, wait_message, int(send_at), True)
+        log.info(f"Scheduled wait message to {sender_name} for link processing: {wait_message}")
+
+    _, scraped_content = await asyncio.gather(send_wait_message(), scrape_text_async(link))
+    log.debug(f"Scraped content (first 200 chars): {scraped_content[:200]}...")
+    await asyncio.to_thread(session_store.add_item, sender_id, UserSessionContentItem(
+        type_="link",
+        source=link,
+        content=scraped_content
+    ))
+    log.info(f"Added scraped link content for {sender_id}.")
+
+async def handle_file_async(client: NewClient, message: MessageEv, user_text: str, sender_id: str):
+    """Async version of handle_file."""
+    log.info(f"Handling file attachment for user {sender_id}.")
+
+    if not DOWNLOAD_USER_FILES:
+        log.info(f"File downloading is disabled; skipping file handling for {sender_id}.")
+        return user_text
+
+    file_name = get_attachment_file_name(message)
+    if not file_name:
+        log.info("No file name found in the message; skipping file handling.")
+        return
+
+    log.info(f"File name detected: {file_name}")
+    chat = message.Info.MessageSource.Chat
+    file_path = f"./downloads/{file_name}"
+
+    try:
+        await run_blocking(client.download_any, message=message.Message, path=file_path)
+        log.info(f"Downloaded file: {file_name}")
+    except Exception as e:
+        log.error(f"Failed to download file: {e}")
+        send_scheduler.schedule(sender_id, time.time(), client.send_message, chat, await generate_error_message_async(user_text=user_text, user_id=sender_id))
+        return
+
+    file_extension = os.path.splitext(file_name)[1].lower()
+    if file_extension == ".jpeg":
+        submission_markdown = await describe_image_with_gpt_async(file_path)
+        item_type = "image"
+        await asyncio.to_thread(session_store.set_latest_image, sender_id, file_path)
+    elif file_extension == ".ogg":
+        return await transcribe_audio_with_whisper_async(file_path)  # Return early for audio files
+    else:
+        submission_markdown = await run_blocking(convert_document_to_markdown, file_path, file_extension)
+        item_type = "document"
+        if submission_markdown is None:
+            log.error(f"Unsupported file type: {file_extension}")
+            send_scheduler.schedule(sender_id, time.time(), client.send_message, chat, await generate_error_message_async(user_text=user_text, user_id=sender_id))
+            return
+
+    await asyncio.to_thread(add_file_to_session, sender_id, file_name, item_type, submission_markdown)
+    return user_text
+
+async def handle_commands_async(client: NewClient, chat: JID, sender_id: str, text: str):
+    """Async version of handle_commands."""
+    return await run_blocking(handle_commands, client, chat, sender_id, text)
+
+async def handle_final_response_async(client: NewClient, chat: JID, sender_id: str, text: str):
+    """Async version of handle_final_response."""
+    send_at = time.time() + random.uniform(2, 5)
+    session_items = await asyncio.to_thread(session_store.get_items, sender_id)
+    scraped_text = await asyncio.to_thread(session_retriever.build_context, sender_id, session_items, text)
+    scenario = SCENARIOS[SCENARIO]
+    if not SINGLE_ROUND_TRIP:
+        tool_usage_result = await process_llm_tools_async(text, scraped_text, client, chat, sender_id)
+        final_answer = await generate_final_response_async(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tool_usage_result=tool_usage_result)
+    elif classify_intent(text)[0].kind == NO_TOOL:
+        final_answer = await generate_final_response_async(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tool_usage_result="No tool calls needed.")
+    else:
+        ctx = ToolContext(client, chat, sender_id, text)
+        final_answer = await generate_response_with_tools_async(scenario.final_response_prompt, user_id=sender_id, scraped_text=scraped_text, user_text=text, tools=scenario.tools, run_tools=lambda tool_calls: execute_tool_calls_async(tool_calls, ctx))
+    log.debug(f"Final answer generated: {final_answer}")
+    send_at = send_scheduler.schedule(sender_id, send_at, client.send_message, to=chat, message=final_answer)
+    await asyncio.to_thread(save_message, user_id=sender_id, message_content=final_answer, timestamp=int(send_at), from_me=True)
+    conversation_summarizer.notify(sender_id)
+    log.info(f"Scheduled final response to {sender_id}.")
+
+async def process_llm_tools_async(user_message: str, scraped_text: str, client: NewClient, chat: JID, sender_id: str):
+    """Async version of process_llm_tools."""
+    decision, verify = classify_intent(user_message)
+    if decision.kind == NO_TOOL and not verify:
+        log.info(f"Intent classifier skipped the tool poll: {decision}")
+        return "No tool calls needed."
+    forced_tool = decision.tool if decision.kind == TOOL and not verify else None
+    hint_tool = decision.tool if decision.kind == ASK_LLM else None
+
+    previous_messages = await asyncio.to_thread(get_recent_messages_formatted, sender_id)
+    tool_calls = await poll_llm_for_tool_choice_async(user_message, previous_messages, scraped_text, SCENARIOS[SCENARIO].tools, forced_tool=forced_tool, hint_tool=hint_tool)
+    if forced_tool is None:
+        await asyncio.to_thread(intent_classifier.record_outcome, SCENARIOS[SCENARIO].name, user_message, decision, [tool_call.function.name for tool_call in tool_calls])
+
+    if not tool_calls:
+        log.info("No tool calls needed for user message.")
+        return "No tool calls needed."
+
+    return await run_tool_calls_async(tool_calls, ToolContext(client, chat, sender_id, user_message))
 
 # --- Main event handlers ---
 
 def on_history_sync(client: NewClient, history: HistorySyncEv):
     """
-    Processes historical messages from the sync data, storing them in the DB.
+    Queues historical messages from the sync data for a bulk import into the DB.
     The data structure is at `history.Data.conversations[...]`.
     """
     if SKIP_HISTORY_SYNC:
@@ -556,50 +661,83 @@ def on_history_sync(client: NewClient, history: HistorySyncEv):
 
     sync_type = getattr(history.Data, "syncType", None)
     log.info(f"Received history sync event with syncType: {sync_type}")
-    log.debug(f"Full history sync data: {history}")
 
     if not hasattr(history.Data, "conversations"):
         log.info("No conversations found in HistorySyncEv.")
         return
+    log.info(f"Queued {len(history.Data.conversations)} conversations from the history sync for import.")
+
+    # Imported on a background thread, so the event callback returns right away
+    history_importer.submit(history)
 
-    for conversation in history.Data.conversations:
-        user_id = conversation.ID.split('@')[0]  # e.g. phone number
-        log.debug(f"Processing conversation for user {user_id}")
-        for message_obj in conversation.messages:
-            message_data = message_obj.message
-            msg = message_data.message
-            from_me = getattr(message_data.key, "fromMe", False)
-            log.debug(f"Processing message (from_me={from_me}): {msg}")
-
-            # Extract text from different possible fields
-            if hasattr(msg, "conversation") and msg.conversation:
-                message_content = msg.conversation
-            elif (hasattr(msg, "extendedTextMessage") and msg.extendedTextMessage.text):
-                message_content = msg.extendedTextMessage.text
-            else:
-                log.debug("Message is not a text message; skipping.")
-                continue
-
-            timestamp = message_obj.message.messageTimestamp
-            log.debug(f"Saving message with timestamp {timestamp} for user {user_id}")
-            save_message(user_id, message_content, timestamp, from_me)
+# Rate limiting for busy replies: user_id -> time of the last busy reply
+busy_reply_timestamps = {}
+
+def send_busy_reply(client: NewClient, message: MessageEv):
+    """Sends the precomputed busy reply, at most once per BUSY_REPLY_INTERVAL per chat."""
+    source = message.Info.MessageSource
+    if source.IsFromMe or source.IsGroup:
+        return
+    now = time.time()
+    if now - busy_reply_timestamps.get(source.Chat.User, 0) < BUSY_REPLY_INTERVAL:
+        return
+    busy_reply_timestamps[source.Chat.User] = now
+    try:
+        busy_message = phrase_cache.get("busy", detect_language(get_message_text(message))) or BUSY_MESSAGE
+        send_scheduler.schedule(source.Chat.User, time.time(), client.send_message, source.Chat, busy_message)
+        metrics.inc("intake.busy_replies")
+    except Exception as e:
+        log.error(f"Failed to send busy reply to {source.Chat.User}: {e}")
+
+def dispatch_messages(sender_id: str, items: list):
+    """Queues a batch of (client, message) pairs from one chat as a single turn."""
+    client = items[0][0]
+    messages = [message for _, message in items]
+    priority = PRIORITY_COMMAND if is_command(get_message_text(messages[0])) else PRIORITY_MESSAGE
+    deadline = messages[-1].Info.Timestamp // 1000 + MESSAGE_MAX_AGE
+    if not message_dispatcher.submit(sender_id, client, messages, priority=priority, deadline=deadline):
+        log.warning(f"Message queue saturated; shedding {len(messages)} message(s) from {sender_id}.")
+        send_busy_reply(client, messages[-1])
 
 def on_message(client: NewClient, message: MessageEv):
     """
-    Enqueue incoming messages for sequential processing.
+    Hand incoming messages to the dispatcher, keyed by their chat.
+    Rapid consecutive messages are coalesced into one turn by the debouncer, while
+    commands skip it and are queued ahead of other chats' LLM turns, right after the
+    chat's own pending messages. Messages that would be older
+    than MESSAGE_MAX_AGE by the time they are reached are dropped without processing.
     """
-    message_queue.put((client, message))
     fileLogger.log(f"[NEW_MESSAGE] {message}")
+    try:
+        message_journal.append_message(message)
+    except Exception as e:
+        log.error(f"Failed to journal message {message.Info.ID}: {e}")
+    sender_id = message.Info.MessageSource.Chat.User
+    if DEBOUNCE_WINDOW <= 0:
+        dispatch_messages(sender_id, [(client, message)])
+    elif is_command(get_message_text(message)):
+        # Messages sent before the command are answered before it runs
+        message_debouncer.flush_now(sender_id)
+        dispatch_messages(sender_id, [(client, message)])
+    else:
+        message_debouncer.add(sender_id, (client, message))
 
-# Start the message worker thread
-def message_worker():
-    while True:
-        client, message = message_queue.get()
-        try:
-            process_message(client, message)
-        except Exception as e:
-            log.error(f"Error processing message: {e}")
-        finally:
-            message_queue.task_done()
+# Start the message dispatcher. Messages from one chat are always processed in
+# order, while other chats are processed in parallel.
+if EXECUTION_MODE == "async":
+    message_dispatcher = AsyncPipeline(process_messages_async, ASYNC_MAX_CONCURRENCY, INTAKE_QUEUE_SIZE)
+else:
+    message_dispatcher = ShardedWorkerPool(process_messages, MESSAGE_WORKERS, INTAKE_QUEUE_SIZE)
+message_dispatcher.start()
+
+message_debouncer = MessageDebouncer(dispatch_messages, DEBOUNCE_WINDOW, DEBOUNCE_MAX_WAIT, DEBOUNCE_MAX_MESSAGES)
+message_debouncer.start()
+
+# Replies are sent on their own thread after their humanization delay
+send_scheduler.start()
+
+# Older messages are folded into rolling summaries in the background
+conversation_summarizer.start()
 
-threading.Thread(target=message_worker, daemon=True).start()
+# History syncs are imported in bulk in the background
+history_importer.start()
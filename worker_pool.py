@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+import zlib
+from intake_queue import IntakeQueue, PRIORITY_MESSAGE
+from metrics import metrics
+
+class ShardedWorkerPool:
+    """
+    Fixed pool of worker threads, each draining its own bounded queue (shard).
+    Items are routed to a shard by hashing a key, so items with the same key
+    are handled in order by one worker, commands included, while different keys
+    run in parallel.
+    """
+    def __init__(self, handler, num_workers, max_pending, name="message_worker"):
+        self.handler = handler
+        self.name = name
+        num_workers = max(1, num_workers)
+        shard_size = max(1, max_pending // num_workers)
+        self.shards = [IntakeQueue(shard_size, f"{name}.shard.{index}") for index in range(num_workers)]
+        # Moving average of handler run time per shard, used to predict queue wait
+        self._service_times = [0.0] * num_workers
+        self._threads = []
+
+    def shard_for(self, key: str) -> int:
+        # crc32 is stable across restarts, unlike hash() on str
+        return zlib.crc32(key.encode("utf-8")) % len(self.shards)
+
+    def submit(self, key: str, *args, priority=PRIORITY_MESSAGE, deadline=None):
+        """
+        Queue `handler(*args)` on the shard owning `key`.
+        Returns False if the item was shed because the shard is full or the item
+        would pass its deadline before a worker could reach it.
+        """
+        index = self.shard_for(key)
+        shard = self.shards[index]
+        if deadline is not None and priority == PRIORITY_MESSAGE:
+            expected_wait = shard.qsize() * self._service_times[index]
+            if time.time() + expected_wait > deadline:
+                metrics.inc(f"{shard.name}.dropped.predicted_stale")
+                return False
+        return shard.put(args, priority=priority, deadline=deadline, key=key)
+
+    def start(self):
+        for index in range(len(self.shards)):
+            thread = threading.Thread(
+                target=self._run,
+                args=(index,),
+                name=f"{self.name}-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Started {len(self.shards)} {self.name} threads.")
+
+    def _run(self, index: int):
+        shard = self.shards[index]
+        while True:
+            enqueued_at, args = shard.get()
+            started_at = time.monotonic()
+            metrics.observe(f"{shard.name}.wait", started_at - enqueued_at)
+            try:
+                self.handler(*args)
+            except Exception as e:
+                logging.error(f"Error in {self.name}-{index}: {e}")
+            finally:
+                elapsed = time.monotonic() - started_at
+                self._service_times[index] = 0.8 * self._service_times[index] + 0.2 * elapsed
+
+    def stats(self):
+        """Return the current queue depth of every shard."""
+        return {index: shard.qsize() for index, shard in enumerate(self.shards)}